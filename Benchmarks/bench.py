@@ -0,0 +1,268 @@
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import engine
+import static
+from renderer import FrameSink
+from worldgen import generateWorld, inventoryItems, DEFAULTS
+
+WORLD_NAME = "BenchWorld"
+
+# --------------------------------------
+# MEASURING
+# --------------------------------------
+def measure(func, repeat: int, setup=None, warmup: int = 3) -> list[int]:
+    """Times func, repeat times
+
+    Args:
+        func (Callable): What to time
+        repeat (int): Amount of runs
+        setup (Callable, optional): Runs before every run, it isn't timed. Defaults to None.
+        warmup (int, optional): Runs before the timed runs, so caches are filled. Defaults to 3.
+
+    Returns:
+        list[int]: Nanoseconds every run took
+    """
+
+    samples = []
+    for run in range(warmup + repeat):
+        if setup: setup()
+
+        gc.disable() # Like timeit, so a collection caused by an earlier run isn't counted
+        try:
+            start = time.perf_counter_ns()
+            func()
+            end = time.perf_counter_ns()
+        finally:
+            gc.enable()
+
+        if run >= warmup: samples.append(end - start)
+
+    return samples
+
+def summarize(samples: list[int]) -> dict:
+    """Turns samples into microsecond statistics"""
+
+    samples = sorted(samples)
+
+    return {
+        "runs": len(samples),
+        "min_us": samples[0] / 1000,
+        "median_us": statistics.median(samples) / 1000,
+        "mean_us": statistics.fmean(samples) / 1000,
+        "p95_us": samples[min(len(samples) - 1, int(len(samples) * 0.95))] / 1000
+    }
+
+def newEngine(search_dir: str, load_save: bool = False) -> engine.PSEngine:
+    """A headless engine, so the terminal doesn't affect timings"""
+
+    prompts = dict(static.PROMPT_ANSWERS_HEADLESS, load_save="y" if load_save else "n")
+    return engine.PSEngine(search_dir, renderer=FrameSink(120, 60), prompts=prompts, _debug_flags_skipsplash=True)
+
+# --------------------------------------
+# SUITE
+# --------------------------------------
+def runSuite(search_dir: str, params: dict, repeat: int) -> dict:
+    """Runs every benchmark on the generated world in search_dir
+
+    Returns:
+        dict: Benchmark name -> statistics from summarize
+    """
+
+    world_dir = os.path.join(search_dir, WORLD_NAME)
+    load_repeat = max(3, repeat // 20)
+    results = {}
+
+    # Keep the world cache with the world, instead of next to the engine
+    cache_dir = os.path.join(search_dir, static.WORLD_CACHE_DIR)
+    engine.WORLD_CACHE_DIR = cache_dir
+
+    def forgetWorld():
+        if os.path.exists(os.path.join(world_dir, static.ROOM_MANIFEST_FILE)): os.remove(os.path.join(world_dir, static.ROOM_MANIFEST_FILE))
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    def loadWorld(load_all):
+        def run():
+            eng = newEngine(search_dir)
+            eng.loadWorld(WORLD_NAME)
+            if load_all: eng.loadAllRooms()
+
+        return run
+
+    # Loading, cold is without the manifest and the world cache
+    results["load_world_cold"] = summarize(measure(loadWorld(False), load_repeat, forgetWorld, warmup=0))
+    results["load_all_rooms_cold"] = summarize(measure(loadWorld(True), load_repeat, forgetWorld, warmup=0))
+    results["load_world_warm"] = summarize(measure(loadWorld(False), load_repeat, warmup=1))
+    results["load_all_rooms_warm"] = summarize(measure(loadWorld(True), load_repeat, warmup=1))
+
+    eng = newEngine(search_dir)
+    eng._DF_neverload = True
+    eng.loadWorld(WORLD_NAME)
+    eng.changeRoom("room_0")
+    eng.spawnPlayerAtRoot()
+    eng.render()
+
+    # Rendering and movement
+    results["render"] = summarize(measure(eng.render, repeat))
+
+    def moveBack():
+        eng.player.coords = [1, 1]
+
+    results["move"] = summarize(measure(eng.player.moveRight, repeat, moveBack))
+
+    # Builtin actions, the entity is reset before every run so every run does the same work
+    room = eng.current_room
+    chest = next(entity for entity in room.entities if entity.type == "chest")
+    door = next(entity for entity in room.entities if entity.type == "door")
+    item = next(entity for entity in room.entities if entity.type == "item")
+    contents = list(chest.properties.contents)
+
+    def on(entity, **properties):
+        def setup():
+            eng.changeRoom(room)
+            eng.player.coords = list(entity.coords)
+            eng.player.inventory = inventoryItems(params["inventory"])
+            entity.properties.update(properties)
+            entity.visible = True
+
+            if entity is chest: chest.properties.contents = list(contents)
+
+        return setup
+
+    def action(name):
+        return lambda: eng.player.doAction(name)
+
+    results["action_inspect"] = summarize(measure(action("inspect"), repeat, on(chest)))
+    results["action_chest_open"] = summarize(measure(action("open"), repeat, on(chest, locked=False, open=False)))
+    results["action_door_open"] = summarize(measure(action("open"), repeat, on(door, locked=False, open=False)))
+    results["action_close"] = summarize(measure(action("close"), repeat, on(chest, locked=False, open=True)))
+    results["action_lock"] = summarize(measure(action("lock"), repeat, on(chest, locked=False, open=False)))
+    results["action_unlock"] = summarize(measure(action("unlock"), repeat, on(chest, locked=True, open=False)))
+    results["action_gather"] = summarize(measure(action("gather"), repeat, on(chest, locked=False, open=True)))
+    results["action_pickup"] = summarize(measure(action("pickup"), repeat, on(item)))
+    results["action_nested_script"] = summarize(measure(action("nest"), repeat, on(chest)))
+
+    # Room transitions through builtin/leave
+    def atExit(exit_id):
+        def setup():
+            eng.changeRoom(room)
+            eng.player.coords = list(eng.findEntityByID(room, exit_id).coords)
+
+        return setup
+
+    results["leave_forced"] = summarize(measure(action("leave"), repeat, atExit("fwd")))
+    results["leave_random"] = summarize(measure(action("leave"), repeat, atExit("rand")))
+
+    # Saving and loading
+    def dirty():
+        eng.changeRoom(room)
+        eng.player.coords = [1, 1]
+        eng.player.moveRight()
+        chest.properties.open = not chest.properties.open
+        eng.markDirty(room)
+
+    eng.saveGame(full=True)
+    results["save_incremental"] = summarize(measure(eng.saveGame, repeat, dirty))
+    results["save_full"] = summarize(measure(lambda: eng.saveGame(full=True), load_repeat, dirty, warmup=1))
+
+    def loadGame():
+        loaded = newEngine(search_dir, load_save=True)
+        loaded.world_dir = world_dir
+        loaded.loadGame()
+
+    results["load_game"] = summarize(measure(loadGame, load_repeat, warmup=1))
+
+    return results
+
+# --------------------------------------
+# BASELINES
+# --------------------------------------
+def compare(report: dict, baseline: dict, threshold: float, metric: str = "min_us") -> list[str]:
+    """Prints how every benchmark changed compared to a baseline report
+
+    Args:
+        report (dict): The new report
+        baseline (dict): The baseline report
+        threshold (float): How much slower a benchmark can get
+        metric (str, optional): Statistic to compare. The minimum is the least affected by other programs. Defaults to "min_us".
+
+    Returns:
+        list[str]: Benchmarks that got slower by more than threshold (0.2 is 20%)
+    """
+
+    if baseline.get("params", None) != report["params"]:
+        print("Warning: the baseline was run on a world generated with other parameters")
+
+    regressions = []
+    print(f"{'benchmark':<24}{'baseline':>14}{'now':>14}{'change':>10}")
+
+    for name, result in report["results"].items():
+        if name not in baseline["results"]: continue
+
+        before = baseline["results"][name][metric]
+        now = result[metric]
+        change = now / before - 1 if before else 0.0
+
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+
+        print(f"{name:<24}{before:>12.1f}us{now:>12.1f}us{change:>+10.1%}{flag}")
+
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the engine on a synthetic world")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against the results in this JSON file, exits with 1 if something got slower")
+    parser.add_argument("--threshold", type=float, default=0.2, help="How much slower a benchmark can get before it counts as a regression (default: 0.2, which is 20%%)")
+    parser.add_argument("--metric", default="min_us", choices=["min_us", "median_us", "mean_us", "p95_us"], help="Statistic to compare against the baseline (default: min_us)")
+    parser.add_argument("--repeat", type=int, default=200, help="Runs of every benchmark, loading is run repeat / 20 times (default: 200)")
+    parser.add_argument("--keep-world", help="Generate the world into this folder and keep it, instead of a temporary folder")
+    for name, value in DEFAULTS.items():
+        parser.add_argument("--" + name.replace("_", "-"), type=int, default=value)
+
+    args = vars(parser.parse_args())
+    params = {name: args[name] for name in DEFAULTS}
+
+    search_dir = args["keep_world"] or tempfile.mkdtemp(prefix="pse-bench-")
+    try:
+        generateWorld(os.path.join(search_dir, WORLD_NAME), **params)
+        results = runSuite(search_dir, params, args["repeat"])
+    finally:
+        if not args["keep_world"]: shutil.rmtree(search_dir, ignore_errors=True)
+
+    report = {
+        "engine_version": static.VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": int(time.time()),
+        "params": params,
+        "repeat": args["repeat"],
+        "results": results
+    }
+
+    if args["output"]:
+        with open(args["output"], "w") as f:
+            json.dump(report, f, indent=4)
+
+    if args["baseline"]:
+        with open(args["baseline"], "r") as f:
+            regressions = compare(report, json.load(f), args["threshold"], args["metric"])
+
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) got slower: {', '.join(regressions)}")
+            sys.exit(1)
+    else:
+        print(json.dumps(report, indent=4))
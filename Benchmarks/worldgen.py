@@ -0,0 +1,181 @@
+import os
+import json
+import random
+import argparse
+import yaml
+
+# --------------------------------------
+# SYNTHETIC WORLDS
+# --------------------------------------
+# Every room is a rectangle with a root spawn point, a spawn point for the "rand" exit, two exits and a mix of chests,
+# items and doors. The "fwd" exit always leads to the next room, the "rand" exit picks one of a few rooms by weight.
+# Every chest and door is locked with the "bench" key, and every chest has a "nest" action running the nested ifs.
+
+DEFAULTS = {
+    "rooms": 50,
+    "width": 30,
+    "height": 12,
+    "entities": 20,
+    "inventory": 20,
+    "generator_depth": 4,
+    "script_depth": 4,
+    "seed": 0
+}
+
+KEY = {"id": "key", "name": "Bench Key", "uid": None, "lock_id": "bench"}
+
+class WorldDumper(yaml.SafeDumper):
+    """Writes layouts as block strings, like hand written rooms"""
+
+def representString(dumper, text):
+    return dumper.represent_scalar("tag:yaml.org,2002:str", text, style="|" if "\n" in text else None)
+
+WorldDumper.add_representer(str, representString)
+
+def generateWorld(path: str, rooms: int = 50, width: int = 30, height: int = 12, entities: int = 20, inventory: int = 20, generator_depth: int = 4, script_depth: int = 4, seed: int = 0) -> dict:
+    """Writes a synthetic world folder
+
+    Args:
+        path (str): The world folder. It is created if it doesn't exist
+        rooms (int, optional): Amount of rooms. Defaults to 50.
+        width (int, optional): Inside width of every room. Defaults to 30.
+        height (int, optional): Inside height of every room. Defaults to 12.
+        entities (int, optional): Chests, items and doors in every room. Defaults to 20.
+        inventory (int, optional): Items in every chest, and in the inventory the benchmark gives the player. Defaults to 20.
+        generator_depth (int, optional): Generators every room has. Leaving through "fwd" looks through all of them. Defaults to 4.
+        script_depth (int, optional): How deep the ifs of the "nest" action are nested. Defaults to 4.
+        seed (int, optional): Seed for the placement of entities. Defaults to 0.
+
+    Returns:
+        dict: The parameters the world was generated with
+    """
+
+    params = {"rooms": rooms, "width": width, "height": height, "entities": entities, "inventory": inventory, "generator_depth": generator_depth, "script_depth": script_depth, "seed": seed}
+    rng = random.Random(seed)
+
+    os.makedirs(os.path.join(path, "actions"), exist_ok=True)
+
+    # Entities go on free tiles, the first row is kept free for spawn points and exits
+    free_tiles = [(x, y) for y in range(2, height + 1) for x in range(1, width + 1)]
+    if entities > len(free_tiles): raise ValueError(f"{entities} entities don't fit into a {width}x{height} room.")
+
+    layout = "+" + "-" * width + "+\n"
+    layout += ("|" + " " * width + "|\n") * height
+    layout += "+" + "-" * width + "+\n"
+
+    for idx in range(rooms):
+        room = {
+            "id": f"room_{idx}",
+            "name": f"Room {idx}",
+            "layout": layout,
+            "entities": [
+                {"type": "spawn_point", "linked_exit": None, "coords": [1, 1], "visible": False},
+                {"type": "spawn_point", "linked_exit": "rand", "coords": [2, 1], "visible": False},
+                {"type": "exit", "id": "fwd", "coords": [3, 1], "visible": True, "actions": {"action_map": "builtin/exit"}},
+                {"type": "exit", "id": "rand", "coords": [4, 1], "visible": True, "actions": {"action_map": "builtin/exit"}}
+            ],
+            "generators": []
+        }
+
+        for entity_idx, coords in enumerate(rng.sample(free_tiles, entities)):
+            room["entities"].append(__entity(entity_idx % 3, list(coords), idx, entity_idx, inventory))
+
+        # Generators that never match, so leaving has to look through all of them
+        for depth in range(generator_depth - 2):
+            room["generators"].append({"exit": f"unused_{depth}", "type": "forced", "room": f"room_{idx}"})
+
+        if generator_depth > 1:
+            pool = [{"room": f"room_{rng.randrange(rooms)}", "weight": rng.randint(1, 5)} for _ in range(4)]
+            room["generators"].append({"exit": "rand", "type": "random", "pool": pool})
+
+        room["generators"].append({"exit": None, "type": "forced", "room": f"room_{(idx + 1) % rooms}"})
+
+        with open(os.path.join(path, f"room_{idx}.yaml"), "w") as f:
+            yaml.dump(room, f, Dumper=WorldDumper, sort_keys=False)
+
+    with open(os.path.join(path, "actions", "bench.yaml"), "w") as f:
+        yaml.dump({"nest": __nestedScript(script_depth)}, f, Dumper=WorldDumper, sort_keys=False)
+
+    with open(os.path.join(path, "flags.json"), "w") as f:
+        json.dump({"loop_found_val": None, "nest_count": 0}, f)
+
+    with open(os.path.join(path, "benchmark.json"), "w") as f:
+        json.dump(params, f, indent=4)
+
+    return params
+
+def inventoryItems(inventory: int) -> list:
+    """Returns the inventory the benchmark gives the player, with the key last so looking for it goes through every item"""
+
+    return [{"id": f"item_{idx}", "name": f"Item {idx}", "uid": None} for idx in range(inventory)] + [dict(KEY)]
+
+def __entity(kind, coords, room_idx, entity_idx, inventory):
+    if kind == 0:
+        return {
+            "type": "chest",
+            "coords": coords,
+            "visible": True,
+            "properties": {
+                "inspect_text": f"Chest {entity_idx} in room {room_idx}",
+                "open": False,
+                "locked": True,
+                "can_lock": True,
+                "key_id": "bench",
+                "contents": [{"id": f"loot_{idx}", "name": f"Loot {idx}"} for idx in range(inventory)]
+            },
+            "actions": {"action_map": "builtin/chest", "nest": "bench/nest"}
+        }
+
+    if kind == 1:
+        return {
+            "type": "item",
+            "coords": coords,
+            "visible": True,
+            "properties": {
+                "inspect_text": f"Item {entity_idx} in room {room_idx}",
+                "data": {"id": f"thing_{entity_idx}", "name": f"Thing {entity_idx}", "uid": None}
+            },
+            "actions": {"action_map": "builtin/item"}
+        }
+
+    return {
+        "type": "door",
+        "coords": coords,
+        "visible": True,
+        "properties": {
+            "inspect_text": f"Door {entity_idx} in room {room_idx}",
+            "locked": True,
+            "key_id": "bench",
+            "can_lock": True,
+            "open": False
+        },
+        "actions": {"action_map": "builtin/door"}
+    }
+
+def __nestedScript(depth):
+    """A for over the chest contents, with depth ifs nested inside of it"""
+
+    block = {"set": {"field": "flags.nest_count", "value_template": "current_item.name"}}
+
+    for level in range(depth):
+        block = {
+            f"if#level{level}": {
+                "a": "current_item.id",
+                "op": "=!",
+                "b": f"STR:missing_{level}",
+                "exec": block
+            }
+        }
+
+    return {"for": {"iter": "current_entity.properties.contents", "exec": block}}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates a synthetic world for benchmarking")
+    parser.add_argument("path", help="World folder to write")
+    for name, value in DEFAULTS.items():
+        parser.add_argument("--" + name.replace("_", "-"), type=int, default=value)
+
+    args = vars(parser.parse_args())
+    path = args.pop("path")
+
+    print(json.dumps(generateWorld(path, **args), indent=4))
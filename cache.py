@@ -0,0 +1,107 @@
+import os
+import sys
+import hashlib
+import pickle
+from static import VERSION
+
+# --------------------------------------
+# WORLD CACHE
+# --------------------------------------
+# Parsed world files are pickled, so the cache must never be read from somewhere a world can write to. It is kept next to
+# the engine, not in the world folder, otherwise a downloaded world could ship a cache that runs code when it's loaded.
+
+CACHE_FORMAT = 5 # Increase when the layout of cached values changes
+
+def hashBytes(data: bytes) -> str:
+    """Returns the digest used to check if a cache entry is still valid"""
+
+    return hashlib.sha256(data).hexdigest()
+
+class WorldCache:
+    def __init__(self, cache_dir: str, world_dir: str):
+        """Parsed files of a single world, stored between runs. Every entry is keyed by the file it was parsed from, and is only used while the digest of that file (and anything else it depends on) still matches
+
+        Args:
+            cache_dir (str): Folder to keep the cache files in
+            world_dir (str): The world folder
+        """
+
+        self.world_dir = world_dir
+        self.path = os.path.join(cache_dir, hashBytes(os.path.abspath(world_dir).encode())[:16] + ".pickle")
+        self.entries = {} # File path relative to the world folder -> (digest, pickled value)
+        self.changed = False
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+
+    def load(self) -> None:
+        """Reads the whole cache in one go. A cache from another engine or python version is ignored"""
+
+        try:
+            with open(self.path, "rb") as f:
+                header, entries = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError, TypeError):
+            return
+
+        if header != self.__header(): return
+
+        self.entries = entries
+
+    def get(self, key: str, digest) -> any:
+        """Returns a cached value, or None if the entry is missing or out of date
+
+        Args:
+            key (str): File path relative to the world folder
+            digest (any): Digest of everything the value was built from
+        """
+
+        entry = self.entries.get(key, None)
+        if entry is None or entry[0] != digest:
+            self.misses += 1
+            return None
+
+        try:
+            value = pickle.loads(entry[1]) # Every caller gets its own copy
+        except (pickle.UnpicklingError, AttributeError, ImportError, TypeError, EOFError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return value
+
+    def isValid(self, key: str, digest) -> bool:
+        """Checks if an entry exists and is up to date, without loading it"""
+
+        entry = self.entries.get(key, None)
+        return entry is not None and entry[0] == digest
+
+    def put(self, key: str, digest, value) -> None:
+        """Stores a value. It is pickled right away, so changing the value afterwards doesn't change the cache"""
+
+        self.entries[key] = (digest, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        self.changed = True
+
+    def flush(self) -> None:
+        """Writes the cache if anything changed, dropping entries of files that no longer exist"""
+
+        if not self.changed: return
+
+        for key in list(self.entries):
+            if key.startswith("<"): continue # Not from the world folder
+            if not os.path.exists(os.path.join(self.world_dir, key)): del self.entries[key]
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+            with open(self.path + ".tmp", "wb") as f:
+                pickle.dump((self.__header(), self.entries), f, pickle.HIGHEST_PROTOCOL)
+
+            os.replace(self.path + ".tmp", self.path)
+        except OSError: # Engine folder isn't writable, parse again next time
+            return
+
+        self.changed = False
+
+    def __header(self):
+        return (CACHE_FORMAT, VERSION, sys.version_info[:2])
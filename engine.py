@@ -1,14 +1,29 @@
 import yaml
 import os
 from static import *
+from renderer import TerminalRenderer, writeText
+from inputs import TerminalInput
+from instrumentation import Instrumentation, Profiler
+from hooks import HookRegistry
+from gameloop import Scheduler
+from models import Model, Room, Entity, ActionTable, toRoom, toItems, jsonDefault
+from rng import WeightedPool, RandomStreams
 from copy import deepcopy as dc
-import io
 import time
-import contextlib
 import json
 import importlib.util
-import random
+import functools
+import operator
+import atexit
+import contextlib
+import multiprocessing
+from cache import WorldCache, hashBytes
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from typing import Callable
+from types import MappingProxyType
+
+if os.name == "nt": import msvcrt
+else: import fcntl
 
 # --------------------------------------
 # EXCEPTIONS
@@ -53,77 +68,403 @@ class SpawnNotFoundException(Exception):
     def __init__(self, *args):
         super().__init__(*args)
 
+class InvalidPromptAnswerException(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+# These end the game. They are SystemExit, so the program still exits unless they are caught
+class GameQuitException(SystemExit):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+class PlayerDiedException(SystemExit):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+class ScriptsDeclinedException(SystemExit):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+# --------------------------------------
+# SCRIPT OPCODES
+# --------------------------------------
+# Control flow opcodes are handled by the script engine itself, the rest are dispatched to their action handler
+OP_IF = 0
+OP_ELSE = 1
+OP_FOR = 2
+OP_NEXT = 3 # End of a for body, jumps back to the start of the body
+OP_BREAK = 4
+OP_RAISE = 5
+OP_DISPLAY_TEXT = 6
+OP_SHOW_CONTENT = 7
+OP_SET = 8
+OP_ADD = 9
+OP_REMOVE = 10
+OP_PY = 11
+OP_CHANGE_ROOM = 12
+OP_RANDOM = 13
+OP_SPAWN_PLAYER = 14
+OP_DAMAGE_PLAYER = 15
+OP_HEAL_PLAYER = 16
+OP_SCHEDULE = 17
+
+OPCODES = {
+    "if": OP_IF,
+    "else": OP_ELSE,
+    "for": OP_FOR,
+    "break": OP_BREAK,
+    "raise": OP_RAISE,
+    "display_text": OP_DISPLAY_TEXT,
+    "show_content": OP_SHOW_CONTENT,
+    "set": OP_SET,
+    "add": OP_ADD,
+    "remove": OP_REMOVE,
+    "py": OP_PY,
+    "change_room": OP_CHANGE_ROOM,
+    "random": OP_RANDOM,
+    "spawn_player": OP_SPAWN_PLAYER,
+    "damage_player": OP_DAMAGE_PLAYER,
+    "heal_player": OP_HEAL_PLAYER,
+    "schedule": OP_SCHEDULE
+}
+
+OPCODE_NAMES = {op: name for name, op in OPCODES.items()} | {OP_NEXT: "next"} # Timer names, see PSEngine.enableInstrumentation
+NO_TIMER = contextlib.nullcontext() # Used instead of a timer while instrumentation is disabled
+LOOP_END = object() # Returned by next() when a for loop has no items left
+
+class LoopFrame:
+    __slots__ = ("items", "index", "copied", "broken", "root", "room")
+
+    def __init__(self, items: list, root: str = None, room: dict = None):
+        """A running for loop. It goes through the list it was given by index, so every iteration is O(1).
+        The list is only copied if something changes it while the loop runs, see detach.
+        Items are the objects themselves, root and room say what changes when current_item does"""
+
+        self.items = items
+        self.index = 0
+        self.copied = False
+        self.broken = False # break was called, the loop ends after the current iteration
+        self.root = root # "flags", "player", "room", or "rooms" if the items are rooms
+        self.room = room # The room the items are in, for "room"
+
+    def next(self) -> any:
+        """Returns the next item, or LOOP_END"""
+
+        if self.index >= len(self.items): return LOOP_END
+
+        item = self.items[self.index]
+        self.index += 1
+        return item
+
+    def detach(self) -> None:
+        """Copies the items that are left, call it before the list changes so the loop still sees the list it started with"""
+
+        if self.copied: return
+
+        self.items = self.items[self.index:]
+        self.index = 0
+        self.copied = True
+
+# --------------------------------------
+# TEMPLATES
+# --------------------------------------
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compileTemplate(template: str, skip_last: int = 0) -> tuple:
+    """Compiles a template into an accessor chain. Results are cached, so every distinct template is only parsed once
+
+    Args:
+        template (str): The template
+        skip_last (int, optional): How many of the last fields to leave out. Use 1 to get the parent and the key to assign to. Defaults to 0.
+
+    Returns:
+        tuple: (steps, last, ends). Steps are keys to index with, a tuple step is a (param, value) search. Last is the last field of the template. Ends is the amount of steps at the end of each field
+    """
+
+    items = template.split(".")
+    end = len(items) if skip_last == 0 else -skip_last
+
+    steps = []
+    ends = []
+    for item in items[:end]:
+        if "[" in item:
+            start = item.index("[")
+            extracted = item[start + 1:-1]
+            steps.append(item[:start])
+
+            if extracted.isnumeric():
+                # Get item at index
+                steps.append(int(extracted))
+            else:
+                # Get item with parameter
+                param, value = extracted.split(":")
+                steps.append((param, value))
+        else:
+            steps.append(item)
+
+        ends.append(len(steps))
+
+    return tuple(steps), items[-1], tuple(ends)
+
+# --------------------------------------
+# YAML
+# --------------------------------------
+YAML_LOADER = getattr(yaml, "CFullLoader", yaml.FullLoader) # The libyaml loader is a lot faster, but not every PyYAML install has it
+
+def loadYaml(data: str | bytes) -> any:
+    """Parses yaml the same way as yaml.full_load, using libyaml if it is available"""
+
+    return yaml.load(data, Loader=YAML_LOADER)
+
+def parseRoomFile(path: str) -> tuple:
+    """Reads and parses a room file. Runs in worker processes when rooms are parsed in parallel
+
+    Returns:
+        tuple: (room, digest of the file, seconds spent parsing)
+    """
+
+    with open(path, "rb") as f:
+        data = f.read()
+
+    start = time.perf_counter()
+    room = toRoom(loadYaml(data))
+
+    return room, hashBytes(data), time.perf_counter() - start
+
 # --------------------------------------
 # MAIN
 # --------------------------------------
+class RoomManifest:
+    def __init__(self, world_dir: str):
+        """Which file every room of a world is in, so rooms can be loaded when they are first needed. Cached in the world folder and refreshed when a room file changes"""
+
+        self.world_dir = world_dir
+        self.path = os.path.join(world_dir, ROOM_MANIFEST_FILE)
+        self.files = {} # File name -> {"mtime", "size", "id"}, in load order
+
+    def refresh(self) -> None:
+        """Brings the manifest up to date with the room files, only reading files that changed since it was saved"""
+
+        try:
+            with open(self.path, "r") as f:
+                cached = json.load(f).get("files", {})
+        except (FileNotFoundError, json.JSONDecodeError):
+            cached = {}
+
+        changed = False
+        self.files = {}
+        for file in os.listdir(self.world_dir):
+            path = os.path.join(self.world_dir, file)
+
+            if not file.endswith(".yaml"): continue
+            if not os.path.isfile(path): continue
+
+            stat = os.stat(path)
+            entry = cached.get(file, None)
+
+            if entry == None or entry["mtime"] != stat.st_mtime_ns or entry["size"] != stat.st_size:
+                entry = {"mtime": stat.st_mtime_ns, "size": stat.st_size, "id": self.__scanID(path)}
+                changed = True
+
+            self.files[file] = entry
+
+        if not changed and len(cached) == len(self.files): return
+
+        try:
+            with open(self.path + ".tmp", "w") as f:
+                json.dump({"version": VERSION, "files": self.files}, f, indent=4)
+
+            os.replace(self.path + ".tmp", self.path)
+        except OSError: # Read only world, the manifest is rebuilt next time
+            pass
+
+    def __scanID(self, path):
+        """Reads the id of the room in a file. Only the top level id line is parsed, unless the file is written in a way that hides it"""
+
+        with open(path, "r") as f:
+            for line in f:
+                if line.startswith("id:"): return loadYaml(line)["id"]
+
+        with open(path, "r") as f:
+            room = loadYaml(f)
+
+        return room.get("id", None) if type(room) == dict else None
+
+class RoomIndex:
+    def __init__(self, room):
+        """Lookup tables for a single room. Built by the engine, use PSEngine.findEntityByCoords instead of reading this directly"""
+
+        self.room = room
+        self.generation = None
+        self.entities = None
+        self.entity_count = 0
+        self.coords = {}
+        self.params = {} # param -> {value: first entity with that value}
+
+        self.layout = None
+        self.tiles_key = None
+        self.rows = ()
+        self.width = 0
+        self.height = 0
+        self.passable = bytearray()
+
+    def isStale(self, generation: int) -> bool:
+        """Has the room changed since the index was built"""
+
+        if self.generation != generation: return True
+        if self.room.entities is not self.entities: return True
+        if self.entities is not None and len(self.entities) != self.entity_count: return True
+
+        return False
+
+    def rebuild(self, generation: int, indexed_params: set):
+        """Rebuilds the coords -> entities table and the parameter tables. Stacked entities are kept in the same order as in the room"""
+
+        self.coords = {}
+        self.params = {param: {} for param in indexed_params}
+        self.entities = self.room.entities
+        self.entity_count = len(self.entities) if self.entities is not None else 0
+        self.generation = generation
+
+        for entity in self.entities or []:
+            for param, table in self.params.items():
+                if param not in entity: continue
+
+                try:
+                    table.setdefault(entity[param], entity)
+                except TypeError: # Unhashable values can never be looked up
+                    pass
+
+            coords = entity.get("coords", None)
+            if coords is None: continue
+
+            self.coords.setdefault(tuple(coords), []).append(entity)
+
+    def isGridStale(self, tiles_key) -> bool:
+        """Has the layout or the set of blocking tiles changed since the grid was built"""
+
+        return self.room.layout is not self.layout or self.tiles_key is not tiles_key
+
+    def rebuildGrid(self, blocking_tiles: list, tiles_key):
+        """Splits the layout into rows and builds the passability bitmap. The bitmap has one byte per tile, 1 if the tile can be walked on"""
+
+        self.layout = self.room.layout
+        self.tiles_key = tiles_key
+        self.rows = tuple((self.layout or "").strip().split("\n"))
+        self.width = max(map(len, self.rows))
+        self.height = len(self.rows)
+
+        blocking = set(blocking_tiles)
+        self.passable = bytearray(self.width * self.height)
+        for y, row in enumerate(self.rows):
+            offset = y * self.width
+
+            for x, tile in enumerate(row):
+                if tile not in blocking: self.passable[offset + x] = 1
+
+    def isPassable(self, x: int, y: int) -> bool:
+        """Can the player stand on this tile. Everything outside of the layout is blocking"""
+
+        if x < 0 or y < 0 or x >= self.width or y >= self.height: return False
+
+        return self.passable[y * self.width + x] == 1
+
+COMPARISONS = {"==": operator.eq, "=!": operator.ne, "<": operator.lt, ">": operator.gt, "<=": operator.le, ">=": operator.ge} # Operators of if
+
+class ExitTable:
+    __slots__ = ("room", "generators", "generation", "exits", "match_all")
+
+    def __init__(self, room: dict, generation: int):
+        """Where every exit of a room leads, compiled from its generators for the builtin leave action. An exit is (kind, generator, exit id, data), see PSEngine.__compileExit"""
+
+        self.room = room
+        self.generators = room.generators
+        self.generation = generation
+        self.exits = {} # Exit id -> exit, for the generators above the match all one. None if the generators can't be compiled
+        self.match_all = None # The first generator without an exit id
+
+    def isStale(self, room: dict, generation: int) -> bool:
+        return self.room is not room or self.generators is not room.generators or self.generation != generation
+
+    def find(self, exit_id):
+        """Returns the exit the leave action picks for an exit entity id, None if no generator matches"""
+
+        return self.exits.get(exit_id, self.match_all)
+
+class FrameGeometry:
+    def __init__(self, w: int, h: int, wr: int, hr: int):
+        """Where everything goes on screen for a terminal size (w, h) and a room size (wr, hr)"""
+
+        w_half, h_half = w // 2, h // 2
+        wr_half, hr_half = wr // 2, hr // 2
+
+        self.width = w
+        self.height = h
+        self.top_left = (w_half - wr_half - 2, h_half - hr_half - 2) # Top left, -2 to remove the borders
+        self.map_top = self.top_left[1] + 1 # +1 for the header line
+        self.status_line = h - 3 # Interactions and narration
+
+        # Borders, copied into every frame
+        self.chrome = [list("+" + "-" * (w - 2) + "+")]
+        for line in range(1, h - 2):
+            self.chrome.append(list("|" + " " * (w - 2) + "|"))
+        self.chrome.append(list("+" + "-" * (w - 2) + "+"))
+
 class Player:
     def __init__(self):
-        self.coords = [None, None]
-        self.last_coords = [None, None]
+        self.coords = (None, None) # Tuples, a move replaces them instead of changing them
+        self.last_coords = (None, None)
         self.hp = 20
         self.max_hp = 20
         self.level = 1
         self.inventory = []
         self.engine = None
+        self.dirty = True # Changed since the last save
 
     def reset(self):
         """Fully resets the player"""
 
-        self.coords = [None, None]
-        self.last_coords = [None, None]
+        self.coords = (None, None)
+        self.last_coords = (None, None)
         self.hp = 20
         self.max_hp = 20
         self.level = 1
         self.inventory = []
+        self.dirty = True
 
     def moveUp(self) -> bool:
         """Move the player. Returns True if moved, otherwise False"""
 
-        tile = self.engine.current_room.layout.strip().split("\n")[self.coords[1] - 1][self.coords[0]]
-
-        if tile not in BLOCKING_TILES:
-            self.undone_move_entity = None
-            self.last_coords = dc(self.coords)
-            self.coords[1] -= 1
-            return True
-        
-        return False
+        return self.__move(0, -1)
     
     def moveDown(self) -> bool:
         """Move the player. Returns True if moved, otherwise False"""
 
-        tile = self.engine.current_room.layout.strip().split("\n")[self.coords[1] + 1][self.coords[0]]
-
-        if tile not in BLOCKING_TILES:
-            self.undone_move_entity = None
-            self.last_coords = dc(self.coords)
-            self.coords[1] += 1
-            return True
-        
-        return False
+        return self.__move(0, 1)
 
     def moveLeft(self) -> bool:
         """Move the player. Returns True if moved, otherwise False"""
 
-        tile = self.engine.current_room.layout.strip().split("\n")[self.coords[1]][self.coords[0] - 1]
-
-        if tile not in BLOCKING_TILES:
-            self.undone_move_entity = None
-            self.last_coords = dc(self.coords)
-            self.coords[0] -= 1
-            return True
-        
-        return False
+        return self.__move(-1, 0)
 
     def moveRight(self) -> bool:
         """Move the player. Returns True if moved, otherwise False"""
 
-        tile = self.engine.current_room.layout.strip().split("\n")[self.coords[1]][self.coords[0] + 1]
+        return self.__move(1, 0)
+
+    def __move(self, dx, dy):
+        x, y = self.coords[0] + dx, self.coords[1] + dy
 
-        if tile not in BLOCKING_TILES:
+        if self.engine.isTilePassable(self.engine.current_room, x, y):
             self.undone_move_entity = None
-            self.last_coords = dc(self.coords)
-            self.coords[0] += 1
+            self.last_coords = self.coords
+            self.coords = (x, y)
+            self.dirty = True
+
+            hooks = self.engine.hooks
+            if hooks.subscribed("move"):
+                room = self.engine.current_room
+                hooks.run("move", room, self.engine.findEntityByCoords(room, self.coords), old=self.last_coords, new=self.coords)
+
             return True
         
         return False
@@ -148,9 +489,10 @@ class Player:
         handler = current_entity.actions[action]
         namespace, func = self.engine._handlerExists(handler, action)
 
-        func = list(self.engine.actions[namespace][func].items())
-
-        self.engine._script_engine(func, current_entity)
+        hooks = self.engine.hooks
+        hooks.run("pre_action", self.engine.current_room, current_entity, action)
+        self.engine._script_engine(self.engine.programs[namespace][func], current_entity)
+        hooks.run("post_action", self.engine.current_room, current_entity, action)
 
     def damage(self, value: int, callback: Callable = None):
         """Damages the player
@@ -161,6 +503,7 @@ class Player:
         """
 
         self.hp -= value
+        self.dirty = True
 
         if self.hp <= 0:
             self.hp = 0
@@ -178,6 +521,7 @@ class Player:
         """
 
         self.hp += value
+        self.dirty = True
 
         if self.hp > self.max_hp:
             self.hp = self.max_hp
@@ -185,7 +529,8 @@ class Player:
     def undoMove(self):
         """Undos the last move action"""
 
-        self.coords = dc(self.last_coords)
+        self.coords = self.last_coords
+        self.dirty = True
 
     def __staticAction(self, action):
         if action not in USER_STATIC_ACTION: return False
@@ -195,7 +540,7 @@ class Player:
             case "save": self.engine.saveGame()
             case "quit":
                 self.engine.saveGame()
-                exit()
+                raise GameQuitException()
 
         return True
     
@@ -207,8 +552,90 @@ class Player:
         items = ", ".join(items)
         self.engine.render(narration="You have: " + items, skip_next=True)
 
+class SharedWorld:
+    def __init__(self, engine: "PSEngine", builtin_leave: tuple = None):
+        """A loaded world that other engines attach to instead of loading it again, see PSEngine.shareWorld. Its rooms are
+        never changed, an attached engine copies a room before entering or changing it"""
+
+        self.world_dir = engine.world_dir
+        self.rooms = tuple(engine.rooms)
+        self.positions = {id(room): idx for idx, room in enumerate(self.rooms)} # id(room) -> index in rooms
+        self.flags = dc(engine.world_flags)
+        self.actions = engine.actions
+        self.programs = engine.programs
+        self.save_index = engine.listSaves() # Read once for every attached engine, they read it again before writing to it
+        self.registry = engine.registry
+        self.builtin_leave = builtin_leave # Program of builtin/leave, unless the world replaced it
+
+    def __getstate__(self):
+        # Pickled for the workers of server.Supervisor, positions are by id() so they are rebuilt after unpickling
+        state = dict(self.__dict__)
+        del state["positions"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.positions = {id(room): idx for idx, room in enumerate(self.rooms)}
+
+WORLD_REGISTRIES = {} # Entries -> WorldRegistry, so engines playing the same world share one
+
+class WorldRegistry:
+    __slots__ = ("etc_map", "uam", "entities", "blocking_tiles")
+
+    def __init__(self, etc_map: dict, uam, entities, blocking_tiles):
+        """The entity chars, entity actions, entity types and blocking tiles of a world. It is never changed, get one with WorldRegistry.build"""
+
+        self.etc_map = MappingProxyType(dict(etc_map)) # Entity type -> char
+        self.uam = frozenset(uam) # User Advanced Movement
+        self.entities = frozenset(entities)
+        self.blocking_tiles = frozenset(blocking_tiles)
+
+    @classmethod
+    def build(cls, etc_map: dict, uam, entities, blocking_tiles) -> "WorldRegistry":
+        """Returns the registry with these entries. Engines asking for the same entries get the same registry"""
+
+        key = (frozenset(etc_map.items()), frozenset(uam), frozenset(entities), frozenset(blocking_tiles))
+
+        registry = WORLD_REGISTRIES.get(key, None)
+        if registry is None: registry = WORLD_REGISTRIES.setdefault(key, cls(etc_map, uam, entities, blocking_tiles))
+
+        return registry
+
+    @classmethod
+    def fromAddons(cls, addons: list) -> "WorldRegistry":
+        """Returns the defaults from static.py with the entries of the addons added"""
+
+        etc_map = dict(ETC_MAP)
+        uam = list(USER_ADVANCED_MOVEMENT)
+        entities = list(ENTITIES)
+        blocking_tiles = list(BLOCKING_TILES)
+
+        for addon in addons:
+            etc_map.update(addon.get("etc_map", {}))
+            uam.extend(addon.get("uam", []))
+            entities.extend(addon.get("entities", []))
+            blocking_tiles.extend(addon.get("blocking_tiles", []))
+
+        return cls.build(etc_map, uam, entities, blocking_tiles)
+
+    def __reduce__(self):
+        return (WorldRegistry.build, (dict(self.etc_map), self.uam, self.entities, self.blocking_tiles))
+
+    def toSave(self) -> dict:
+        return {"etc_map": dict(self.etc_map), "uam": sorted(self.uam), "entities": sorted(self.entities), "blocking_tiles": sorted(self.blocking_tiles)}
+
 class PSEngine:
-    def __init__(self, search_dir: str = ".", _debug_flags_neverload=False, _debug_flags_skipsplash=False):
+    def __init__(self, search_dir: str = ".", input_source=None, renderer=None, prompts: dict = None, seed: int = None, _debug_flags_neverload=False, _debug_flags_skipsplash=False):
+        """The engine
+
+        Args:
+            search_dir (str, optional): Folder to look for worlds in. Defaults to ".".
+            input_source (optional): Where keys are read from, see inputs.py. Defaults to the terminal.
+            renderer (optional): Where frames and messages go, see renderer.py. Defaults to the terminal.
+            prompts (dict, optional): Answers to prompts, so they don't wait for input. See PROMPT_ANSWERS_HEADLESS. Defaults to None.
+            seed (int, optional): Seed of the random streams of new games, a loaded save continues its own streams. Defaults to RANDOM_SEED.
+        """
+
         self.rooms = []
         self.world_flags = {}
         self.current_room = None
@@ -217,18 +644,86 @@ class PSEngine:
         self.world_dir = None
         self.engine_dir = os.path.split(__file__)[0]
         self.actions = {}
+        self.programs = {} # Compiled actions, same layout as self.actions
         self.render_skip_next = False
+        self.resize_waiter = None # Called instead of waiting in render when the room doesn't fit, gameloop.GameLoop sets it so the event loop never blocks
+        self.renderer = renderer if renderer else TerminalRenderer(differential=DIFFERENTIAL_RENDERING)
+        self.input = input_source if input_source else TerminalInput()
+        self.prompts = dict(prompts) if prompts else {} # Prompt name -> answer
+        self.seed = seed if seed is not None else RANDOM_SEED
+        self.random = RandomStreams(self.seed) # Saved with the game
+        self.random_pool = WeightedPool() # Filled by the random action
+        self.registry = WorldRegistry.fromAddons([]) # Entity chars, actions and types and blocking tiles of the world
+        self.__frame_geometries = {}
         self.world_scripts = {}
+        self.__room_indexes = {}
+        self.__entity_generation = 0 # Increased every time an entity might have moved, been added or removed
+        self.__indexed_params = {"id", "linked_exit"}
+        self.__indexed_fields = {"entities", "coords"} | self.__indexed_params # Assigning to these invalidates room indexes
+        self.__rooms_by_id = {}
+        self.__rooms_indexed = None # The self.rooms list the room ID index was built from
+        self.__rooms_indexed_count = 0
+        self.__dirty_rooms = {} # id(room) -> room, rooms changed since the last save
+        self.__flags_dirty = False
+        self.__script_room = None # The room the running script started in
+        self.__script_depth = 0
+        self.__loops = [] # LoopFrame of every running for, innermost last
+        self.__item_loop = None # LoopFrame current_item came from, for the action that runs
+        self.save_slot = DEFAULT_SAVE_SLOT # Name of the save slot saveGame writes to
+        self.__save_index = None # Slot metadata, loaded from the save index
+        self.__save_seq = 0 # Sequence number of the last save entry
+        self.__save_synced = False # The save on disk belongs to this game, so deltas can be appended to it
+        self.__journal_entries = 0
+        self.world_cache = None # Parsed world files from previous runs
+        self.__action_maps = {}
+        self.__action_maps_digest = None
+        self.__action_tables = {} # Shared action tables, by action map and changed actions, or by all actions for saved rooms
+        self.__room_manifest = None
+        self.__unparsed_room_files = {} # Path -> room id, of every room file that hasn't been loaded yet
+        self.__unparsed_rooms = {} # Room id -> path
+        self.__room_prefetcher = None
+        self.__prefetched_rooms = {} # Path -> Future of the parsed file
+        self.room_parse_times = {} # Room file -> seconds spent parsing it, for rooms that weren't in the world cache
+        self.instrumentation = None # Counters and timings of the hot paths, only while enabled
+        self.__profiler = None
+        self.hooks = HookRegistry(HOOK_TIME_BUDGET, self.__detachLoops, self.__scriptRan) # Functions world scripts subscribed to events
+        self.scheduler = Scheduler() # Timers, fired between inputs while the game runs on gameloop.GameLoop
+        self.__typed = None # Command typed so far, see feedKey
+        self.__shared_world = None # SharedWorld this engine is attached to
+        self.__builtin_leave = None # Program of builtin/leave, it runs from the exit tables instead
+        self.__exit_tables = {} # id(room) -> ExitTable
+        self.__exit_generation = 0 # Increased every time a generator might have changed
+        self.__room_copies = {} # id(copy) -> shared room, of the rooms this engine copied
+        self.__changed_rooms = set() # id(copy) of the copies that were changed, they are kept after leaving the room
 
         self._DF_neverload = _debug_flags_neverload
         self._DF_skipsplash = _debug_flags_skipsplash
         
         self.player.engine = self
 
-        with open(os.path.join(self.engine_dir, "builtin.json"), "r") as f:
-            self.builtin = toDotdict(json.load(f))
+        self.__script_handlers = {
+            OP_DISPLAY_TEXT: self.__action_displaytext,
+            OP_SHOW_CONTENT: self.__action_showcontent,
+            OP_SET: self.__action_set,
+            OP_ADD: self.__action_add,
+            OP_REMOVE: self.__action_remove,
+            OP_PY: self.__action_py,
+            OP_CHANGE_ROOM: self.__action_changeroom,
+            OP_RANDOM: self.__action_random,
+            OP_SPAWN_PLAYER: self.__action_spawnplayer,
+            OP_DAMAGE_PLAYER: self.__action_damageplayer,
+            OP_HEAL_PLAYER: self.__action_healplayer,
+            OP_SCHEDULE: self.__action_schedule
+        }
+
+        with open(os.path.join(self.engine_dir, "builtin.json"), "rb") as f:
+            data = f.read()
+            self.builtin = toDotdict(json.loads(data))
+            self.__builtin_digest = hashBytes(data)
+
+        if INSTRUMENTATION: self.enableInstrumentation(INSTRUMENTATION_SNAPSHOT_FILE)
 
-    def loadWorld(self, world_name: str) -> None:
+    def loadWorld(self, world_name: str) -> bool:
         """Loads a world folder
 
         Args:
@@ -237,40 +732,55 @@ class PSEngine:
         Raises:
             WorldAlreadyLoadedException: A world is already loaded but is trying to load another.
             WorldNotFoundException: Cannot find the world folder in the search directory
+
+        Returns:
+            bool: True if a save was loaded. The player is then already in the saved room, so there is no need to change rooms or spawn them
         """
 
         self.world_dir = os.path.join(self.search_dir, world_name)
 
-        if self.rooms != []: raise WorldAlreadyLoadedException("A world has already been loaded, unload it first and then load another.")
+        if self.rooms != [] or self.__unparsed_room_files: raise WorldAlreadyLoadedException("A world has already been loaded, unload it first and then load another.")
         if not os.path.exists(self.world_dir): raise WorldNotFoundException(f"The world folder '{world_name}' has not been found.")
 
+        if WORLD_CACHE:
+            self.world_cache = WorldCache(os.path.join(self.engine_dir, WORLD_CACHE_DIR), self.world_dir)
+            self.world_cache.load()
+            atexit.register(self.world_cache.flush) # Rooms loaded later are cached when the game exits
+
         status = self.loadGame()
-        if status:
-            return
 
-        self.world_flags["_world_name"] = world_name
+        if not status:
+            self.world_flags["_world_name"] = world_name
+        else:
+            self.world_flags.setdefault("_world_name", world_name) # flags.json replaces the flags, so saves can be missing it
+
         self.__splashScreen()
 
-        for file in os.listdir(self.world_dir):
-            file = os.path.join(self.world_dir, file)
+        with self.__timer("load_world/rooms"):
+            self.__action_maps = self.__loadCustomActionMaps()
+            self.__action_tables = {}
+            self.__loadRoomManifest() # A save only contains the rooms that were loaded
 
-            if not os.path.isfile(file): continue
-            if not file.endswith(".yaml"): continue
+            if not LAZY_ROOM_LOADING: self.loadAllRooms()
+
+        if not status:
+            if os.path.isfile(os.path.join(self.world_dir, "flags.json")):
+                with open(os.path.join(self.world_dir, "flags.json"), "r") as f:
+                    self.world_flags = json.load(f)
 
-            with open(file, "r") as f:
-                self.rooms.append(toDotdict(yaml.full_load(f)))
+            self.__loadAddons() # Saves already contain the addons
 
-        if os.path.isfile(os.path.join(self.world_dir, "flags.json")):
-            with open(os.path.join(self.world_dir, "flags.json"), "r") as f:
-                self.world_flags = json.load(f)
+        with self.__timer("load_world/actions"):
+            self.__loadActions()
+
+        if self.world_cache: self.world_cache.flush()
 
-        self.__loadActionMap()
-        self.__loadAddons()
-        self.__loadActions()
         self.__loadUserScripts()
 
         self.__splashScreenEnd()
 
+        return bool(status)
+
     def unloadWorld(self) -> None:
         """Unload a world"""
 
@@ -278,6 +788,126 @@ class PSEngine:
         self.rooms = []
         self.world_flags = {}
         self.actions = {}
+        self.programs = {}
+        self.world_scripts = {}
+        self.hooks = HookRegistry(HOOK_TIME_BUDGET, self.__detachLoops, self.__scriptRan) # The scripts subscribe again when a world is loaded
+        self.hooks.instrumentation = self.instrumentation
+        self.__room_indexes = {}
+        self.__rooms_indexed = None
+        self.save_slot = DEFAULT_SAVE_SLOT
+        self.__save_index = None
+        self.__save_synced = False
+        self.__action_maps = {}
+        self.__action_tables = {}
+        self.__room_manifest = None
+        self.__unparsed_room_files = {}
+        self.__unparsed_rooms = {}
+        self.room_parse_times = {}
+        self.random = RandomStreams(self.seed)
+        self.random_pool = WeightedPool()
+        self.registry = WorldRegistry.fromAddons([])
+        self.scheduler.clear()
+        self.__shared_world = None
+        self.__room_copies = {}
+        self.__changed_rooms = set()
+        self.__builtin_leave = None
+        self.__exit_tables = {}
+
+        if self.world_cache:
+            self.world_cache.flush()
+            atexit.unregister(self.world_cache.flush)
+            self.world_cache = None
+
+        for future in self.__prefetched_rooms.values(): future.cancel()
+        self.__prefetched_rooms = {}
+
+    def loadAllRooms(self) -> None:
+        """Loads every room of the world that hasn't been loaded yet. Rooms are otherwise loaded the first time they are needed"""
+
+        if not self.__unparsed_room_files: return
+
+        paths = list(self.__unparsed_room_files)
+        parsed = self.__parseRoomFiles(paths) if len(paths) >= PARALLEL_PARSE_THRESHOLD else {}
+
+        for path in paths: # Added in order, whichever worker finished first
+            if path in parsed: self.__addRoomFile(path, *parsed.pop(path))
+            else: self.__loadRoomFile(path)
+
+        if self.world_cache: self.world_cache.flush()
+
+        # Keep the order the rooms would have been loaded in all at once
+        order = {}
+        for idx, entry in enumerate(self.__room_manifest.files.values()):
+            if type(entry["id"]) in (str, int): order.setdefault(entry["id"], idx)
+
+        def position(room):
+            room_id = room.get("id", None)
+            return order.get(room_id, len(order)) if type(room_id) in (str, int) else len(order)
+
+        self.rooms.sort(key=position)
+
+    def shareWorld(self) -> SharedWorld:
+        """Loads every room and returns the world for other engines to attach to with attachWorld. Don't change the rooms of this engine after sharing them
+
+        Returns:
+            SharedWorld: The world
+        """
+
+        self.loadAllRooms()
+        return SharedWorld(self, self.__builtin_leave)
+
+    def attachWorld(self, world: SharedWorld) -> None:
+        """Plays a world another engine loaded, instead of loading it with loadWorld. Rooms are shared until this engine enters or changes
+        them, it then works on its own copy. Flags and the player are always its own. World scripts aren't loaded
+
+        Args:
+            world (SharedWorld): The world, from shareWorld
+
+        Raises:
+            WorldAlreadyLoadedException: A world is already loaded
+        """
+
+        if self.rooms != [] or self.__unparsed_room_files: raise WorldAlreadyLoadedException("A world has already been loaded, unload it first and then attach another.")
+
+        self.world_dir = world.world_dir
+        self.rooms = list(world.rooms)
+        self.world_flags = dc(world.flags)
+        self.actions = world.actions
+        self.programs = world.programs
+        self.registry = world.registry
+        self.__builtin_leave = world.builtin_leave
+        self.__shared_world = world
+        self.__save_index = world.save_index
+        self.__room_copies = {}
+        self.__changed_rooms = set()
+        self.invalidateRoomIndexes()
+
+    def editableRoom(self, room: dict) -> dict:
+        """Returns the room to change instead of room. That is a copy of it if this engine is attached to a shared world and hasn't copied it yet, otherwise room itself.
+        Custom scripts that change rooms other than the current room should change the room this returns
+
+        Args:
+            room (dict): The room
+
+        Returns:
+            dict: The room to change, it has replaced room in PSEngine.rooms
+        """
+
+        shared = self.__shared_world
+        if shared is None: return room
+
+        position = shared.positions.get(id(room), None)
+        if position is None: return room # Not a shared room
+
+        if self.rooms[position] is not room:
+            copy = self.rooms[position]
+            return copy if self.__room_copies.get(id(copy), None) is room else room # Copied already, or replaced by a save
+
+        copy = dc(room)
+        self.__room_copies[id(copy)] = room
+        self.__swapRoom(position, room, copy)
+
+        return copy
 
     def changeRoom(self, room: str | dict) -> None:
         """Change the current room
@@ -289,11 +919,17 @@ class PSEngine:
             RoomNotFoundException: If provided a room id, that room doesn't exist in the loaded world
         """
 
-        if type(room) == str: self.current_room = self.findRoomByID(room)
-        elif type(room) in [dict, dotdict]: self.current_room = room
+        if type(room) == str: room = self.findRoomByID(room)
+        elif type(room) not in [dict, dotdict, Room]: room = self.current_room
+
+        if self.__shared_world is not None: room = self.__enterSharedRoom(room)
+        self.current_room = room
 
-        for module in self.world_scripts.values():
-            module.onLoad()
+        self.renderer.invalidate()
+
+        self.hooks.run("load", self.current_room)
+
+        if PREFETCH_ROOMS: self.__prefetchExits(self.current_room)
 
     def findRoomByID(self, search_id: str) -> dict:
         """Find a room from a loaded world by the room id
@@ -308,9 +944,22 @@ class PSEngine:
             dict: The room
         """
 
-        for room in self.rooms:
-            if room.id == search_id:
-                return room
+        if self.__rooms_indexed is not self.rooms or len(self.rooms) != self.__rooms_indexed_count:
+            self.__rebuildRoomIDIndex()
+
+        try:
+            room = self.__rooms_by_id.get(search_id, None)
+        except TypeError: # Unhashable id
+            room = None
+
+        if room is not None: return room
+
+        try:
+            path = self.__unparsed_rooms.get(search_id, None)
+        except TypeError:
+            path = None
+
+        if path is not None: return self.__loadRoomFile(path)
             
         raise RoomNotFoundException(f"Cannot find room with id: '{search_id}'")
             
@@ -328,9 +977,17 @@ class PSEngine:
             dict: The entity
         """
 
-        for entity in room.entities:
-            if entity.id == search_id:
-                return entity
+        if search_id is not None: # Entities without an id match None, so those have to be searched for
+            try:
+                entity = self.__getRoomIndex(room).params["id"].get(search_id, None)
+            except TypeError: # Unhashable id
+                entity = None
+
+            if entity is not None: return entity
+        else:
+            for entity in room.entities:
+                if entity.id == search_id:
+                    return entity
             
         raise EntityNotFoundException(f"Cannot find entity with id '{search_id}' in room '{room.id}'")
     
@@ -349,6 +1006,15 @@ class PSEngine:
             dict: The entity
         """
 
+        if param in self.__indexed_params:
+            try:
+                entity = self.__getRoomIndex(room).params[param].get(target_value, None)
+            except TypeError: # Unhashable value, fall back to searching
+                pass
+            else:
+                if entity is not None: return entity
+                raise EntityNotFoundException(f"Cannot find entity which has parameter '{param}' set to '{target_value}'")
+
         for entity in room.entities:
             try:
                 if entity[param] == target_value:
@@ -369,11 +1035,43 @@ class PSEngine:
             dict | None: Returns the entity if found, otherwise None
         """
         
-        for entity in room.entities:
-            if entity.coords == coords:
-                return entity
-            
-        return None
+        stacked = self.__getRoomIndex(room).coords.get(tuple(coords), None)
+        if not stacked: return None
+
+        return stacked[0]
+
+    def findEntitiesByCoords(self, room: dict, coords: list[int, int]) -> list:
+        """Find all entities stacked on the same coords
+
+        Args:
+            room (dict): The room to search
+            coords (list[int, int]): The coords to check
+
+        Returns:
+            list: The entities in the order they appear in the room, empty if there are none
+        """
+
+        return list(self.__getRoomIndex(room).coords.get(tuple(coords), []))
+
+    def invalidateRoomIndexes(self) -> None:
+        """Marks all room lookup tables as outdated. Call this after a custom script moves, adds or removes entities, or changes indexed parameters"""
+
+        self.__entity_generation += 1
+        self.__exit_generation += 1
+        self.__rooms_indexed = None
+
+    def addIndexedParameter(self, param: str) -> None:
+        """Keep a lookup table for an entity parameter, making findEntityByParameter with that parameter a dictionary lookup. "id" and "linked_exit" are always indexed
+
+        Args:
+            param (str): The entity parameter
+        """
+
+        if param in self.__indexed_params: return
+
+        self.__indexed_params.add(param)
+        self.__indexed_fields.add(param)
+        self.__entity_generation += 1
     
     def findItemInArrayByParameter(self, array: list, param: str, target_value: str) -> any:
         """Find an item in an array by its parameter
@@ -413,13 +1111,22 @@ class PSEngine:
             dict: The entity
         """
 
-        length = len(template.split("."))
+        steps, _, ends = compileTemplate(template, 1)
 
-        for skip_last in range(1, length):
-            rendered = self.__renderTemplate(template, state_map, skip_last)[0]
+        # Walk the template once, remembering the value at the end of every field
+        rendered_fields = []
+        rendered = state_map
+        idx = 0
+        for end in ends:
+            while idx < end:
+                rendered = self.__renderStep(rendered, steps[idx])
+                idx += 1
 
-            if type(rendered) != dict and type(rendered) != dotdict: continue
-            if rendered.get("type", None) in ENTITIES:
+            rendered_fields.append(rendered)
+
+        for rendered in reversed(rendered_fields):
+            if type(rendered) not in (dict, dotdict, Entity): continue
+            if rendered.get("type", None) in self.registry.entities:
                 return rendered
             
         raise EntityNotFoundException(f"Cannot find entity in template '{template}'\nState map: {state_map}")
@@ -434,7 +1141,23 @@ class PSEngine:
             tuple[int, int]: Width and height
         """
         
-        return max(map(lambda x: len(x), room.layout.strip().split("\n"))), len(room.layout.strip().split("\n"))
+        grid = self.__getRoomGrid(room)
+
+        return grid.width, grid.height
+
+    def isTilePassable(self, room: dict, x: int, y: int) -> bool:
+        """Check if a tile in a room's layout is not blocking
+
+        Args:
+            room (dict): The room
+            x (int): Tile x coordinate
+            y (int): Tile y coordinate
+
+        Returns:
+            bool: True if the player can move onto the tile. Tiles outside of the layout are blocking
+        """
+
+        return self.__getRoomGrid(room).isPassable(x, y)
         
     def render(self, room: dict = None, narration: str = None, skip_next: bool = False) -> None:
         """Renders a room. This is also the main tick loop
@@ -448,87 +1171,90 @@ class PSEngine:
             ValueError: Parameter missing
         """
 
-        for module in self.world_scripts.values():
-            module.onRender()
+        self.hooks.run("render", self.current_room)
+
+        inst = self.instrumentation
+        if inst: start = lap = time.perf_counter_ns()
 
         if self.render_skip_next:
             self.render_skip_next = False
+            if inst: inst.count("render/skipped")
             return
 
         if not room: room = self.current_room
         if not room: raise ValueError("'room' parameter is missing.")
         
-        w, h = os.get_terminal_size()
-        wr, hr = self.getRoomWH(room)
-        buffer = io.StringIO()
-
         while not self.__canDraw(room):
-            print(" Cannot fit map into the available terminal space. Please resize the terminal.", end="\r")
-            time.sleep(0.25)
+            self.renderer.write(" Cannot fit map into the available terminal space. Please resize the terminal.\r")
+            self.renderer.invalidate()
 
-        w_half, h_half = w // 2, h // 2
-        wr_half, hr_half = wr // 2, hr // 2
-        TL = (w_half - wr_half - 2, h_half - hr_half - 2) # Top left, -2 to remove the borders
-        with contextlib.redirect_stdout(buffer):
-            # Draw to buffer
-            print("+", end="")
-            print("-" * (w - 2), end="")
-            print("+", end="\r")
-            print(f"+-- {AnsiColorCodes.Cyan}{room.name}{AnsiColorCodes.Reset}   {AnsiColorCodes.Red}{self.player.hp}{AnsiColorCodes.Reset}/{AnsiColorCodes.Red}{self.player.max_hp}{AnsiColorCodes.Reset} ")
-
-            first_line = buffer.tell()
-            chars_per_line = w + 1 # width + \n
-            for line in range(1, h - 2):
-                print("|", end="")
-                print(" " * (w - 2), end="")
-                print("|")
-
-            print("+", end="")
-            print("-" * (w - 2), end="")
-            print("+", end="")
-
-            # Draw map
-            TL_Offset = first_line + (TL[1] * chars_per_line) + TL[0] # Go to first line, go to TL[1] (topleft.y) line, go to TL[0] (topleft.x) char
-            buffer.seek(TL_Offset)
-            for idx, line in enumerate(room.layout.strip().split("\n")):
-                buffer.write(line)
-                buffer.seek(TL_Offset + chars_per_line * (idx + 1))
-
-            # Draw entities
-            for entity in room.entities:
-                if not entity.visible: continue
+            if self.resize_waiter is not None: # It renders again once the terminal is resized
+                self.resize_waiter()
+                return
 
-                try:
-                    buffer.seek(TL_Offset + entity.coords[0] + entity.coords[1] * chars_per_line)
-                    buffer.write(ETC_MAP[entity.type])
-                except KeyError as e:
-                    raise EntityNotFoundException(f"Entity {e} is not in the default set of entities, nor has it been loaded by a custom map.")
-
-            if not narration:
-                # Add interactions
-                if (entity := self.findEntityByCoords(room, self.player.coords)):
-                    if entity.visible:
-                        buffer.seek(first_line + (h - 4) * chars_per_line + 2)
-                        actions = entity.get("actions", {})
-                        actions = list(filter(lambda x: x[1] != None, actions.items()))
-                        actions = list(map(lambda x: x[0].title(), actions))
-                        buffer.write(" | ".join(actions))
-            else:
-                # Add narration
-                buffer.seek(first_line + (h - 4) * chars_per_line + 2)
-                buffer.write("> " + narration)
+            self.renderer.waitForResize()
+
+        geometry = self.__getFrameGeometry(room)
+        TL = geometry.top_left
+        map_top = geometry.map_top
+        status_line = geometry.status_line
+        w = geometry.width
+
+        # Draw borders
+        frame = [row[:] for row in geometry.chrome]
+        if inst: lap = self.__lap("render/geometry", lap)
+
+        # Draw header
+        col = 0
+        for text, color in (("+-- ", None), (room.name, AnsiColorCodes.Cyan), ("   ", None), (str(self.player.hp), AnsiColorCodes.Red), ("/", None), (str(self.player.max_hp), AnsiColorCodes.Red), (" ", None)):
+            writeText(frame, 0, col, text, color)
+            col += len(text)
+
+        # Draw map
+        for idx, line in enumerate(self.__getRoomGrid(room).rows):
+            writeText(frame, map_top + idx, TL[0], line)
+
+        if inst: lap = self.__lap("render/map", lap)
+
+        # Draw entities
+        for entity in room.entities:
+            if not entity.visible: continue
+
+            try:
+                writeText(frame, map_top + entity.coords[1], TL[0] + entity.coords[0], self.registry.etc_map[entity.type])
+            except KeyError as e:
+                raise EntityNotFoundException(f"Entity {e} is not in the default set of entities, nor has it been loaded by a custom map.")
+
+        if inst: lap = self.__lap("render/entities", lap)
+
+        if not narration:
+            # Add interactions
+            if (entity := self.findEntityByCoords(room, self.player.coords)):
+                if entity.visible:
+                    actions = entity.get("actions", {})
+                    actions = list(filter(lambda x: x[1] != None, actions.items()))
+                    actions = list(map(lambda x: x[0].title(), actions))
+                    writeText(frame, status_line, 2, " | ".join(actions), end_col=w - 1)
+        else:
+            # Add narration
+            writeText(frame, status_line, 2, "> " + str(narration), end_col=w - 1)
+
+        # If player moved to a closed door, move the player back one space while still adding interactions
+        if (entity := self.findEntityByCoords(self.current_room, self.player.coords)):
+            if entity.type == "door" and not entity.get("properties", {}).get("open", True):
+                self.player.undoMove()
+                self.player.undone_move_entity = entity
 
-            # If player moved to a closed door, move the player back one space while still adding interactions
-            if (entity := self.findEntityByCoords(self.current_room, self.player.coords)):
-                if entity.type == "door" and not entity.get("properties", {}).get("open", True):
-                    self.player.undoMove()
-                    self.player.undone_move_entity = entity
+        # Draw player
+        writeText(frame, map_top + self.player.coords[1], TL[0] + self.player.coords[0], self.registry.etc_map["player"])
 
-            # Draw player
-            buffer.seek(TL_Offset + self.player.coords[0] + self.player.coords[1] * chars_per_line)
-            buffer.write(ETC_MAP.player)
+        if inst: lap = self.__lap("render/status", lap)
 
-        print(buffer.getvalue())
+        self.renderer.draw(frame)
+
+        if inst:
+            end = self.__lap("render/draw", lap)
+            inst.record("render", end - start)
 
         if skip_next: self.render_skip_next = True
 
@@ -546,8 +1272,8 @@ class PSEngine:
 
         if not spawn: raise EntityNotFoundException(f"Cannot find an unlinked spawn in room '{self.current_room.name}'")
 
-        self.player.coords = dc(spawn.coords)
-        self.player.last_coords = dc(spawn.coords)
+        self.player.coords = self.player.last_coords = tuple(spawn.coords)
+        self.player.dirty = True
 
     def spawnPlayerAtLinkedExit(self, exit_id: str) -> None:
         """Spawns the player at the correct spawn depending on the exit
@@ -563,8 +1289,8 @@ class PSEngine:
 
         if not spawn: raise SpawnNotFoundException(f"Cannot find a spawn in the room '{self.current_room.name}' with the linked exit set to '{exit_id}'")
 
-        self.player.coords = dc(spawn.coords)
-        self.player.last_coords = dc(spawn.coords)
+        self.player.coords = self.player.last_coords = tuple(spawn.coords)
+        self.player.dirty = True
 
     def inputLoop(self) -> str:
         """Pools the player for an input. W/A/S/D is returned for a simple command, and the full command name (ex. INSPECT/OPEN/CLOSE) is returned for the complex commands. Everything is sent in lowercase
@@ -574,44 +1300,376 @@ class PSEngine:
         """
 
         while True:
-            char = getch()
-            
-            if char.lower() in USER_BASIC_MOVEMENT:
-                return char.lower()
-                
-            full = " "
-            full += char.lower()
-            while True:
-                print(full, end="\r", flush=True)
-                char = getch().lower()
+            command = self.feedKey(self.input.read())
+            if command is not None: return command
 
-                if char in ("\n", "\r"):
-                    if full.strip() in USER_ADVANCED_MOVEMENT or full.strip() in USER_STATIC_ACTION:
-                        return full.strip()
+    def feedKey(self, char: str) -> str | None:
+        """Feeds a single key of input, for loops that read keys themselves like gameloop.GameLoop. inputLoop is built on it
 
-                    break
+        Args:
+            char (str): The key
 
-                full += char
+        Returns:
+            str | None: The key/action once a command is complete (like inputLoop returns it), otherwise None
+        """
 
-            print(" " * MIN_TERM_WIDTH, end="\r", flush=True)
+        char = char.lower()
 
-    def loadGame(self):
-        """Loads the game. If no save is present, returns None. If the player denies loading, returns False"""
+        if self.__typed is None:
+            if char in USER_BASIC_MOVEMENT: return char
 
-        global ETC_MAP, USER_ADVANCED_MOVEMENT, ENTITIES, BLOCKING_TILES
+            self.__typed = " " + char
+            self.renderer.write(self.__typed + "\r")
+            return None
 
-        if self._DF_neverload: return False
-        if not os.path.exists(os.path.join(self.world_dir, "save.json")): return None
+        if char in ("\n", "\r"):
+            command = self.__typed.strip()
+            self.__typed = None
 
-        with open(os.path.join(self.world_dir, "save.json"), "r") as f:
-            save = json.load(f)
-            save = toDotdict(save)
+            if command in self.registry.uam or command in USER_STATIC_ACTION: return command
 
-        now = int(time.time())
-        elapsed = now - save.timestamp
-        if elapsed < 60:
-            ago = f"{elapsed} second{'s' if elapsed != 1 else ''} ago"
-        elif elapsed < 3600:
+            self.renderer.write(" " * MIN_TERM_WIDTH + "\r")
+            return None
+
+        self.__typed += char
+        self.renderer.write(self.__typed + "\r")
+        return None
+
+    def handleInput(self, action: str) -> None:
+        """Does what an input from inputLoop asks for. W/A/S/D moves the player, anything else is an action
+
+        Args:
+            action (str): The key/action
+
+        Raises:
+            GameQuitException: The player quit
+            PlayerDiedException: The player died
+        """
+
+        match action:
+            case "w": self.player.moveUp()
+            case "a": self.player.moveLeft()
+            case "s": self.player.moveDown()
+            case "d": self.player.moveRight()
+            case _: self.player.doAction(action)
+
+    def loadGame(self):
+        """Loads the game. If no save is present, returns None. If the player denies loading, returns False"""
+
+        if self._DF_neverload: return False
+
+        self.__migrateLegacySave()
+
+        saves = sorted(self.listSaves().items(), key=lambda slot: slot[1].timestamp, reverse=True)
+        if not saves: return None
+
+        if len(saves) == 1:
+            slot, meta = saves[0]
+
+            self.renderer.write(f"{AnsiColorCodes.Cyan}A save has been found:\n\nName: {meta.name}\nDate: {self.__formatSaveDate(meta.timestamp)}\nRoom: {meta.room}\nLevel: {meta.level}\n")
+            self.renderer.write(f"Do you wish to load this save? (y/n){AnsiColorCodes.Reset}\n")
+
+            if self.__prompt("load_save", ["y", "n"]) == "n": return False
+        else:
+            self.renderer.write(f"{AnsiColorCodes.Cyan}Saves have been found:\n\n")
+            for idx, (slot, meta) in enumerate(saves):
+                self.renderer.write(f"[{idx + 1}] {meta.name} - {self.__formatSaveDate(meta.timestamp)} - {meta.room}, level {meta.level}, {self.__formatSize(meta.size)}\n")
+
+            self.renderer.write(f"\nEnter the number of the save to load, or n to start a new game{AnsiColorCodes.Reset}\n")
+
+            choices = ["n", "y"] + [str(idx + 1) for idx in range(len(saves))] # y loads the latest save, like with a single save
+            choice = self.__prompt("load_save", choices, line=len(saves) >= 10)
+            if choice == "n": return False
+            if choice == "y": choice = "1"
+
+            slot, meta = saves[int(choice) - 1]
+
+        self.__loadSlot(slot)
+        self.save_slot = meta.name
+
+        return True
+
+    def saveGame(self, full: bool = False, name: str = None):
+        """Saves the game. Only what changed since the last save is appended to the save journal, which is compacted into a new snapshot every SAVE_JOURNAL_LIMIT saves
+
+        Args:
+            full (bool, optional): Always write a full snapshot. Defaults to False.
+            name (str, optional): Save to another slot, later saves go to that slot as well. Defaults to PSEngine.save_slot.
+        """
+
+        #try:
+        #    save_name = input("Enter save name >>>")
+        #except KeyboardInterrupt:
+        #    print(f"\n{AnsiColorCodes.Yellow}Not saving{AnsiColorCodes.Reset}")
+        #    return
+
+        if name != None and name != self.save_slot:
+            self.save_slot = name
+            self.__save_synced = False # The other slot can hold a different game
+
+        self.hooks.run("pre_save", self.current_room, full=full)
+
+        self.__save_seq += 1
+
+        if full or not self.__save_synced or self.__journal_entries >= SAVE_JOURNAL_LIMIT:
+            with self.__timer("save/snapshot"):
+                self.__writeSnapshot()
+        else:
+            with self.__timer("save/delta"):
+                self.__appendDelta()
+
+        self.__clearDirty()
+        self.__updateSaveIndex()
+
+        self.hooks.run("post_save", self.current_room, full=full)
+
+    def listSaves(self) -> dict:
+        """Lists the save slots of the loaded world. Only the save index is read, not the saves themselves
+
+        Returns:
+            dict: Slot folder -> name, timestamp, room, level and size (in bytes) of the save
+        """
+
+        if self.__save_index is None:
+            path = os.path.join(self.world_dir, "saves", "index.json")
+
+            try:
+                with open(path, "r") as f:
+                    self.__save_index = toDotdict(json.load(f))
+            except (FileNotFoundError, json.JSONDecodeError):
+                self.__save_index = dotdict()
+
+        return self.__save_index
+
+    def markDirty(self, room: dict = None) -> None:
+        """Marks a room as changed so it is written by the next save. Custom scripts that change rooms outside of a py call should call this
+
+        Args:
+            room (dict, optional): The room that changed. Defaults to PSEngine.current_room
+        """
+
+        if not room: room = self.current_room
+        if not room: return
+
+        self.__dirty_rooms[id(room)] = room
+        if self.__shared_world is not None: self.__changed_rooms.add(id(room))
+
+    def markFlagsDirty(self) -> None:
+        """Marks the world flags as changed so they are written by the next save. Custom scripts that change flags outside of a py call or hook should call this"""
+
+        self.__flags_dirty = True
+
+    def markPlayerDirty(self) -> None:
+        """Marks the player as changed so it is written by the next save. Custom scripts that change the player outside of a py call or hook should call this"""
+
+        self.player.dirty = True
+
+    def enableInstrumentation(self, snapshot_path: str = None, interval: float = INSTRUMENTATION_SNAPSHOT_INTERVAL) -> Instrumentation:
+        """Starts counting and timing renders, script opcodes, templates, world script hooks, saves and loads. Read the results with stats()
+
+        Args:
+            snapshot_path (str, optional): Also write stats() to this JSON file every interval seconds. Defaults to None.
+            interval (float, optional): Seconds between snapshots. Defaults to INSTRUMENTATION_SNAPSHOT_INTERVAL.
+
+        Returns:
+            Instrumentation: Where the counters and timers are kept. Its writeCollapsed writes a flamegraph
+        """
+
+        if not self.instrumentation: self.instrumentation = Instrumentation()
+        self.hooks.instrumentation = self.instrumentation
+        if snapshot_path: self.instrumentation.startSnapshots(snapshot_path, interval, self.stats)
+
+        return self.instrumentation
+
+    def disableInstrumentation(self) -> Instrumentation:
+        """Stops recording. Returns the instrumentation that was used, or None if it wasn't enabled"""
+
+        instrumentation = self.instrumentation
+        if instrumentation: instrumentation.stopSnapshots()
+
+        self.instrumentation = None
+        self.hooks.instrumentation = None
+
+        return instrumentation
+
+    def stats(self) -> dict:
+        """Returns the engine metrics. Cache and renderer metrics are always kept, the counters and timers only while instrumentation is enabled
+
+        Returns:
+            dict: instrumentation (None if disabled), template_cache, world_cache, renderer, rooms and hooks
+        """
+
+        templates = compileTemplate.cache_info()
+        renderer = {name: getattr(self.renderer, name) for name in ("frames", "full_repaints", "last_frame_bytes", "total_bytes") if hasattr(self.renderer, name)}
+
+        return {
+            "instrumentation": self.instrumentation.snapshot() if self.instrumentation else None,
+            "template_cache": {"hits": templates.hits, "misses": templates.misses, "size": templates.currsize, "max_size": templates.maxsize},
+            "world_cache": {"hits": self.world_cache.hits, "misses": self.world_cache.misses} if self.world_cache else None,
+            "renderer": renderer,
+            "rooms": {"loaded": len(self.rooms), "not_loaded": len(self.__unparsed_room_files), "copied": len(self.__room_copies)},
+            "hooks": self.hooks.stats()
+        }
+
+    def startProfile(self) -> None:
+        """Runs cProfile until stopProfile is called"""
+
+        if self.__profiler: return
+
+        self.__profiler = Profiler().start()
+
+    def stopProfile(self, path: str = None) -> None:
+        """Stops cProfile
+
+        Args:
+            path (str, optional): Write the profile here, in the pstats format. Defaults to not writing it.
+        """
+
+        if not self.__profiler: return
+
+        self.__profiler.stop(path)
+        self.__profiler = None
+
+    def __loadSlot(self, slot):
+        """Loads the full save from a slot, and replays its journal"""
+
+        slot_dir = os.path.join(self.world_dir, "saves", slot)
+
+        with self.__timer("load_game/read"):
+            with open(os.path.join(slot_dir, "save.json"), "r") as f:
+                save = json.load(f)
+                save = toDotdict(save)
+
+            deltas = self.__readJournal(slot_dir, save.get("seq", 0))
+
+        self.__applyPlayerSave(save.player)
+
+        self.rooms = [toRoom(room) for room in save.rooms]
+        self.__shareActions(self.rooms)
+        self.world_flags = save.flags
+        self.__room_indexes = {}
+        self.__exit_tables = {}
+        self.__rooms_indexed = None
+
+        self.registry = WorldRegistry.build(save.etc_map, save.uam, save.entities, save.blocking_tiles)
+
+        if "random" in save: self.random = RandomStreams.fromState(save.random) # Older saves continue with new streams
+
+        # Replay everything saved after the snapshot
+        current_room = save.current_room
+        for delta in deltas:
+            if "player" in delta: self.__applyPlayerSave(delta.player)
+            if "flags" in delta: self.world_flags = delta.flags
+            if "rooms" in delta: self.__replaceRooms(delta.rooms)
+            if "random" in delta: self.random = RandomStreams.fromState(delta.random)
+            current_room = delta.current_room
+
+        if type(current_room) == dotdict: current_room = current_room.id # Old saves stored the whole room
+        self.current_room = self.findRoomByID(current_room) if current_room != None else None
+
+        self.__save_seq = deltas[-1].seq if deltas else save.get("seq", 0)
+        self.__journal_entries = len(deltas)
+        self.__save_synced = True
+        self.__clearDirty()
+        self.renderer.invalidate()
+
+    def __slotDir(self, name = None):
+        """Returns the folder of a save slot, creating it if needed"""
+
+        if name == None: name = self.save_slot
+
+        folder = "".join(char if char.isalnum() or char in "-_" else "_" for char in name)
+        if folder != name: folder += "-" + hashBytes(name.encode())[:8] # "my save" and "my_save" are different slots
+        slot_dir = os.path.join(self.world_dir, "saves", folder)
+        os.makedirs(slot_dir, exist_ok=True)
+
+        return slot_dir
+
+    def __updateSaveIndex(self):
+        """Writes the metadata of the current slot to the save index"""
+
+        slot_dir = self.__slotDir()
+        size = 0
+        for file in ["save.json", "save.journal"]:
+            if os.path.exists(os.path.join(slot_dir, file)): size += os.path.getsize(os.path.join(slot_dir, file))
+
+        self.__writeSaveIndex(os.path.basename(slot_dir), dotdict({
+            "name": self.save_slot,
+            "timestamp": int(time.time()),
+            "room": self.current_room.id if self.current_room else None,
+            "level": self.player.level,
+            "size": size
+        }))
+
+    def __writeSaveIndex(self, folder, entry):
+        """Sets the entry of a slot folder in the save index. The index is read again and written while holding saves/index.lock,
+        sessions in other processes (see server.Supervisor) and other games of the world write to it too"""
+
+        path = os.path.join(self.world_dir, "saves", "index.json")
+        temp = f"{path}.{os.getpid()}.tmp" # Every process writes its own, so they can't replace the index with half of one
+
+        with open(os.path.join(self.world_dir, "saves", "index.lock"), "a+b") as lock:
+            if os.name == "nt":
+                lock.seek(0)
+                msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1) # Retries for 10 seconds, then raises OSError
+            else:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+
+            try:
+                self.__save_index = None
+                index = self.listSaves()
+                index[folder] = entry
+
+                with open(temp, "w") as f:
+                    json.dump(index, f, indent=4)
+
+                os.replace(temp, path)
+            finally:
+                if os.name == "nt":
+                    lock.seek(0)
+                    msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def __migrateLegacySave(self):
+        """Moves a save from before save slots (save.json in the world folder) into the default slot"""
+
+        legacy = os.path.join(self.world_dir, "save.json")
+        if not os.path.exists(legacy): return
+
+        with open(legacy, "r") as f:
+            save = toDotdict(json.load(f))
+
+        current_room = save.current_room
+        if type(current_room) == dotdict: current_room = current_room.id
+
+        name = save.get("name", DEFAULT_SAVE_SLOT)
+        slot_dir = self.__slotDir(name)
+        timestamp = save.timestamp
+        size = os.path.getsize(legacy)
+
+        os.replace(legacy, os.path.join(slot_dir, "save.json"))
+        if os.path.exists(os.path.join(self.world_dir, "save.journal")):
+            journal = os.path.join(slot_dir, "save.journal")
+            os.replace(os.path.join(self.world_dir, "save.journal"), journal)
+
+            timestamp = max(timestamp, int(os.path.getmtime(journal)))
+            size += os.path.getsize(journal)
+
+        self.__writeSaveIndex(os.path.basename(slot_dir), dotdict({
+            "name": name,
+            "timestamp": timestamp,
+            "room": current_room,
+            "level": save.player.level,
+            "size": size
+        }))
+
+    def __formatSaveDate(self, timestamp):
+        now = int(time.time())
+        elapsed = now - timestamp
+        if elapsed < 60:
+            ago = f"{elapsed} second{'s' if elapsed != 1 else ''} ago"
+        elif elapsed < 3600:
             mins = elapsed // 60
             ago = f"{mins} minute{'s' if mins != 1 else ''} ago"
         elif elapsed < 86400:
@@ -621,71 +1679,167 @@ class PSEngine:
             days = elapsed // 86400
             ago = f"{days} day{'s' if days != 1 else ''} ago"
 
-        print(f"{AnsiColorCodes.Cyan}A save has been found:\n\nName: {save.name}\nDate: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(save.timestamp))} ({ago})")
-        print(f"Do you wish to load this save? (y/n){AnsiColorCodes.Reset}")
+        return f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))} ({ago})"
 
-        while True:
-            char = getch().lower()
+    def __formatSize(self, size):
+        for unit in ["B", "KB", "MB"]:
+            if size < 1024: break
+            size /= 1024
 
-            if char == "n": return False
-            elif char == "y": break
+        return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
 
-        self.player.coords = save.player.coords
-        self.player.hp = save.player.hp
-        self.player.max_hp = save.player.max_hp
-        self.player.level = save.player.level
-        self.player.inventory = save.player.inventory
+    def __playerSave(self):
+        return {
+            "coords": self.player.coords,
+            "hp": self.player.hp,
+            "max_hp": self.player.max_hp,
+            "level": self.player.level,
+            "inventory": self.player.inventory
+        }
 
-        self.current_room = save.current_room
-        self.rooms = save.rooms
-        self.world_flags = save.flags
-        self.world_scripts = save.scripts
+    def __applyPlayerSave(self, player):
+        self.player.coords = self.player.last_coords = tuple(player.coords)
+        self.player.hp = player.hp
+        self.player.max_hp = player.max_hp
+        self.player.level = player.level
+        self.player.inventory = toItems(player.inventory)
 
-        ETC_MAP = save.etc_map
-        USER_ADVANCED_MOVEMENT = save.uam
-        ENTITIES = save.entities
-        BLOCKING_TILES = save.blocking_tiles
+    def __replaceRooms(self, rooms):
+        """Swaps loaded rooms with saved rooms that have the same id"""
 
-        return True
+        positions = {room.id: idx for idx, room in enumerate(self.rooms)}
 
-    def saveGame(self):
-        """Saves the game"""
+        rooms = [toRoom(room) for room in rooms]
+        self.__shareActions(rooms)
 
-        #try:
-        #    save_name = input("Enter save name >>>")
-        #except KeyboardInterrupt:
-        #    print(f"\n{AnsiColorCodes.Yellow}Not saving{AnsiColorCodes.Reset}")
-        #    return
+        for room in rooms:
+            if room.id in positions:
+                self.__exit_tables.pop(id(self.rooms[positions[room.id]]), None)
+                self.rooms[positions[room.id]] = room
+            else:
+                self.rooms.append(room)
 
+        self.invalidateRoomIndexes()
+
+    def __writeSnapshot(self):
         save = {
-            "name": "Latest",#save_name,
+            "name": self.save_slot,#save_name,
             "timestamp": int(time.time()),
-            "player": {
-                "coords": self.player.coords,
-                "hp": self.player.hp,
-                "max_hp": self.player.max_hp,
-                "level": self.player.level,
-                "inventory": self.player.inventory
-            },
-            "current_room": self.current_room,
+            "seq": self.__save_seq,
+            "player": self.__playerSave(),
+            "current_room": self.current_room.id if self.current_room else None,
             "rooms": self.rooms,
             "flags": self.world_flags,
-            "etc_map": ETC_MAP,
-            "uam": USER_ADVANCED_MOVEMENT,
-            "entities": ENTITIES,
-            "blocking_tiles": BLOCKING_TILES,
-            "scripts": self.world_scripts
+            "random": self.random.state(),
+            **self.registry.toSave()
+        }
+
+        slot_dir = self.__slotDir()
+        path = os.path.join(slot_dir, "save.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(save, f, default=jsonDefault)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(path + ".tmp", path)
+
+        # The snapshot contains every delta, so the journal can be emptied. Deltas left behind by a crash are skipped by their sequence number
+        journal = os.path.join(slot_dir, "save.journal")
+        if os.path.exists(journal): os.remove(journal)
+
+        self.__journal_entries = 0
+        self.__save_synced = True
+
+    def __appendDelta(self):
+        delta = {
+            "seq": self.__save_seq,
+            "timestamp": int(time.time()),
+            "current_room": self.current_room.id if self.current_room else None
         }
 
-        with open(os.path.join(self.world_dir, "save.json"), "w") as f:
-            json.dump(save, f)
+        if self.player.dirty: delta["player"] = self.__playerSave()
+        if self.__flags_dirty: delta["flags"] = self.world_flags
+        if self.__dirty_rooms: delta["rooms"] = list(self.__dirty_rooms.values())
+        if self.random.changed: delta["random"] = self.random.state()
+
+        with open(os.path.join(self.__slotDir(), "save.journal"), "a") as f:
+            f.write(json.dumps(delta, default=jsonDefault) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.__journal_entries += 1
+
+    def __readJournal(self, slot_dir, snapshot_seq):
+        """Returns the deltas saved after the snapshot, in order"""
+
+        path = os.path.join(slot_dir, "save.journal")
+        if not os.path.exists(path): return []
+
+        deltas = []
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    delta = toDotdict(json.loads(line))
+                except json.JSONDecodeError: # Only the last line can be cut off, by a crash while saving
+                    break
+
+                if delta.seq > snapshot_seq: deltas.append(delta)
+
+        return deltas
+
+    def __clearDirty(self):
+        self.__dirty_rooms = {}
+        self.__flags_dirty = False
+        self.player.dirty = False
+        self.random.changed = False
 
     def playerDied(self):
-        print("\033[2J") # Clear the screen
-        text = YOU_DIED.replace("[[LEVEL]]", self.player.level)
-        print(text)
-        getch()
-        quit()
+        """Shows the death screen and ends the game
+
+        Raises:
+            PlayerDiedException: Always
+        """
+
+        self.renderer.write("\033[2J\n") # Clear the screen
+        text = YOU_DIED.replace("[[LEVEL]]", str(self.player.level))
+        self.renderer.write(text + "\n")
+        self.renderer.invalidate()
+        self.__prompt("died")
+
+        raise PlayerDiedException()
+
+    def __prompt(self, name, choices=None, line=False):
+        """Asks the player something, unless the prompt has an answer in PSEngine.prompts
+
+        Args:
+            name (str): Name of the prompt
+            choices (list, optional): Valid answers. Defaults to any key.
+            line (bool, optional): Read a whole line instead of a single key. Defaults to False.
+
+        Raises:
+            InvalidPromptAnswerException: The answer in PSEngine.prompts isn't one of the choices
+
+        Returns:
+            str: The answer, in lowercase
+        """
+
+        if name in self.prompts:
+            answer = str(self.prompts[name]).lower()
+            if choices is not None and answer not in choices: raise InvalidPromptAnswerException(f"The answer '{answer}' to the prompt '{name}' is not valid, valid answers are: {', '.join(choices)}")
+
+            return answer
+
+        while True:
+            if line:
+                self.renderer.write(">>> ")
+                answer = ""
+                while (char := self.input.read()) not in ("\n", "\r"): answer += char
+                self.renderer.write("\n")
+            else:
+                answer = self.input.read()
+
+            answer = answer.strip().lower() if line else answer.lower()
+            if choices is None or answer in choices: return answer
 
     def __splashScreen(self):
         if self._DF_skipsplash: return
@@ -694,19 +1848,19 @@ class PSEngine:
         replaced = replaced.replace("[[ENGINE_VERSION]]", VERSION)
         replaced = replaced.replace("[[ACTIONS]]", ", ".join(map(lambda x: x.title(), USER_STATIC_ACTION)))
         replaced = replaced.replace("[[PADDING]]", PADDING_CHAR * len(VERSION))
-        print(replaced)
-        print(f"{AnsiColorCodes.Cyan}Loading world...{AnsiColorCodes.Reset}", end="\r")
+        self.renderer.write(replaced + "\n")
+        self.renderer.write(f"{AnsiColorCodes.Cyan}Loading world...{AnsiColorCodes.Reset}\r")
 
     def __splashScreenEnd(self):
         if self._DF_skipsplash: return
 
-        print(f"{AnsiColorCodes.Cyan}Done! Press any key to continue...{AnsiColorCodes.Reset}")
-        getch()
+        self.renderer.write(f"{AnsiColorCodes.Cyan}Done! Press any key to continue...{AnsiColorCodes.Reset}\n")
+        self.__prompt("continue")
 
     def __canDraw(self, room):
         """Does the room fit into the terminal"""
         wr, hr = self.getRoomWH(room)
-        w, h = os.get_terminal_size()
+        w, h = self.renderer.getSize()
 
         if w < MIN_TERM_WIDTH: return False
         if w < wr + 4: return False
@@ -714,72 +1868,456 @@ class PSEngine:
 
         return True
     
+    def __getFrameGeometry(self, room):
+        w, h = self.renderer.getSize()
+        wr, hr = self.getRoomWH(room)
+        key = (w, h, wr, hr) # Rooms of the same size share their geometry
+
+        geometry = self.__frame_geometries.get(key, None)
+        if geometry is None:
+            if len(self.__frame_geometries) >= 64: self.__frame_geometries = {} # Only happens after a lot of resizing
+
+            geometry = FrameGeometry(w, h, wr, hr)
+            self.__frame_geometries[key] = geometry
+
+        return geometry
+
+    def __roomIndexFor(self, room):
+        index = self.__room_indexes.get(id(room), None)
+
+        if index is None or index.room is not room:
+            index = RoomIndex(room)
+            self.__room_indexes[id(room)] = index
+
+        return index
+
+    def __getRoomIndex(self, room):
+        index = self.__roomIndexFor(room)
+        if index.isStale(self.__entity_generation): index.rebuild(self.__entity_generation, self.__indexed_params)
+
+        return index
+
+    def __enterSharedRoom(self, room):
+        """Copies the room the player enters, and puts the shared room back for the room they leave if it wasn't changed"""
+
+        previous = self.current_room
+        base = self.__room_copies.get(id(previous), None)
+
+        if base is not None and previous is not room and id(previous) not in self.__changed_rooms:
+            del self.__room_copies[id(previous)]
+            self.__swapRoom(self.__shared_world.positions[id(base)], previous, base)
+
+        return self.editableRoom(room)
+
+    def __swapRoom(self, position, old, new):
+        self.rooms[position] = new
+        self.__room_indexes.pop(id(old), None)
+        self.__exit_tables.pop(id(old), None)
+
+        try:
+            if self.__rooms_by_id.get(old.id, None) is old: self.__rooms_by_id[old.id] = new
+        except TypeError: # Unhashable id
+            pass
+
+    def __leave(self, current_entity):
+        """Does what the builtin leave action does, from the exit table of the room. Returns False if the yaml action has to run instead"""
+
+        table = self.__exitTableFor(self.current_room)
+        if table.exits is None: return False
+
+        try:
+            found = table.find(current_entity["id"])
+        except (TypeError, KeyError): # Unhashable id, or an entity without one
+            return False
+
+        if found is None:
+            self.world_flags["loop_found_val"] = 0
+            self.__flags_dirty = True
+            return True
+
+        kind, generator, exit_id, data = found
+        if kind == "yaml": return False
+
+        self.world_flags["loop_found_val"] = dc(generator) # Like set does, changing the flag doesn't change the room
+        self.__flags_dirty = True
+
+        match kind:
+            case "room":
+                self.__leaveTo(data, exit_id)
+            case "random":
+                room = data.choose(self.random.stream("world"))
+                self.random_pool = data.copy() # Scripts can add to the pool the leave action filled
+                self.world_flags["_random"] = room
+                self.__leaveTo(room, exit_id)
+            case "plugin":
+                self.__callScript(data)
+
+        return True
+
+    def __leaveTo(self, room, exit_id):
+        self.changeRoom(room)
+
+        try:
+            self.spawnPlayerAtLinkedExit(exit_id)
+        except SpawnNotFoundException:
+            self.spawnPlayerAtRoot()
+
+    def __exitTableFor(self, room):
+        table = self.__exit_tables.get(id(room), None)
+        if table is not None and not table.isStale(room, self.__exit_generation): return table
+
+        table = ExitTable(room, self.__exit_generation)
+        try:
+            for generator in room.generators or []:
+                exit_id = generator["exit"]
+
+                try:
+                    kind, data = self.__compileExit(generator)
+                except (TypeError, KeyError, ValueError, AttributeError, IndexError, ScriptNotFoundError): # The yaml action runs for this exit, and fails where it always did
+                    kind, data = "yaml", None
+
+                compiled = (kind, generator, exit_id, data)
+
+                if exit_id is None: # Matches every exit, so the generators below it are never reached
+                    table.match_all = compiled
+                    break
+
+                table.exits.setdefault(exit_id, compiled)
+        except (TypeError, KeyError, AttributeError): # Unhashable exit id, or a generator without one
+            table.exits = None
+
+        self.__exit_tables[id(room)] = table
+        return table
+
+    def __compileExit(self, generator):
+        """Returns (kind, data) of a generator: ("room", room id) for forced, and conditional with a matching condition. ("random", pool), ("plugin", function),
+        and ("none", None) for anything that doesn't leave the room"""
+
+        match generator["type"]:
+            case "forced":
+                return ("room", generator["room"])
+            case "conditional":
+                # a and b are values, not templates, so every condition is decided here
+                for condition in generator["conditions"]:
+                    match condition["type"]:
+                        case "if":
+                            if COMPARISONS[condition["op"]](condition["a"], condition["b"]): return ("room", condition["room"])
+                        case "room":
+                            return ("room", condition["room"])
+            case "random":
+                pool = WeightedPool()
+                for option in generator["pool"]: pool.add(option["room"], option["weight"])
+
+                return ("random", pool)
+            case "plugin":
+                module, func = generator["handler"].split(":")
+                if module not in self.world_scripts: raise ScriptNotFoundError(f"Script '{module}' has not been loaded")
+
+                return ("plugin", getattr(self.world_scripts[module], func))
+
+        return ("none", None)
+
+    def __rebuildRoomIDIndex(self):
+        self.__rooms_by_id = {}
+        self.__rooms_indexed = self.rooms
+        self.__rooms_indexed_count = len(self.rooms)
+
+        for room in self.rooms:
+            try:
+                self.__rooms_by_id.setdefault(room.id, room)
+            except TypeError: # Unhashable id
+                pass
+
+    def __loadRoomManifest(self):
+        self.__room_manifest = RoomManifest(self.world_dir)
+        self.__room_manifest.refresh()
+
+        loaded = set()
+        for room in self.rooms: # Rooms from a save
+            if type(room.get("id", None)) in (str, int): loaded.add(room.id)
+
+        for file, entry in self.__room_manifest.files.items():
+            if entry["id"] in loaded and type(entry["id"]) in (str, int): continue
+
+            path = os.path.join(self.world_dir, file)
+            self.__unparsed_room_files[path] = entry["id"]
+            if type(entry["id"]) in (str, int): self.__unparsed_rooms.setdefault(entry["id"], path)
+
+    def __readRoomFile(self, path):
+        """Parses a room file, or takes it from the world cache. Safe to run on the prefetch thread, it only reads from the engine
+
+        Returns:
+            tuple: (room, digest, cached). Cached rooms already have their action maps applied
+        """
+
+        with open(path, "rb") as f:
+            data = f.read()
+
+        digest = (hashBytes(data), self.__action_maps_digest) # Cached rooms contain the action maps
+        if self.world_cache:
+            room = self.world_cache.get(os.path.relpath(path, self.world_dir), digest)
+            if room is not None: return room, digest, True
+
+        start = time.perf_counter()
+        room = toRoom(loadYaml(data))
+        self.room_parse_times[os.path.relpath(path, self.world_dir)] = time.perf_counter() - start
+
+        return room, digest, False
+
+    def __parseRoomFiles(self, paths):
+        """Parses room files that aren't in the world cache or already prefetched across worker processes
+
+        Returns:
+            dict: Path -> (room, digest, cached)
+        """
+
+        # Worker processes are forked, other start methods would run the entry program again in every worker
+        if PARALLEL_PARSE_WORKERS == 1 or "fork" not in multiprocessing.get_all_start_methods(): return {}
+
+        missing = []
+        for path in paths:
+            if path in self.__prefetched_rooms: continue
+
+            if self.world_cache:
+                with open(path, "rb") as f:
+                    digest = (hashBytes(f.read()), self.__action_maps_digest)
+
+                if self.world_cache.isValid(os.path.relpath(path, self.world_dir), digest): continue
+
+            missing.append(path)
+
+        if len(missing) < PARALLEL_PARSE_THRESHOLD: return {}
+
+        workers = PARALLEL_PARSE_WORKERS or os.cpu_count() or 1
+        if workers == 1: return {}
+
+        # A thread holding a lock while the process forks leaves that lock held forever in the workers. Prefetched rooms
+        # stay in __prefetched_rooms, the prefetcher is started again for the next prefetch
+        if self.__room_prefetcher is not None:
+            self.__room_prefetcher.shutdown(wait=True)
+            self.__room_prefetcher = None
+
+        parsed = {}
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as pool:
+            results = pool.map(parseRoomFile, missing, chunksize=max(1, len(missing) // (workers * 4)))
+
+            for path, (room, file_digest, seconds) in zip(missing, results):
+                parsed[path] = (room, (file_digest, self.__action_maps_digest), False)
+                self.room_parse_times[os.path.relpath(path, self.world_dir)] = seconds
+
+        return parsed
+
+    def __loadRoomFile(self, path):
+        """Loads a room file into the world, using the prefetched room if there is one"""
+
+        future = self.__prefetched_rooms.pop(path, None)
+        return self.__addRoomFile(path, *(future.result() if future else self.__readRoomFile(path)))
+
+    def __addRoomFile(self, path, room, digest, cached):
+        """Adds a parsed room to the world"""
+
+        if cached:
+            self.__shareActions([room]) # Every cached room was pickled with tables of its own
+        else:
+            self.__applyActionMap(room)
+            if self.world_cache: self.world_cache.put(os.path.relpath(path, self.world_dir), digest, room)
+
+        room_id = self.__unparsed_room_files.pop(path)
+        if self.__unparsed_rooms.get(room_id, None) == path: del self.__unparsed_rooms[room_id]
+
+        # Add the room to the room ID index directly instead of rebuilding it
+        indexed = self.__rooms_indexed is self.rooms and len(self.rooms) == self.__rooms_indexed_count
+        if self.__loops: self.__detachLoops(self.rooms) # Scripts can load rooms while going through them
+        self.rooms.append(room)
+
+        if indexed:
+            self.__rooms_indexed_count += 1
+            if type(room.get("id", None)) in (str, int): self.__rooms_by_id.setdefault(room.id, room)
+
+        return room
+
+    def __prefetchExits(self, room):
+        """Starts parsing the rooms the generators of a room can lead to on a background thread"""
+
+        if not room or not self.__unparsed_rooms: return
+
+        targets = []
+        for generator in room.get("generators", None) or []:
+            targets.append(generator.get("room", None))
+            for option in (generator.get("conditions", None) or []) + (generator.get("pool", None) or []):
+                targets.append(option.get("room", None))
+
+        for target in targets:
+            if type(target) not in (str, int): continue
+
+            path = self.__unparsed_rooms.get(target, None)
+            if path is None or path in self.__prefetched_rooms: continue
+
+            if self.__room_prefetcher is None: self.__room_prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="room-prefetch")
+            self.__prefetched_rooms[path] = self.__room_prefetcher.submit(self.__readRoomFile, path)
+
+    def __renderRoomsStep(self, step):
+        """Renders a step on PSEngine.rooms while some rooms aren't loaded. Looking up a room by id only loads that room, anything else loads every room"""
+
+        if type(step) == tuple and step[0] == "id":
+            try:
+                return self.findRoomByID(step[1])
+            except RoomNotFoundException:
+                raise ItemNotFoundException(f"Cannot find item in the array {self.rooms} which has parameter 'id' set to '{step[1]}'")
+
+        self.loadAllRooms()
+        return self.__renderStep(self.rooms, step)
+
+    def __getRoomGrid(self, room):
+        index = self.__roomIndexFor(room)
+        tiles = self.registry.blocking_tiles
+        if index.isGridStale(tiles): index.rebuildGrid(tiles, tiles)
+
+        return index
+
+    def __trackMutation(self, template, current_item=None):
+        """Marks what a template assigns to as changed for the next save, and invalidates room indexes if they depend on it.
+        Returns current_item, or the copy to change instead if it is a shared room"""
+
+        steps = compileTemplate(template)[0]
+
+        match steps[0]:
+            case "flags": self.__flags_dirty = True
+            case "player": self.player.dirty = True
+            case "current_room": self.markDirty(self.current_room)
+            case "current_entity": self.markDirty(self.__script_room)
+            case "rooms":
+                if len(steps) > 1:
+                    room = self.__editableRoomOf(steps)
+                    if room is not None: self.markDirty(room)
+            case "current_item":
+                loop = self.__item_loop
+                if loop is not None:
+                    match loop.root:
+                        case "flags": self.__flags_dirty = True
+                        case "player": self.player.dirty = True
+                        case "rooms":
+                            current_item = self.editableRoom(current_item)
+                            self.markDirty(current_item)
+                        case "room": self.markDirty(self.editableRoom(loop.room))
+
+        # Generators can be reached through rooms, loop items and flags holding one, like loop_found_val does
+        if "generators" in steps or steps[0] == "current_item" or (steps[0] == "flags" and len(steps) > 2): self.__exit_generation += 1
+
+        if not self.__indexed_fields.isdisjoint(steps):
+            self.__entity_generation += 1
+            if "id" in steps: self.__rooms_indexed = None
+
+        return current_item
+
+    def __editableRoomOf(self, steps):
+        """Returns the editable room a rooms[...] template goes through, see editableRoom. None if the template will fail"""
+
+        try:
+            return self.editableRoom(self.__renderStep(self.rooms, steps[1]))
+        except (KeyError, IndexError, ItemNotFoundException):
+            return None
+
     def __loadCustomActionMaps(self):
         maps = {"builtin": self.builtin.action_maps}
+        digest = [self.__builtin_digest]
 
-        if not os.path.exists(os.path.join(self.world_dir, "action_maps")): return maps
+        if os.path.exists(os.path.join(self.world_dir, "action_maps")):
+            for action_map in os.listdir(os.path.join(self.world_dir, "action_maps")):
+                action_map = os.path.join(self.world_dir, "action_maps", action_map)
 
-        for action_map in os.listdir(os.path.join(self.world_dir, "action_maps")):
-            action_map = os.path.join(self.world_dir, "action_maps", action_map)
+                if not os.path.isfile(action_map): continue
 
-            if not os.path.isfile(action_map): continue
+                with open(action_map, "rb") as f:
+                    data = f.read()
+                    maps[os.path.splitext(action_map)[0]] = toDotdict(json.loads(data))
+                    digest.append(os.path.basename(action_map) + ":" + hashBytes(data))
 
-            with open(action_map, "r") as f:
-                maps[os.path.splitext(action_map)[0]] = toDotdict(json.load(f))
+        self.__action_maps_digest = hashBytes("\n".join(digest).encode()) # Rooms are cached with their action maps applied
 
         return maps
 
-    def __loadActionMap(self):
-        """Replaces action_map entries in entities with the correct actions from said mapping"""
+    def __cachedParse(self, key, digest, parse):
+        """Returns the cached result of parse, or runs it and caches the result"""
 
-        action_maps = self.__loadCustomActionMaps()
+        if not self.world_cache: return parse()
 
-        for room in self.rooms:
-            for entity in room.entities:
-                if not entity.get("actions", {}).get("action_map", None): continue
+        value = self.world_cache.get(key, digest)
+        if value is None:
+            value = parse()
+            self.world_cache.put(key, digest, value)
+
+        return value
+
+    def __applyActionMap(self, room):
+        """Replaces action_map entries in entities with the correct actions from said mapping. Entities with the same actions share one ActionTable dict"""
+
+        action_maps = self.__action_maps
+        tables = self.__action_tables
+
+        for entity in room.entities:
+            if not entity.get("actions", {}).get("action_map", None): continue
+
+            try:
+                key = tuple(entity.actions.items()) # The action map and the actions it changes
+                table = tables.get(key, None)
+            except TypeError: # Something unhashable in the actions, the entity gets a table of its own
+                key = table = None
 
+            if table is None:
                 map_namespace, map_entity = entity.actions.action_map.split("/")
-                replaced_map = dc(action_maps[map_namespace][map_entity])
+                table = dotdict(action_maps[map_namespace][map_entity])
 
                 for action, func in entity.actions.items():
                     if action == "action_map": continue
 
-                    replaced_map[action] = func
+                    table[action] = func
+
+                if key is not None: tables[key] = table
+
+            entity.actions = ActionTable(table, key is not None)
+
+    def __shareActions(self, rooms):
+        """Makes entities of saved and cached rooms with the same actions share one ActionTable dict, like after __applyActionMap"""
 
-                entity.actions = replaced_map
+        tables = self.__action_tables
+
+        for room in rooms:
+            for entity in room.get("entities", None) or []:
+                actions = entity.get("actions", None)
+                if not isinstance(actions, (dict, ActionTable)): continue
+
+                try:
+                    key = ("saved",) + tuple(actions.items())
+                    table = tables.get(key, None)
+                except TypeError: # Something unhashable in the actions, keep them as they are
+                    continue
+
+                if table is None:
+                    table = tables[key] = actions if isinstance(actions, dict) else dotdict(actions.toDict())
+
+                entity.actions = ActionTable(table)
 
     def __loadAddons(self):
         if not os.path.exists(os.path.join(self.world_dir, "addons")): return
 
+        addons = []
         for addon in os.listdir(os.path.join(self.world_dir, "addons")):
             path = os.path.join(self.world_dir, "addons", addon)
 
             if not os.path.isfile(path): continue
 
             with open(path, "r") as f:
-                loaded = json.load(f)
-
-                for entity, char in loaded.get("etc_map", {}).items():
-                    ETC_MAP[entity] = char
+                addons.append(json.load(f))
 
-                for item in loaded.get("uam", []): # User Advanced Movement
-                    USER_ADVANCED_MOVEMENT.append(item)
-
-                for item in loaded.get("entities", []):
-                    ENTITIES.append(item)
-
-                for item in loaded.get("blocking_tiles", []):
-                    BLOCKING_TILES.append(item)
+        self.registry = WorldRegistry.fromAddons(addons)
 
     def __loadUserScripts(self): # .py not .yaml
         if not os.path.exists(os.path.join(self.world_dir, "scripts")): return
 
-        print(CUSTOM_SCRIPT_WARNING, end="")
-        while True:
-            char = getch().lower()
-            if char == "n": exit(-1)
-            elif char == "y": break
-        print()
+        self.renderer.write(CUSTOM_SCRIPT_WARNING)
+        if self.__prompt("custom_scripts", ["y", "n"]) == "n": raise ScriptsDeclinedException(-1)
+        self.renderer.write("\n")
 
         for script in os.listdir(os.path.join(self.world_dir, "scripts")):
             path = os.path.join(self.world_dir, "scripts", script)
@@ -790,37 +2328,115 @@ class PSEngine:
             module = importlib.util.module_from_spec(spec)
             spec.loader.exec_module(module)
 
-            module.init(self)
+            module.init(self) # Scripts can subscribe to more events here, with engine.hooks
             self.world_scripts[os.path.splitext(script)[0]] = module
+            self.hooks.subscribeModule(os.path.splitext(script)[0], module)
 
     def __loadBaseActions(self):
-        self.actions["builtin"] = {}
+        self.actions = toDotdict(self.actions)
+        self.actions["builtin"], self.programs["builtin"] = self.__cachedParse("<builtin>", self.__builtin_digest, self.__parseBaseActions)
+        self.__builtin_leave = self.programs["builtin"]["leave"] # A world replacing it replaces the program, so it runs as yaml
+
+    def __parseBaseActions(self):
+        actions = dotdict()
 
         for name, func in self.builtin.actions.items():
-            parsed = yaml.full_load(func)
-            self.actions["builtin"][name] = parsed
+            actions[name] = toDotdict(loadYaml(func))
 
-        self.actions = toDotdict(self.actions)
+        return actions, {name: self.__compileScript(func) for name, func in actions.items()}
 
     def __loadActions(self):
         self.__loadBaseActions()
         
         if not os.path.exists(os.path.join(self.world_dir, "actions")): return
-        
+
         for action in os.listdir(os.path.join(self.world_dir, "actions")):
             path = os.path.join(self.world_dir, "actions", action)
             namespace = os.path.splitext(action)[0]
 
             if not os.path.isfile(path): continue
 
-            with open(path, "r") as f:
-                loaded = yaml.full_load(f)
+            with open(path, "rb") as f:
+                data = f.read()
 
-                for name, func in loaded.items():
-                    self.actions[namespace] = {}
-                    self.actions[namespace][name] = func
+            actions, programs = self.__cachedParse(os.path.join("actions", action), hashBytes(data), lambda: self.__parseActions(data))
 
-        self.actions = toDotdict(self.actions)
+            self.actions.setdefault(namespace, dotdict()).update(actions)
+            self.programs.setdefault(namespace, {}).update(programs)
+
+    def __parseActions(self, data):
+        """Parses and compiles an action file. Returns (actions, programs)"""
+
+        actions = toDotdict(loadYaml(data))
+
+        return actions, {name: self.__compileScript(func) for name, func in actions.items()}
+
+    def __compileScript(self, script) -> tuple:
+        """Compiles a parsed yaml action into a flat program.
+
+        Every instruction is a tuple of (opcode, operand, target). Target is the jump destination used by control flow opcodes:
+         - if: Where to jump if the condition is false (past the exec block)
+         - else: Where to jump if the previous condition was true (past the else block). Its operand is the index of the
+           if or else before it in the same block, or None if there isn't one
+         - for: Where to jump if there is nothing to iterate (past the loop)
+         - next: Where to jump to run the next iteration (start of the exec block)
+        """
+
+        code = []
+        self.__compileBlock(script, code)
+
+        return tuple(code)
+
+    def __compileBlock(self, block, code):
+        if not block: return
+
+        last_condition = None # The if or else an else belongs to, ifs in other blocks don't count
+        for entry, data in block.items():
+            opcode = OPCODES.get(entry.split("#")[0], None) # Entry is what to do, data is data passed to the entry.
+
+            if opcode == None: continue # Unknown calls are ignored
+
+            if opcode == OP_IF:
+                start = len(code)
+                code.append(None)
+                self.__compileBlock(data.get("exec", None), code)
+                code[start] = (OP_IF, self.__compileCondition(data), len(code))
+                last_condition = start
+            elif opcode == OP_ELSE:
+                start = len(code)
+                code.append(None)
+                self.__compileBlock(data, code)
+                code[start] = (OP_ELSE, last_condition, len(code))
+                last_condition = start
+            elif opcode == OP_FOR:
+                start = len(code)
+                code.append(None)
+                self.__compileBlock(data.get("exec", None), code)
+                code.append((OP_NEXT, None, start + 1))
+                code[start] = (OP_FOR, data, len(code))
+            elif opcode in (OP_CHANGE_ROOM, OP_SPAWN_PLAYER):
+                code.append((opcode, self.__compileOperand(data), None))
+            else:
+                code.append((opcode, data, None))
+
+    def __compileOperand(self, operand):
+        """Returns a tuple of (is_template, value), value is already parsed if it isn't a template"""
+
+        if self.__isTemplate(operand): return (True, operand)
+        return (False, self.__parseImmediate(operand))
+
+    def __compileCondition(self, params):
+        """Pre-parses an if call into (a, b, op), where every field is from __compileOperand"""
+
+        a = self.__compileOperand(params.a)
+        b = self.__compileOperand(params.b)
+
+        if params.op in ("==", "=!", "<", ">", "<=", ">="):
+            op = (False, params.op)
+        else:
+            op = (True, params.op)
+
+        return (a, b, op)
 
     def __buildStateMap(self, current_entity, current_item):
         player_map = {"inventory": self.player.inventory, "coords": {"x": self.player.coords[0], "y": self.player.coords[1]}, "hp": self.player.hp, "max_hp": self.player.max_hp, "level": self.player.level}
@@ -829,34 +2445,34 @@ class PSEngine:
     
     def __renderTemplate(self, template, state_map, skip_last=0):
         # Renders the template only, does not assing. Returns the sub-indexed whatnot state_map
-        #cur_state_map = dc(state_map)
-
-        items = template.split(".")
-        end = len(items) if skip_last == 0 else -skip_last
+        inst = self.instrumentation
+        if inst: start = time.perf_counter_ns()
 
-        for item in items[:end]:
-            if "[" in item:
-                start = item.index("[")
-                extracted = item[start + 1:-1]
+        steps, last, _ = compileTemplate(template, skip_last)
 
-                if extracted.isnumeric():
-                    # Get item at index
-                    state_map = state_map[item[:start]]
-                    state_map = state_map[int(extracted)]
-                else:
-                    # Get item with parameter
-                    param, value = extracted.split(":")
-                    state_map = state_map[item[:start]]
-                    state_map = self.findItemInArrayByParameter(state_map, param, value)
+        for step in steps:
+            if state_map is self.rooms and self.__unparsed_room_files:
+                state_map = self.__renderRoomsStep(step)
+            elif type(step) == tuple:
+                state_map = self.findItemInArrayByParameter(state_map, step[0], step[1])
             else:
-                state_map = state_map[item]
+                state_map = state_map[step]
+
+        if state_map is self.rooms: self.loadAllRooms() # Every room is needed
+
+        if inst: inst.record("template", time.perf_counter_ns() - start)
 
-        return state_map, items[-1]
+        return state_map, last
+
+    def __renderStep(self, state_map, step):
+        if state_map is self.rooms and self.__unparsed_room_files: return self.__renderRoomsStep(step)
+        if type(step) == tuple: return self.findItemInArrayByParameter(state_map, step[0], step[1])
+        return state_map[step]
     
     def __isTemplate(self, template):
         if template == None: return False
         if template == True or template == False: return False # Bool
-        if type(template) == int: return False # Number
+        if type(template) in (int, float): return False # Number
         if template.startswith("STR:"): return False # String
 
         return True # Might leave some edge cases
@@ -864,7 +2480,7 @@ class PSEngine:
     def __parseImmediate(self, text):
         if text == None: return None
         if type(text) == bool: return text
-        if type(text) == int: return text
+        if type(text) in (int, float): return text
         return text.replace("STR:", "")
     
     def _handlerExists(self, handler, action):
@@ -875,71 +2491,132 @@ class PSEngine:
 
         return namespace, func
 
-    def _script_engine(self, script, current_entity):
-        queue = []
-        current_item = None
-        item_array = None
-        flag_manual_break = False
-        while script:
-            entry, data = script.pop(0) # Entry is what to do, data is data passed to the entry.
-            entry = entry.split("#")[0]
-
-            match entry:
-                case "display_text": self.__action_displaytext(data, current_entity, current_item)
-                case "show_content": self.__action_showcontent(data, current_entity, current_item)
-                case "set": self.__action_set(data, current_entity, current_item)
-                case "add": self.__action_add(data, current_entity, current_item)
-                case "remove": self.__action_remove(data, current_entity, current_item)
-                case "py": self.__action_py(data, current_entity, current_item)
-                case "change_room": self.__action_changeroom(data, current_entity, current_item)
-                case "random": self.__action_random(data, current_entity, current_item)
-                case "spawn_player": self.__action_spawnplayer(data, current_entity, current_item)
-                case "break": flag_manual_break = True
-                case "damage_player": self.__action_damageplayer(data, current_entity, current_item)
-                case "heal_player": self.__action_healplayer(data, current_entity, current_item)
-                case "raise":
+    # --------------------------------------
+    # INSTRUMENTATION
+    # --------------------------------------
+    def __timer(self, name):
+        # For anything that isn't hot enough for the context manager to matter
+        if self.instrumentation: return self.instrumentation.timer(name)
+        return NO_TIMER
+
+    def __lap(self, name, start):
+        now = time.perf_counter_ns()
+        self.instrumentation.record(name, now - start)
+        return now
+
+    def _script_engine(self, program, current_entity):
+        if self.__script_depth == 0: self.__script_room = self.current_room
+
+        self.__script_depth += 1
+        try:
+            with self.__timer("script"):
+                if program is not self.__builtin_leave or not self.__leave(current_entity):
+                    self.__runProgram(program, current_entity)
+        finally:
+            self.__script_depth -= 1
+
+    def __runProgram(self, program, current_entity):
+        # Raised events run after the program that raised them, and before the next event that program raised.
+        # They are kept on a stack instead of recursing, so long chains of events don't hit the recursion limit.
+        pending = [(program, current_entity)]
+
+        while pending:
+            program, current_entity = pending.pop()
+            raised = self.__runFrame(program, current_entity)
+            pending.extend(reversed(raised))
+
+    def __runFrame(self, program, current_entity) -> list:
+        """Runs one program. Returns the (program, entity) of every event it raised, in order"""
+
+        if type(program) != tuple: program = self.__compileScript(toDotdict(dict(program))) # Uncompiled script
+
+        handlers = self.__script_handlers
+        inst = self.instrumentation
+        raised = []
+        loops = self.__loops # Shared with py scripts that run scripts, and with actions that change lists
+        outer_loops = len(loops)
+        results = [False] * len(program) # Result of every if and else that ran, by index
+        current_item = None # Stays the last item after a loop, scripts use it after breaking out
+        item_loop = None # The loop current_item came from
+        pc = 0
+        end = len(program)
+        try:
+            while pc < end:
+                opcode, data, target = program[pc]
+                pc += 1
+                if inst: start = time.perf_counter_ns()
+
+                if opcode > OP_RAISE:
+                    self.__item_loop = item_loop # Scripts that run scripts change it
+                    changed = handlers[opcode](data, current_entity, current_item)
+                    if changed is not None: current_item = changed # set, add and remove return the copy of a shared room they changed
+                elif opcode == OP_IF:
+                    status = results[pc - 1] = self.__action_if(data, current_entity, current_item)
+                    if not status: pc = target
+                elif opcode == OP_ELSE:
+                    results[pc - 1] = True
+                    if data is not None and results[data]: pc = target
+                elif opcode == OP_FOR:
+                    root, room = self.__loopOwner(data.iter)
+                    loop = LoopFrame(self.__action_for(data, current_entity), root, room)
+                    item = loop.next()
+
+                    if item is LOOP_END:
+                        pc = target
+                    else:
+                        current_item = item
+                        item_loop = loop
+                        loops.append(loop)
+                elif opcode == OP_NEXT:
+                    loop = loops[-1]
+                    item = LOOP_END if loop.broken else loop.next()
+
+                    if item is LOOP_END:
+                        loops.pop()
+                    else:
+                        current_item = item
+                        item_loop = loop
+                        pc = target
+                elif opcode == OP_BREAK:
+                    if len(loops) > outer_loops: loops[-1].broken = True
+                elif opcode == OP_RAISE:
                     handler, entity_of_event = self.__action_raise(data, current_entity, current_item)
                     namespace, new_func = self._handlerExists(handler, data)
-                    new_func = list(self.actions[namespace][new_func].items())
-                    queue.append((new_func, entity_of_event))
-                case "if":
-                    status = self.__action_if(data, current_entity, current_item)
-
-                    if status:
-                        for call, call_data in list(data.exec.items())[::-1]:
-                            script.insert(0, (call, call_data))
-                case "else":
-                    if not status:
-                        status = True
-                        for call, call_data in list(data.items())[::-1]:
-                            script.insert(0, (call, call_data))
-                case "for":
-                    flag_break = False
-                    if data.iter == "CONT":
-                        index = item_array.index(current_item)
-                        index += 1
-
-                        if index == len(item_array):
-                            flag_break = True
-                        else:
-                            current_item = item_array[index]
-                    else:
-                        item_array = dc(self.__action_for(data, current_entity)) # Unlink to allow for modification while running
-                        if len(item_array) > 0: current_item = item_array[0]
-                        else: flag_break = True
+                    raised.append((self.programs[namespace][new_func], entity_of_event))
+
+                if inst: inst.record("script/" + OPCODE_NAMES[opcode], time.perf_counter_ns() - start)
+        finally:
+            del loops[outer_loops:]
+
+        return raised
+
+    def __loopOwner(self, template):
+        """Returns the root and room of a LoopFrame going through template, so changes to its items can be saved.
+        Call it before the for renders template, a shared room is copied so the loop goes through the items of the copy"""
+
+        steps = compileTemplate(template)[0]
 
-                    if flag_manual_break:
-                        flag_break = True
-                        flag_manual_break = False
+        match steps[0]:
+            case "flags" | "player": return steps[0], None
+            case "current_room": return "room", self.current_room
+            case "current_entity": return "room", self.__script_room
+            case "rooms":
+                if len(steps) == 1: return "rooms", None # set, add and remove copy the shared room they change
 
-                    if not flag_break:
-                        script.insert(0, ("for", toDotdict({"iter": "CONT", "exec": data.exec})))
+                room = self.__editableRoomOf(steps)
+                if room is not None: return "room", room
 
-                        for call, call_data in list(data.exec.items())[::-1]:
-                            script.insert(0, (call, call_data))
+        return None, None
 
-        for item, entity in queue:
-            self._script_engine(item, entity)
+    def __detachLoops(self, array=None):
+        """Call before changing a list, so loops going through it keep going through the list they started with
+
+        Args:
+            array (list, optional): The list that changes. Defaults to every list, for scripts that can change anything.
+        """
+
+        for loop in self.__loops:
+            if array is None or loop.items is array: loop.detach()
 
     # --------------------------------------
     # ACTIONS
@@ -970,34 +2647,50 @@ class PSEngine:
         self.render(narration=content_str, skip_next=True)
 
     def __action_set(self, params, current_entity, current_item):
+        current_item = self.__trackMutation(params.field, current_item) # First, so a shared room is copied before the template finds the fields in it
         state_map = self.__buildStateMap(current_entity, current_item)
         fields, last = self.__renderTemplate(params.field, state_map, 1)
+        if self.__loops and type(fields) == list: self.__detachLoops(fields)
         
         if params.get("value", None) != None:
-            fields[last] = params.value
+            fields[last] = self.__ownValue(params.value)
         elif params.get("value_template", None):
             value = self.__renderTemplate(params.value_template, state_map)[0]
-            fields[last] = value
+            fields[last] = self.__ownValue(value)
+
+        return current_item
 
     def __action_add(self, params, current_entity, current_item):
+        current_item = self.__trackMutation(params.field, current_item)
         state_map = self.__buildStateMap(current_entity, current_item)
         field = self.__renderTemplate(params.field, state_map)[0]
 
         if type(field) != list:
             raise InvalidTemplateException(f"Action: for\nTemplate: {params.field}\nFinal value: {field}\nFinal value is not an acceptable type\nType is: {type(field)}, accetable is list\n\nValues:\nstate_map: {state_map}")
 
+        if self.__loops: self.__detachLoops(field)
         if params.get("value", None):
-            field.append(params.value)
+            field.append(self.__ownValue(params.value))
         elif params.get("value_template", None):
-            field.append(self.__renderTemplate(params.value_template, state_map)[0])
+            field.append(self.__ownValue(self.__renderTemplate(params.value_template, state_map)[0]))
+
+        return current_item
+
+    def __ownValue(self, value):
+        """Returns a copy of a list, dict or model that set or add puts somewhere, so one object is never in two places.
+        Loops hand out the items themselves, and values from the script would be shared by every run of it"""
+
+        return dc(value) if isinstance(value, (dict, list, Model)) else value
 
     def __action_remove(self, params, current_entity, current_item):
+        current_item = self.__trackMutation(params.field, current_item)
         state_map = self.__buildStateMap(current_entity, current_item)
         field = self.__renderTemplate(params.field, state_map)[0]
 
         if type(field) != list:
             raise InvalidTemplateException(f"Action: for\nTemplate: {params.field}\nFinal value: {field}\nFinal value is not an acceptable type\nType is: {type(field)}, accetable is list\n\nValues:\nstate_map: {state_map}")
 
+        if self.__loops: self.__detachLoops(field)
         if params.get("idx", None):
             del field[params.idx]
         elif params.get("param", None):
@@ -1005,7 +2698,13 @@ class PSEngine:
             item = self.findItemInArrayByParameter(field, param, self.__parseImmediate(value))
             field.remove(item)
 
+        return current_item
+
     def __action_raise(self, template, current_entity, current_item):
+        if self.__shared_world is not None:
+            steps = compileTemplate(template)[0]
+            if steps[0] == "rooms" and len(steps) > 1: self.__editableRoomOf(steps) # The event can change the entity it runs for
+
         state_map = self.__buildStateMap(current_entity, current_item)
         handler = self.__renderTemplate(template, state_map)[0]
         parent_entity = self.findEntityFromTemplate(template, state_map)
@@ -1013,19 +2712,13 @@ class PSEngine:
 
     def __action_if(self, params, current_entity, current_item):
         state_map = self.__buildStateMap(current_entity, current_item)
-        a_status = self.__isTemplate(params.a)
-        b_status = self.__isTemplate(params.b)
+        (a_status, a), (b_status, b), (op_status, op) = params # Compiled by __compileCondition
 
-        if a_status: a = self.__renderTemplate(params.a, state_map)[0]
-        else: a = self.__parseImmediate(params.a)
+        if a_status: a = self.__renderTemplate(a, state_map)[0]
+        if b_status: b = self.__renderTemplate(b, state_map)[0]
 
-        if b_status: b = self.__renderTemplate(params.b, state_map)[0]
-        else: b = self.__parseImmediate(params.b)
-
-        if params.op in ("==", "=!", "<", ">", "<=", ">="):
-            op = params.op
-        else:
-            op = self.__renderTemplate(params.op, state_map)
+        if op_status:
+            op = self.__renderTemplate(op, state_map)[0]
 
         match op:
             case "==":
@@ -1041,7 +2734,7 @@ class PSEngine:
             case ">=":
                 if a >= b: return True
             case _:
-                raise InvalidOperatorException(f"Received operator '{op}' which is invalid.\nOriginal value: {params.op}")
+                raise InvalidOperatorException(f"Received operator '{op}' which is invalid.\nOriginal value: {params[2][1]}")
 
         return False
     
@@ -1064,39 +2757,53 @@ class PSEngine:
 
         if module not in self.world_scripts: raise ScriptNotFoundError(f"Script '{module}' has not been loaded")
 
-        func = getattr(self.world_scripts[module], func)
+        self.__callScript(getattr(self.world_scripts[module], func))
+
+    def __callScript(self, func):
+        self.__detachLoops()
         func()
+        self.__scriptRan()
+
+    def __scriptRan(self):
+        """Call after a py script or a hook ran, they can change anything"""
+
+        self.invalidateRoomIndexes()
+        self.markDirty(self.current_room)
+        if self.__script_depth: self.markDirty(self.__script_room) # Hooks also run outside of scripts
+        self.__flags_dirty = True
+        self.player.dirty = True
 
     def __action_changeroom(self, params, current_entity, current_item):
-        state_map = self.__buildStateMap(current_entity, current_item)
-        status = self.__isTemplate(params)
+        status, room = params # Compiled by __compileOperand
 
-        if status: room = self.__renderTemplate(params, state_map)[0]
-        else: room = self.__parseImmediate(params)
+        if status:
+            state_map = self.__buildStateMap(current_entity, current_item)
+            room = self.__renderTemplate(room, state_map)[0]
 
         self.changeRoom(room)
 
     def __action_random(self, params, current_entity, current_item):
         state_map = self.__buildStateMap(current_entity, current_item)
+        rng = self.random.stream("world")
 
         if params.get("action", None) == None:
-            self.random_choices = []
+            self.random_pool = WeightedPool()
             for option, weight in params.items():
                 status = self.__isTemplate(option)
 
                 if status: option = self.__renderTemplate(option, state_map)[0]
                 else: option = self.__parseImmediate(option)
 
-                self.random_choices.extend([option] * weight)
+                self.random_pool.add(option, weight)
 
-            chosen = random.choice(self.random_choices)
-
-            self.world_flags["_random"] = chosen
+            self.world_flags["_random"] = self.random_pool.choose(rng)
+            self.__flags_dirty = True
         else:
             if params.action == "reset":
-                self.random_choices = []
+                self.random_pool = WeightedPool()
             elif params.action == "start":
-                self.world_flags["_random"] = random.choice(self.random_choices)
+                self.world_flags["_random"] = self.random_pool.choose(rng)
+                self.__flags_dirty = True
             elif params.action == "add":
                 for option, weight in params.data.items():
                     status_option = self.__isTemplate(option)
@@ -1108,14 +2815,14 @@ class PSEngine:
                     if status_weight: weight = self.__renderTemplate(weight, state_map)[0]
                     else: weight = self.__parseImmediate(weight)
 
-                    self.random_choices.extend([option] * weight)
+                    self.random_pool.add(option, weight)
 
     def __action_spawnplayer(self, params, current_entity, current_item):
-        state_map = self.__buildStateMap(current_entity, current_item)
-        status = self.__isTemplate(params)
+        status, exit_id = params # Compiled by __compileOperand
 
-        if status: exit_id = self.__renderTemplate(params, state_map)[0]
-        else: exit_id == self.__parseImmediate(params)
+        if status:
+            state_map = self.__buildStateMap(current_entity, current_item)
+            exit_id = self.__renderTemplate(exit_id, state_map)[0]
 
         try:
             self.spawnPlayerAtLinkedExit(exit_id)
@@ -1130,6 +2837,19 @@ class PSEngine:
         else:
             self.player.damage(params)
 
+    def __action_schedule(self, params, current_entity, current_item):
+        handler, entity_of_event = self.__action_raise(params.handler, current_entity, current_item)
+        namespace, func = self._handlerExists(handler, params.handler)
+
+        delay = params.get("delay", None)
+        if type(delay) == str: delay = self.__renderTemplate(delay, self.__buildStateMap(current_entity, current_item))[0]
+
+        if type(delay) not in (int, float):
+            raise InvalidTemplateException(f"Action: schedule\nDelay: {params.get('delay', None)}\nFinal value: {delay}\nFinal value is not an acceptable type\nType is: {type(delay)}, accetable is int or float")
+
+        if params.get("repeat", False): self.scheduler.every(delay, self._script_engine, self.programs[namespace][func], entity_of_event)
+        else: self.scheduler.after(delay, self._script_engine, self.programs[namespace][func], entity_of_event)
+
     def __action_healplayer(self, params, current_entity, current_item):
         if type(params) == str:
             state_map = self.__buildStateMap(current_entity, current_item)
@@ -0,0 +1,331 @@
+import os
+import sys
+import time
+import heapq
+import asyncio
+import itertools
+from inputs import InputExhaustedException, TerminalInput
+from static import AUTOSAVE_INTERVAL
+
+# --------------------------------------
+# SCHEDULER
+# --------------------------------------
+# Timers are kept by the engine, not by the loop, so scripts can schedule them no matter how the game is run. They
+# only fire while something calls Scheduler.runDue, which GameLoop does between inputs. Timers are not saved.
+
+class ScheduledTimer:
+    __slots__ = ("due", "interval", "callback", "args", "cancelled")
+
+    def __init__(self, due: float, interval: float, callback, args: tuple):
+        self.due = due
+        self.interval = interval # None for a timer that fires once
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+class Scheduler:
+    def __init__(self, clock=time.monotonic):
+        """Timers for the game, fired by runDue
+
+        Args:
+            clock (Callable, optional): Returns the time in seconds. Defaults to time.monotonic.
+        """
+
+        self.clock = clock
+        self.__timers = [] # Heap of (due, order, timer)
+        self.__order = itertools.count() # Timers due at the same time fire in the order they were scheduled
+
+    def after(self, delay: float, callback, *args) -> ScheduledTimer:
+        """Calls callback(*args) once, delay seconds from now"""
+
+        return self.__push(ScheduledTimer(self.clock() + delay, None, callback, args))
+
+    def every(self, interval: float, callback, *args) -> ScheduledTimer:
+        """Calls callback(*args) every interval seconds, until the timer is cancelled"""
+
+        if interval <= 0: raise ValueError("The interval of a repeating timer must be more than 0 seconds")
+
+        return self.__push(ScheduledTimer(self.clock() + interval, interval, callback, args))
+
+    def nextDelay(self) -> float | None:
+        """Returns the seconds until the next timer is due (0 if one is late), or None if there are no timers"""
+
+        timers = self.__timers
+        while timers and timers[0][2].cancelled: heapq.heappop(timers)
+
+        if not timers: return None
+        return max(0.0, timers[0][0] - self.clock())
+
+    def runDue(self) -> int:
+        """Fires every timer that is due. Returns how many fired"""
+
+        timers = self.__timers
+        now = self.clock()
+        fired = 0
+
+        while timers and timers[0][0] <= now:
+            _, _, timer = heapq.heappop(timers)
+            if timer.cancelled: continue
+
+            if timer.interval is not None:
+                timer.due = max(timer.due + timer.interval, now) # A late timer doesn't fire again to catch up
+                self.__push(timer)
+
+            timer.callback(*timer.args)
+            fired += 1
+
+        return fired
+
+    def clear(self) -> None:
+        for _, _, timer in self.__timers: timer.cancel()
+        self.__timers = []
+
+    def __len__(self):
+        return sum(1 for _, _, timer in self.__timers if not timer.cancelled)
+
+    def __push(self, timer):
+        heapq.heappush(self.__timers, (timer.due, next(self.__order), timer))
+        return timer
+
+# --------------------------------------
+# ASYNC INPUT
+# --------------------------------------
+# Async readers put keys into the event queue of a GameLoop with loop.key(). They run as a task next to the loop.
+
+class TerminalKeyReader:
+    def __init__(self, poll_interval: float = 0.02):
+        """Reads keys from the terminal without blocking the event loop. Waits for stdin to be readable on POSIX, polls msvcrt on Windows
+
+        Args:
+            poll_interval (float, optional): Seconds between polls on Windows. Defaults to 0.02.
+        """
+
+        self.poll_interval = poll_interval
+
+    async def run(self, game_loop: "GameLoop") -> None:
+        if os.name == "nt":
+            await self.__poll(game_loop)
+        else:
+            await self.__watch(game_loop)
+
+    async def __poll(self, game_loop):
+        import msvcrt
+
+        while True:
+            while msvcrt.kbhit(): game_loop.key(msvcrt.getwch())
+            await asyncio.sleep(self.poll_interval)
+
+    async def __watch(self, game_loop):
+        import termios
+        import tty
+
+        fd = sys.stdin.fileno()
+        previous = termios.tcgetattr(fd)
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+
+        tty.setcbreak(fd) # Keys arrive as they are pressed, without echo
+        loop.add_reader(fd, readable.set)
+        try:
+            while True:
+                await readable.wait()
+                readable.clear()
+
+                for char in os.read(fd, 64).decode(errors="ignore"): game_loop.key(char)
+        finally:
+            loop.remove_reader(fd)
+            termios.tcsetattr(fd, termios.TCSADRAIN, previous)
+
+class SourceKeyReader:
+    def __init__(self, source, blocking: bool = False):
+        """Reads keys from an input source from inputs.py
+
+        Args:
+            source: The input source
+            blocking (bool, optional): read() waits, like QueueInput and TerminalInput do. It then runs on a worker thread. Defaults to False.
+        """
+
+        self.source = source
+        self.blocking = blocking
+
+    async def run(self, game_loop: "GameLoop") -> None:
+        loop = asyncio.get_running_loop()
+
+        try:
+            while True:
+                if self.blocking: char = await loop.run_in_executor(None, self.source.read)
+                else: char = self.source.read()
+
+                game_loop.key(char)
+                if char in ("\n", "\r") or not self.blocking: await asyncio.sleep(0) # Let the command and due timers run
+        except InputExhaustedException:
+            game_loop.stop()
+
+class QueueKeyReader:
+    def __init__(self):
+        """Commands put into it from the event loop, for example by a network connection. Like ScriptedInput, a single character is a key press and anything longer is typed out and followed by enter"""
+
+        self.queue = asyncio.Queue()
+
+    def put(self, command: str) -> None:
+        self.queue.put_nowait(str(command))
+
+    def close(self) -> None:
+        """Stops the game loop after the commands that were already put in"""
+
+        self.queue.put_nowait(None)
+
+    async def run(self, game_loop: "GameLoop") -> None:
+        while (command := await self.queue.get()) is not None:
+            for char in (command if len(command) == 1 else command + "\r"): game_loop.key(char)
+
+        game_loop.stop()
+
+# --------------------------------------
+# GAME LOOP
+# --------------------------------------
+class GameLoop:
+    def __init__(self, engine, reader=None, autosave: float = None):
+        """Runs a game on asyncio. Keys, calls from other threads and coroutines, and timers all go through one event queue, so
+        the engine is only ever used by one of them at a time and nothing waits for a key press
+
+        Args:
+            engine (PSEngine): The engine, with the player already placed
+            reader (optional): Where keys come from, TerminalKeyReader, SourceKeyReader or QueueKeyReader. Defaults to the input source of the engine, the terminal is read without blocking.
+            autosave (float, optional): Save every autosave seconds. Defaults to AUTOSAVE_INTERVAL from static.py.
+        """
+
+        if reader is None: reader = TerminalKeyReader() if type(engine.input) == TerminalInput else SourceKeyReader(engine.input)
+
+        self.engine = engine
+        self.reader = reader
+        self.autosave = AUTOSAVE_INTERVAL if autosave is None else autosave
+        self.running = False
+        self.events = None # asyncio.Queue, created by run inside the event loop
+        self.__loop = None
+        self.__resize = None # Task waiting for the terminal to be resized, while the room doesn't fit
+
+    # --------------------------------------
+    # EVENTS
+    # --------------------------------------
+    def key(self, char: str) -> None:
+        """Queues a key press. Call it from the event loop, use post from other threads"""
+
+        self.events.put_nowait((self.__handleKey, (char,)))
+
+    def post(self, callback, *args) -> None:
+        """Queues callback(*args) to run between inputs. Safe to call from any thread"""
+
+        self.__loop.call_soon_threadsafe(self.events.put_nowait, (callback, args))
+
+    def narrate(self, text: str) -> None:
+        """Shows text in place of the interactions, like the display_text action. Call it from the event loop, use post from other threads"""
+
+        self.engine.render(narration=text, skip_next=True)
+
+    async def runAction(self, handler: str, entity=None) -> None:
+        """Runs a yaml action, for example "builtin/inspect", from a coroutine. It runs between inputs, like a key press does
+
+        Args:
+            handler (str): Namespace and name of the action
+            entity (optional): The entity the action runs on, current_entity in its templates. Defaults to None.
+        """
+
+        done = self.__loop.create_future()
+
+        def run():
+            try:
+                namespace, func = self.engine._handlerExists(handler, handler)
+                self.engine._script_engine(self.engine.programs[namespace][func], entity)
+                done.set_result(None)
+            except Exception as e:
+                done.set_exception(e)
+
+        self.events.put_nowait((run, ()))
+        await done
+
+    def stop(self) -> None:
+        """Ends run after the events that are already queued"""
+
+        self.events.put_nowait(None)
+
+    # --------------------------------------
+    # RUNNING
+    # --------------------------------------
+    async def run(self) -> None:
+        """Runs the game until stop is called, the input runs out or the player quits
+
+        Raises:
+            GameQuitException: The player quit
+            PlayerDiedException: The player died
+        """
+
+        self.__loop = asyncio.get_running_loop()
+        self.events = asyncio.Queue()
+        self.running = True
+
+        scheduler = self.engine.scheduler
+        autosave = scheduler.every(self.autosave, self.engine.saveGame) if self.autosave else None
+        reader = asyncio.create_task(self.reader.run(self))
+        self.engine.resize_waiter = self.__waitForResize
+
+        try:
+            self.engine.render()
+
+            while self.running:
+                try:
+                    event = await asyncio.wait_for(self.events.get(), scheduler.nextDelay())
+                except asyncio.TimeoutError:
+                    event = False # A timer is due
+
+                changed = scheduler.runDue() > 0
+
+                if event is None:
+                    self.running = False
+                elif event:
+                    callback, args = event
+                    changed = callback(*args) is not False or changed # Keys that don't finish a command return False
+
+                if changed and self.running: self.engine.render()
+
+                if reader.done() and not reader.cancelled() and reader.exception(): raise reader.exception()
+        finally:
+            self.running = False
+            self.engine.resize_waiter = None
+            if autosave: autosave.cancel()
+            if self.__resize: self.__resize.cancel()
+            reader.cancel()
+
+            try:
+                await reader
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    def __waitForResize(self):
+        """Called by engine.render instead of blocking while the room doesn't fit the terminal"""
+
+        if self.__resize is None or self.__resize.done(): self.__resize = asyncio.create_task(self.__resized())
+
+    async def __resized(self):
+        try:
+            await self.engine.renderer.waitForResizeAsync()
+        except Exception as e: # A sink that can't be resized, run raises it like an error from a key
+            self.events.put_nowait((self.__raise, (e,)))
+        else:
+            self.events.put_nowait((self.__redraw, ()))
+
+    def __redraw(self):
+        return True # The loop renders after every event that doesn't return False
+
+    def __raise(self, e):
+        raise e
+
+    def __handleKey(self, char):
+        command = self.engine.feedKey(char)
+        if command is None: return False
+
+        self.engine.handleInput(command)
+        return True
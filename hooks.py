@@ -0,0 +1,197 @@
+import time
+import warnings
+from static import dotdict
+
+# --------------------------------------
+# EXCEPTIONS
+# --------------------------------------
+class HookEventNotFoundException(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+class SlowHookWarning(UserWarning):
+    pass
+
+# --------------------------------------
+# EVENTS
+# --------------------------------------
+# Every hook gets one argument, a dotdict with the name of the event, the room, the entity and the action (None where
+# they don't apply), and the extra values of the event:
+#  - load: A room change happened
+#  - render: engine.render() was called, before the frame is drawn
+#  - pre_action, post_action: Around the script of an entity action
+#  - pre_save, post_save: Around engine.saveGame(). full is True for a full snapshot
+#  - move: The player moved. old and new are the (x, y) coords
+HOOK_EVENTS = ("load", "render", "pre_action", "post_action", "pre_save", "post_save", "move")
+
+LEGACY_HOOKS = {"onLoad": "load", "onRender": "render"} # Module functions that are subscribed without calling on
+
+class Hook:
+    __slots__ = ("event", "func", "name", "rooms", "types", "actions", "legacy")
+
+    def __init__(self, event: str, func, name: str, rooms=None, types=None, actions=None, legacy: bool = False):
+        """A subscribed function. Filters are sets, None lets everything through"""
+
+        self.event = event
+        self.func = func
+        self.name = name
+        self.rooms = rooms
+        self.types = types
+        self.actions = actions
+        self.legacy = legacy # onLoad and onRender take no arguments
+
+    def __repr__(self):
+        return f"Hook({self.event!r}, {self.name!r})"
+
+# --------------------------------------
+# REGISTRY
+# --------------------------------------
+class HookRegistry:
+    def __init__(self, budget: float = None, before=None, after=None):
+        """The functions world scripts subscribed to engine events
+
+        Args:
+            budget (float, optional): Warn with a SlowHookWarning when a hook takes longer than this many milliseconds. Defaults to no budget.
+            before (Callable, optional): Called before the first hook of an event runs. Defaults to None.
+            after (Callable, optional): Called after the hooks of an event if one of them ran. Defaults to None.
+        """
+
+        self.hooks = {event: [] for event in HOOK_EVENTS}
+        self.budget = budget
+        self.before = before # The engine keeps running loops going through the lists they started with
+        self.after = after # and marks everything changed, hooks can change anything like py scripts
+        self.instrumentation = None # Set by PSEngine.enableInstrumentation, hooks are timed as hooks/<event>/<name>
+        self.slow = {} # Hook name -> times it went over the budget
+        self.__by_room = {} # (event, room id) -> hooks whose room filter lets the room through
+
+    def subscribe(self, event: str, func, name: str = None, rooms=None, types=None, actions=None) -> Hook:
+        """Calls func on an event
+
+        Args:
+            event (str): One of HOOK_EVENTS
+            func (Callable): Gets the event dotdict
+            name (str, optional): Name in the timings. Defaults to module.function.
+            rooms (Iterable, optional): Only for these room ids. Defaults to every room.
+            types (Iterable, optional): Only for entities of these types. Defaults to every entity, and no entity.
+            actions (Iterable, optional): Only for these action names. Defaults to every action, and no action.
+
+        Raises:
+            HookEventNotFoundException: The event doesn't exist
+
+        Returns:
+            Hook: Pass it to unsubscribe
+        """
+
+        return self.__add(Hook(event, func, name or self.__nameOf(func), self.__toSet(rooms), self.__toSet(types), self.__toSet(actions)))
+
+    def on(self, event: str, **filters):
+        """Decorator version of subscribe
+
+        ```python
+        @eng.hooks.on("move", rooms=["cave"])
+        def onCaveMove(event): ...
+        ```
+        """
+
+        def decorator(func):
+            self.subscribe(event, func, **filters)
+            return func
+
+        return decorator
+
+    def subscribeModule(self, name: str, module) -> None:
+        """Subscribes the onLoad and onRender functions of a world script, if it has them"""
+
+        for func_name, event in LEGACY_HOOKS.items():
+            func = getattr(module, func_name, None)
+            if callable(func): self.__add(Hook(event, func, name, legacy=True))
+
+    def unsubscribe(self, hook) -> None:
+        """Removes a hook, or every hook of a function"""
+
+        for event, hooks in self.hooks.items():
+            hooks[:] = [other for other in hooks if other is not hook and other.func is not hook]
+
+        self.__by_room = {}
+
+    def subscribed(self, event: str) -> bool:
+        return bool(self.hooks[event])
+
+    def run(self, event: str, room=None, entity=None, action: str = None, **values) -> bool:
+        """Calls the hooks of an event that its filters let through
+
+        Returns:
+            bool: A hook was called
+        """
+
+        if not self.hooks[event]: return False # Most events have no hooks
+
+        room_id = room.get("id", None) if room else None
+        try:
+            hooks = self.__by_room[(event, room_id)]
+        except KeyError:
+            hooks = self.__by_room[(event, room_id)] = [hook for hook in self.hooks[event] if hook.rooms is None or room_id in hook.rooms]
+        except TypeError: # Unhashable room id
+            hooks = [hook for hook in self.hooks[event] if hook.rooms is None]
+
+        entity_type = entity.get("type", None) if entity else None
+        inst = self.instrumentation
+        timed = inst is not None or self.budget is not None
+        data = None
+        called = False
+
+        for hook in hooks:
+            if hook.types is not None and entity_type not in hook.types: continue
+            if hook.actions is not None and action not in hook.actions: continue
+
+            if not called and self.before: self.before()
+            if timed: start = time.perf_counter_ns()
+
+            if hook.legacy:
+                hook.func()
+            else:
+                if data is None: data = dotdict(event=event, room=room, entity=entity, action=action, **values)
+                hook.func(data)
+
+            called = True
+            if timed: self.__record(hook, time.perf_counter_ns() - start)
+
+        if called and self.after: self.after()
+
+        return called
+
+    def stats(self) -> dict:
+        """Returns the subscribed hooks by event, and how often every hook went over the budget"""
+
+        return {
+            "hooks": {event: [hook.name for hook in hooks] for event, hooks in self.hooks.items() if hooks},
+            "budget_ms": self.budget,
+            "slow": dict(self.slow)
+        }
+
+    def __add(self, hook):
+        if hook.event not in self.hooks: raise HookEventNotFoundException(f"There is no hook event '{hook.event}', events are: {', '.join(HOOK_EVENTS)}")
+
+        self.hooks[hook.event].append(hook)
+        self.__by_room = {}
+
+        return hook
+
+    def __record(self, hook, ns):
+        if self.instrumentation: self.instrumentation.record(f"hooks/{hook.event}/{hook.name}", ns)
+
+        if self.budget is not None and ns > self.budget * 1_000_000:
+            self.slow[hook.name] = self.slow.get(hook.name, 0) + 1
+            warnings.warn(f"Hook '{hook.name}' on '{hook.event}' took {ns / 1_000_000:.2f}ms, the budget is {self.budget}ms", SlowHookWarning, stacklevel=3)
+
+    def __nameOf(self, func):
+        module = getattr(func, "__module__", None)
+        name = getattr(func, "__qualname__", None) or getattr(func, "__name__", None) or repr(func)
+
+        return f"{module}.{name}" if module else name
+
+    def __toSet(self, values):
+        if values is None: return None
+        if type(values) == str: return {values}
+
+        return set(values)
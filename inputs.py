@@ -0,0 +1,91 @@
+import queue
+import static
+
+# --------------------------------------
+# EXCEPTIONS
+# --------------------------------------
+class InputExhaustedException(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+# --------------------------------------
+# INPUT SOURCES
+# --------------------------------------
+# An input source hands the engine one key at a time with read(). Scripted sources take whole commands instead of keys:
+# a single character is sent as a key press, anything longer is typed out and followed by enter.
+
+class TerminalInput:
+    def read(self) -> str:
+        """Waits for a key press on the terminal"""
+
+        return static.getch()
+
+class ScriptedInput:
+    def __init__(self, commands):
+        """Plays back a list (or any iterable) of commands
+
+        Args:
+            commands (iterable): The commands, for example ["w", "w", "open", "inventory"]
+        """
+
+        self.commands = iter(commands)
+        self.pending = ""
+
+    def read(self) -> str:
+        """Returns the next key
+
+        Raises:
+            InputExhaustedException: There are no commands left
+        """
+
+        while not self.pending:
+            command = self.nextCommand()
+            self.pending = command if len(command) == 1 else command + "\r"
+
+        key = self.pending[0]
+        self.pending = self.pending[1:]
+
+        return key
+
+    def nextCommand(self) -> str:
+        try:
+            return str(next(self.commands))
+        except StopIteration:
+            raise InputExhaustedException("No commands left.")
+
+class FileInput(ScriptedInput):
+    def __init__(self, path: str):
+        """Plays back commands from a file, one command per line. Empty lines are skipped"""
+
+        self.file = open(path, "r")
+        super().__init__(line.strip() for line in self.file if line.strip())
+
+    def nextCommand(self) -> str:
+        try:
+            return super().nextCommand()
+        except InputExhaustedException:
+            self.file.close()
+            raise
+
+class QueueInput(ScriptedInput):
+    def __init__(self, commands: queue.Queue, timeout: float = None):
+        """Takes commands from a queue, as another thread puts them in. Putting None in the queue ends the input
+
+        Args:
+            commands (queue.Queue): The queue
+            timeout (float, optional): Seconds to wait for the next command. Defaults to waiting forever.
+        """
+
+        self.queue = commands
+        self.timeout = timeout
+        super().__init__(())
+
+    def nextCommand(self) -> str:
+        try:
+            command = self.queue.get(timeout=self.timeout)
+        except queue.Empty:
+            raise InputExhaustedException(f"No command in {self.timeout} seconds.")
+
+        if command is None: raise InputExhaustedException("The queue was closed.")
+
+        return str(command)
@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import threading
+import cProfile
+
+# --------------------------------------
+# HISTOGRAMS
+# --------------------------------------
+class Histogram:
+    def __init__(self):
+        """Timings of one thing. Buckets are powers of two nanoseconds, so recording a timing never allocates"""
+
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.buckets = [0] * 64
+
+    def record(self, ns: int) -> None:
+        self.count += 1
+        self.total += ns
+        if self.min is None or ns < self.min: self.min = ns
+        if ns > self.max: self.max = ns
+        self.buckets[min(ns.bit_length(), 63)] += 1
+
+    def percentile(self, fraction: float) -> int:
+        """Returns the upper bound of the bucket the percentile falls into, in nanoseconds"""
+
+        if self.count == 0: return 0
+
+        needed = self.count * fraction
+        seen = 0
+        for bucket, amount in enumerate(self.buckets):
+            seen += amount
+            if seen >= needed: return min(1 << bucket, self.max)
+
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "total_us": self.total / 1000,
+            "mean_us": self.total / self.count / 1000 if self.count else 0,
+            "min_us": (self.min or 0) / 1000,
+            "max_us": self.max / 1000,
+            "p50_us": self.percentile(0.5) / 1000,
+            "p95_us": self.percentile(0.95) / 1000,
+            "p99_us": self.percentile(0.99) / 1000
+        }
+
+# --------------------------------------
+# INSTRUMENTATION
+# --------------------------------------
+# Timer names are paths, "render/map" is the map phase of "render". Nested timers are inclusive, so the time of "render"
+# contains the time of all of its phases. writeCollapsed turns that into the self time flamegraph tools expect.
+
+class Instrumentation:
+    def __init__(self):
+        """Counters and timing histograms of the engine hot paths. Engines only record into one while it's enabled, see PSEngine.enableInstrumentation"""
+
+        self.counters = {}
+        self.timers = {}
+        self.started = time.time()
+        self.__lock = threading.Lock() # Snapshots are taken from another thread
+        self.__snapshot_thread = None
+        self.__snapshot_stop = None
+
+    def count(self, name: str, amount: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record(self, name: str, ns: int) -> None:
+        """Records a timing in nanoseconds, as measured with time.perf_counter_ns"""
+
+        timer = self.timers.get(name, None)
+        if timer is None:
+            with self.__lock:
+                timer = self.timers.setdefault(name, Histogram())
+
+        timer.record(ns)
+
+    def timer(self, name: str) -> "Timer":
+        """Returns a context manager timing its block, for anything that isn't called often enough for the overhead to matter"""
+
+        return Timer(self, name)
+
+    def reset(self) -> None:
+        with self.__lock:
+            self.counters = {}
+            self.timers = {}
+            self.started = time.time()
+
+    def snapshot(self) -> dict:
+        """Returns every counter and timer as plain data, timings are in microseconds"""
+
+        with self.__lock:
+            counters = dict(self.counters)
+            timers = dict(self.timers)
+
+        return {
+            "timestamp": time.time(),
+            "seconds": time.time() - self.started,
+            "counters": dict(sorted(counters.items())),
+            "timers": {name: timers[name].snapshot() for name in sorted(timers)}
+        }
+
+    # --------------------------------------
+    # EXPORTING
+    # --------------------------------------
+    def writeSnapshot(self, path: str, data: dict = None) -> None:
+        """Writes a snapshot as JSON. The file is replaced in one step, so readers never see half a snapshot
+
+        Args:
+            path (str): The JSON file
+            data (dict, optional): What to write. Defaults to Instrumentation.snapshot()
+        """
+
+        if data is None: data = self.snapshot()
+
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f, indent=4)
+
+        os.replace(path + ".tmp", path)
+
+    def startSnapshots(self, path: str, interval: float, source=None) -> None:
+        """Writes a snapshot every interval seconds from a background thread, until stopSnapshots is called
+
+        Args:
+            path (str): The JSON file
+            interval (float): Seconds between snapshots
+            source (Callable, optional): Returns what to write, PSEngine passes its stats. Defaults to Instrumentation.snapshot
+        """
+
+        if source is None: source = self.snapshot
+
+        self.stopSnapshots()
+
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.writeSnapshot(path, source())
+                except OSError: # Try again next time
+                    pass
+
+        self.__snapshot_stop = stop
+        self.__snapshot_thread = threading.Thread(target=run, name="pse-snapshots", daemon=True)
+        self.__snapshot_thread.start()
+
+    def stopSnapshots(self) -> None:
+        if not self.__snapshot_thread: return
+
+        self.__snapshot_stop.set()
+        self.__snapshot_thread.join()
+        self.__snapshot_thread = None
+        self.__snapshot_stop = None
+
+    def writeCollapsed(self, path: str) -> None:
+        """Writes the timers as collapsed stacks ("render;map 1234" per line, in microseconds), which flamegraph.pl, speedscope and inferno can read"""
+
+        with self.__lock:
+            totals = {name: timer.total for name, timer in self.timers.items()}
+
+        # Subtract the children, flamegraphs add them back up
+        own = dict(totals)
+        for name, total in totals.items():
+            parent = name.rpartition("/")[0]
+            if parent in own: own[parent] -= total
+
+        with open(path, "w") as f:
+            for name in sorted(own):
+                us = own[name] // 1000
+                if us > 0: f.write(f"{name.replace('/', ';')} {us}\n")
+
+class Timer:
+    def __init__(self, instrumentation: Instrumentation, name: str):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.instrumentation.record(self.name, time.perf_counter_ns() - self.start)
+
+# --------------------------------------
+# PROFILING
+# --------------------------------------
+class Profiler:
+    def __init__(self):
+        """Runs cProfile over everything between start and stop, for when the timers don't say enough"""
+
+        self.profile = cProfile.Profile()
+
+    def start(self) -> "Profiler":
+        self.profile.enable()
+        return self
+
+    def stop(self, path: str = None) -> None:
+        """Stops profiling
+
+        Args:
+            path (str, optional): Write the profile here, in the pstats format. snakeviz, gprof2dot and flameprof read it. Defaults to not writing it.
+        """
+
+        self.profile.disable()
+        if path: self.profile.dump_stats(path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,482 @@
+from copy import deepcopy as dc
+from static import dotdict, toDotdict
+
+# --------------------------------------
+# COORDS
+# --------------------------------------
+class Coords:
+    __slots__ = ("x", "y")
+
+    def __init__(self, x: int, y: int):
+        """Entity coords. Indexes, iterates and compares like the [x, y] list from the room file, without the list.
+        They can't be changed, so they can be shared and used as keys. To move an entity, give it new coords"""
+
+        object.__setattr__(self, "x", x)
+        object.__setattr__(self, "y", y)
+
+    def __getitem__(self, idx):
+        if type(idx) == slice: return [self.x, self.y][idx]
+        if idx == 0 or idx == -2: return self.x
+        if idx == 1 or idx == -1: return self.y
+
+        raise IndexError("Coords index out of range")
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Coords can't be changed")
+
+    def __len__(self):
+        return 2
+
+    def __iter__(self):
+        return iter((self.x, self.y))
+
+    def __eq__(self, other):
+        if type(other) not in (Coords, list, tuple): return NotImplemented
+        return len(other) == 2 and self.x == other[0] and self.y == other[1]
+
+    def __hash__(self):
+        return hash((self.x, self.y)) # Equal to the (x, y) tuple
+
+    def __repr__(self):
+        return repr([self.x, self.y])
+
+    def __copy__(self):
+        return Coords(self.x, self.y)
+
+    def __deepcopy__(self, memo):
+        return Coords(self.x, self.y)
+
+    def __reduce__(self):
+        return (Coords, (self.x, self.y))
+
+    def toList(self) -> list:
+        return [self.x, self.y]
+
+# --------------------------------------
+# ACTION TABLES
+# --------------------------------------
+# Most entities use an action map without changing it, so every entity with the same actions shares one dict. Reading
+# goes straight to that dict, the first change copies it for just that entity.
+
+class ActionTable:
+    __slots__ = ("_table", "_shared")
+
+    def __init__(self, table: dict, shared: bool = True):
+        """The actions of an entity
+
+        Args:
+            table (dict): Action -> handler. Never changed while shared
+            shared (bool, optional): Other entities use table too. Defaults to True.
+        """
+
+        object.__setattr__(self, "_table", table)
+        object.__setattr__(self, "_shared", shared)
+
+    def __own(self):
+        if self._shared:
+            object.__setattr__(self, "_table", dotdict(self._table))
+            object.__setattr__(self, "_shared", False)
+
+        return self._table
+
+    def __getitem__(self, key):
+        return self._table[key]
+
+    def __setitem__(self, key, value):
+        self.__own()[key] = value
+
+    def __delitem__(self, key):
+        del self.__own()[key]
+
+    def __getattr__(self, name):
+        if name.startswith("_"): raise AttributeError(name)
+        return self._table.get(name, None)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+    def __delattr__(self, name):
+        del self[name]
+
+    def __contains__(self, key):
+        return key in self._table
+
+    def __iter__(self):
+        return iter(self._table)
+
+    def __len__(self):
+        return len(self._table)
+
+    def get(self, key, default=None):
+        return self._table.get(key, default)
+
+    def keys(self):
+        return self._table.keys()
+
+    def values(self):
+        return self._table.values()
+
+    def items(self):
+        return self._table.items()
+
+    def setdefault(self, key, default=None):
+        if key in self._table: return self._table[key]
+        return self.__own().setdefault(key, default)
+
+    def pop(self, key, *default):
+        if key not in self._table and default: return default[0]
+        return self.__own().pop(key, *default)
+
+    def update(self, other=(), **fields):
+        self.__own().update(other, **fields)
+
+    def toDict(self) -> dict:
+        return dict(self._table)
+
+    def __eq__(self, other):
+        if type(other) == ActionTable: return self._table is other._table or self._table == other._table
+        if isinstance(other, (dict, Model)): return self._table == dict(other.items())
+
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"ActionTable({self._table!r})"
+
+    def __copy__(self):
+        return ActionTable(self._table) if self._shared else ActionTable(dotdict(self._table), False)
+
+    def __deepcopy__(self, memo):
+        if self._shared: return ActionTable(self._table) # Nothing changes a shared table, so copies can share it too
+        return ActionTable(dc(self._table, memo), False)
+
+    def __reduce__(self):
+        return (ActionTable, (self._table, self._shared))
+
+# --------------------------------------
+# MODELS
+# --------------------------------------
+MISSING = object() # Value of a field that isn't set, when comparing
+
+def restoreModel(cls, names: tuple, values: tuple, extra: dotdict) -> "Model":
+    """Unpickles a model"""
+
+    self = cls.__new__(cls)
+    object.__setattr__(self, "_extra", extra)
+
+    for name, value in zip(names, values):
+        object.__setattr__(self, name, value) # Skips Model.__setattr__
+
+    return self
+
+# Rooms, entities, items and generators are kept in slotted classes instead of dotdicts, which takes a fraction of the
+# memory and makes attribute access a slot lookup. They still act like a dotdict: templates and scripts index them with
+# entity["linked_exit"], missing attributes are None, and fields that aren't in FIELDS are kept in a small dict of their
+# own. A field that was never set is missing, so "linked_exit" in entity is only True if the room file has it.
+
+class Model:
+    __slots__ = ("_extra",)
+
+    FIELDS = ()
+    _SLOTS = {}
+    CONVERTERS = {} # Field -> function turning a parsed value into what the model keeps
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._SLOTS = {name: getattr(cls, name) for name in cls.FIELDS} # Field -> slot descriptor
+
+    def __init__(self, data: dict = None, **fields):
+        """A model. Values are kept as they are, use fromDict to convert parsed data"""
+
+        object.__setattr__(self, "_extra", None)
+
+        for key, value in (data or {}).items(): self[key] = value
+        for key, value in fields.items(): self[key] = value
+
+    @classmethod
+    def fromDict(cls, data: dict) -> "Model":
+        """Builds a model from parsed yaml or json, converting the fields it knows and turning the rest into dotdicts"""
+
+        self = cls.__new__(cls)
+        slots = cls._SLOTS
+        converters = cls.CONVERTERS
+        extra = None
+
+        for key, value in data.items():
+            convert = converters.get(key, None)
+            if convert is not None: value = convert(value)
+            elif isinstance(value, (dict, list)): value = toDotdict(value) # Most values are strings and numbers
+
+            slot = slots.get(key, None)
+            if slot is not None:
+                slot.__set__(self, value)
+            else:
+                if extra is None: extra = dotdict()
+                extra[key] = value
+
+        object.__setattr__(self, "_extra", extra)
+
+        return self
+
+    def toDict(self) -> dict:
+        """Returns the fields as a dict, nested models are kept as they are"""
+
+        fields = self.__setFields()
+        if self._extra: fields.update(self._extra)
+
+        return fields
+
+    # --------------------------------------
+    # DICT ACCESS
+    # --------------------------------------
+    def __getitem__(self, key):
+        slot = self._SLOTS.get(key, None)
+
+        if slot is not None:
+            try:
+                return slot.__get__(self)
+            except AttributeError:
+                raise KeyError(key) from None
+
+        extra = self._extra
+        if extra is None: raise KeyError(key)
+
+        return extra[key]
+
+    def __setitem__(self, key, value):
+        slot = self._SLOTS.get(key, None)
+
+        if slot is not None:
+            slot.__set__(self, value)
+        else:
+            if self._extra is None: object.__setattr__(self, "_extra", dotdict())
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        slot = self._SLOTS.get(key, None)
+
+        if slot is not None:
+            try:
+                slot.__delete__(self)
+            except AttributeError:
+                raise KeyError(key) from None
+        else:
+            if self._extra is None: raise KeyError(key)
+            del self._extra[key]
+
+    def __contains__(self, key):
+        slot = self._SLOTS.get(key, None)
+
+        if slot is not None:
+            try:
+                slot.__get__(self)
+            except AttributeError:
+                return False
+
+            return True
+
+        return self._extra is not None and key in self._extra
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            self[key] = default
+            return default
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default: return default[0]
+            raise
+
+        del self[key]
+        return value
+
+    def update(self, other=(), **fields):
+        for key, value in (other.items() if hasattr(other, "items") else other): self[key] = value
+        for key, value in fields.items(): self[key] = value
+
+    def keys(self):
+        return self.toDict().keys()
+
+    def values(self):
+        return self.toDict().values()
+
+    def items(self):
+        return self.toDict().items()
+
+    def __iter__(self):
+        return iter(self.toDict())
+
+    def __len__(self):
+        return len(self.toDict())
+
+    def __bool__(self):
+        # Truthiness of every entity found by coords is checked, don't build the dict for it
+        if self._extra: return True
+
+        for slot in self._SLOTS.values():
+            try:
+                slot.__get__(self)
+            except AttributeError:
+                continue
+
+            return True
+
+        return False
+
+    # --------------------------------------
+    # ATTRIBUTE ACCESS
+    # --------------------------------------
+    def __getattr__(self, name):
+        # Only reached for fields that aren't set, and fields that aren't in FIELDS
+        if name.startswith("_"): raise AttributeError(name)
+
+        extra = self._extra
+        return extra.get(name, None) if extra else None
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+    def __delattr__(self, name):
+        del self[name]
+
+    # --------------------------------------
+    # COPYING AND COMPARING
+    # --------------------------------------
+    def __eq__(self, other):
+        if self is other: return True
+
+        if type(other) == type(self):
+            # Compare field by field, list.index compares every item before the one it finds
+            for slot in self._SLOTS.values():
+                try:
+                    a = slot.__get__(self)
+                except AttributeError:
+                    a = MISSING
+
+                try:
+                    b = slot.__get__(other)
+                except AttributeError:
+                    b = MISSING
+
+                if a is not b and a != b: return False
+
+            return (self._extra or None) == (other._extra or None)
+
+        if not isinstance(other, (Model, dict)): return NotImplemented
+
+        return self.toDict() == dict(other.items())
+
+    __hash__ = None # Mutable, like the dotdict
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.toDict()!r})"
+
+    def __copy__(self):
+        return type(self)(self.toDict())
+
+    def __deepcopy__(self, memo):
+        cls = type(self)
+        copy = cls.__new__(cls)
+        memo[id(self)] = copy
+
+        object.__setattr__(copy, "_extra", dc(self._extra, memo))
+        for slot in self._SLOTS.values():
+            try:
+                slot.__set__(copy, dc(slot.__get__(self), memo))
+            except AttributeError: # Not set
+                pass
+
+        return copy
+
+    def __reduce__(self):
+        # The world cache unpickles every room, restoreModel sets the fields without going through Model.__setattr__
+        fields = self.__setFields()
+        return (restoreModel, (type(self), tuple(fields), tuple(fields.values()), self._extra))
+
+    def __setFields(self):
+        """Returns the fields that are set, without the extra fields"""
+
+        fields = {}
+        for name, slot in self._SLOTS.items():
+            try:
+                fields[name] = slot.__get__(self)
+            except AttributeError: # Not set
+                pass
+
+        return fields
+
+class Item(Model):
+    __slots__ = FIELDS = ("id", "name", "uid", "lock_id")
+
+class Entity(Model):
+    __slots__ = FIELDS = ("type", "id", "coords", "visible", "linked_exit", "properties", "actions", "events")
+
+class Generator(Model):
+    __slots__ = FIELDS = ("exit", "type", "room", "pool", "conditions")
+
+class Room(Model):
+    __slots__ = FIELDS = ("id", "name", "layout", "entities", "generators")
+
+# --------------------------------------
+# CONVERTING
+# --------------------------------------
+def toCoords(coords) -> any:
+    """Turns [x, y] into Coords, anything else is kept as it is"""
+
+    if type(coords) in (list, tuple) and len(coords) == 2: return Coords(coords[0], coords[1])
+    return toDotdict(coords)
+
+def toItem(item) -> any:
+    return Item.fromDict(item) if isinstance(item, dict) else toDotdict(item)
+
+def toItems(items) -> any:
+    return [toItem(item) for item in items] if type(items) == list else toDotdict(items)
+
+def toEntity(entity) -> any:
+    return Entity.fromDict(entity) if isinstance(entity, dict) else toDotdict(entity)
+
+def toGenerator(generator) -> any:
+    return Generator.fromDict(generator) if isinstance(generator, dict) else toDotdict(generator)
+
+def toRoom(room) -> any:
+    """Turns a parsed room into a Room, converting its entities, generators and the items inside of entities. Anything that isn't a dict is turned into a dotdict like before"""
+
+    return Room.fromDict(room) if isinstance(room, dict) else toDotdict(room)
+
+def toProperties(properties) -> any:
+    """Entity properties stay a dotdict, but chest contents and item data are items"""
+
+    if not isinstance(properties, dict): return toDotdict(properties)
+
+    converted = dotdict()
+    for key, value in properties.items():
+        if key == "contents": converted[key] = toItems(value)
+        elif key == "data": converted[key] = toItem(value)
+        else: converted[key] = toDotdict(value)
+
+    return converted
+
+def listOf(convert):
+    return lambda value: [convert(item) for item in value] if type(value) == list else toDotdict(value)
+
+def jsonDefault(obj) -> dict | list:
+    """Pass as json.dump(default=jsonDefault) to write models as the dicts and lists they were read from"""
+
+    if isinstance(obj, (Model, ActionTable)): return obj.toDict()
+    if type(obj) == Coords: return obj.toList()
+
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+Entity.CONVERTERS = {"coords": toCoords, "properties": toProperties}
+Room.CONVERTERS = {"entities": listOf(toEntity), "generators": listOf(toGenerator)}
@@ -0,0 +1,365 @@
+import sys
+import os
+import re
+import signal
+import asyncio
+import threading
+import time
+from collections import deque
+
+# --------------------------------------
+# EXCEPTIONS
+# --------------------------------------
+class TerminalTooSmallException(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+# --------------------------------------
+# FRAMES
+# --------------------------------------
+# A frame is a list of rows, every row is a list of cells. A cell is the text of a single character on the screen,
+# including any color codes around it, so two cells are only equal if they look the same.
+
+def blankFrame(width: int, height: int) -> list[list[str]]:
+    """Creates an empty frame filled with spaces"""
+
+    return [[" "] * width for _ in range(height)]
+
+def writeText(frame: list[list[str]], row: int, col: int, text: str, color: str = None, end_col: int = None):
+    """Writes text into a frame, one character per cell. Anything outside of the frame (or past end_col) is clipped
+
+    Args:
+        frame (list[list[str]]): The frame
+        row (int): Row to write to
+        col (int): Column of the first character
+        text (str): The text
+        color (str, optional): Color code to wrap every character with. Defaults to None.
+        end_col (int, optional): First column that can't be written to. Defaults to the frame width.
+    """
+
+    if row < 0 or row >= len(frame): return
+
+    line = frame[row]
+    end_col = len(line) if end_col is None else min(end_col, len(line))
+
+    for char in text:
+        if col >= end_col: return
+        if col >= 0: line[col] = f"{color}{char}\033[0m" if color else char
+        col += 1
+
+# --------------------------------------
+# TERMINAL SIZE
+# --------------------------------------
+class TerminalSize:
+    def __init__(self):
+        """Caches the terminal size. Where SIGWINCH exists, the cache is only refreshed when the terminal is resized, otherwise it is queried every time"""
+
+        self.size = None
+        self.watching = False
+
+    def watch(self) -> bool:
+        """Installs the SIGWINCH handler. Returns False if resize events are not available (Windows, or not called from the main thread)"""
+
+        if self.watching: return True
+        if not hasattr(signal, "SIGWINCH"): return False
+        if threading.current_thread() is not threading.main_thread(): return False
+
+        previous = signal.getsignal(signal.SIGWINCH)
+
+        def onResize(signum, frame):
+            self.size = None # Only mark as changed, the handler can interrupt anything
+
+            if callable(previous): previous(signum, frame)
+
+        signal.signal(signal.SIGWINCH, onResize)
+        self.watching = True
+
+        return True
+
+    def get(self) -> tuple[int, int]:
+        """Returns the terminal width and height"""
+
+        size = self.size
+        if size is None or not self.watching:
+            size = tuple(os.get_terminal_size())
+            self.size = size
+
+        return size
+
+    def waitForResize(self) -> None:
+        """Blocks until the terminal is resized. Without resize events this falls back to a short sleep"""
+
+        if not self.watching or threading.current_thread() is not threading.main_thread():
+            time.sleep(0.25)
+            self.size = None
+            return
+
+        # Block the signal first so a resize between the check and the wait stays pending instead of being lost
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGWINCH})
+        try:
+            if tuple(os.get_terminal_size()) == self.size:
+                signal.sigwait({signal.SIGWINCH})
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGWINCH})
+
+        self.size = None
+
+    async def waitForResizeAsync(self) -> None:
+        """Waits until the terminal is resized without blocking the event loop. Without resize events this falls back to a short sleep"""
+
+        loop = asyncio.get_running_loop()
+        resized = asyncio.Event()
+
+        watching = self.watching
+        if watching:
+            previous = signal.getsignal(signal.SIGWINCH)
+
+            try:
+                loop.add_signal_handler(signal.SIGWINCH, resized.set)
+            except (RuntimeError, ValueError): # The event loop isn't running on the main thread
+                watching = False
+
+        if not watching:
+            await asyncio.sleep(0.25)
+            self.size = None
+            return
+
+        try:
+            if tuple(os.get_terminal_size()) == self.size: await resized.wait()
+        finally:
+            loop.remove_signal_handler(signal.SIGWINCH)
+            signal.signal(signal.SIGWINCH, previous) # remove_signal_handler resets it, put back the handler watch installed
+
+        self.size = None
+
+TERMINAL_SIZE = TerminalSize()
+
+# --------------------------------------
+# RENDERER
+# --------------------------------------
+class TerminalRenderer:
+    def __init__(self, stream=None, differential: bool = True):
+        """Draws frames to a terminal
+
+        Args:
+            stream (optional): Where to write to. Defaults to whatever sys.stdout currently is.
+            differential (bool, optional): Only send the cells that changed since the last frame, using cursor movement. If False, every frame is printed in full. Defaults to True.
+        """
+
+        self.stream = stream
+        self.differential = differential
+        self.previous = None
+
+        TERMINAL_SIZE.watch()
+
+        # Metrics
+        self.frames = 0
+        self.full_repaints = 0
+        self.last_frame_bytes = 0
+        self.total_bytes = 0
+
+    def getSize(self) -> tuple[int, int]:
+        """Returns the width and height available for frames"""
+
+        return TERMINAL_SIZE.get()
+
+    def waitForResize(self) -> None:
+        """Blocks until the available space changes"""
+
+        TERMINAL_SIZE.waitForResize()
+
+    async def waitForResizeAsync(self) -> None:
+        """Waits until the available space changes, without blocking the event loop"""
+
+        await TERMINAL_SIZE.waitForResizeAsync()
+
+    def invalidate(self) -> None:
+        """Forget the previous frame, so the next one is fully repainted. Call this when something else has drawn over the screen"""
+
+        self.previous = None
+
+    def write(self, text: str) -> None:
+        """Writes text that isn't part of a frame, like prompts and messages"""
+
+        stream = self.stream or sys.stdout
+        stream.write(text)
+        stream.flush()
+
+    def draw(self, frame: list[list[str]]) -> int:
+        """Draws a frame
+
+        Args:
+            frame (list[list[str]]): The frame
+
+        Returns:
+            int: Bytes written
+        """
+
+        if not self.differential:
+            output = "\n".join(map("".join, frame)) + "\n"
+        elif self.previous is None or len(self.previous) != len(frame) or len(self.previous[0]) != len(frame[0]):
+            output = self.__fullRepaint(frame)
+        else:
+            output = self.__diff(frame)
+
+        self.previous = frame
+        self.frames += 1
+        self.last_frame_bytes = len(output.encode())
+        self.total_bytes += self.last_frame_bytes
+
+        if output:
+            stream = self.stream or sys.stdout
+            stream.write(output)
+            stream.flush()
+
+        return self.last_frame_bytes
+
+    def __fullRepaint(self, frame):
+        self.full_repaints += 1
+
+        output = "\033[H\033[2J" # Home, clear screen
+        output += "\r\n".join(map("".join, frame))
+        output += self.__park(frame)
+
+        return output
+
+    def __diff(self, frame):
+        output = []
+
+        for row_idx, (row, previous_row) in enumerate(zip(frame, self.previous)):
+            if row == previous_row: continue
+
+            col = 0
+            width = len(row)
+            while col < width:
+                if row[col] == previous_row[col]:
+                    col += 1
+                    continue
+
+                # Extend the run over short unchanged gaps, rewriting a few cells is cheaper than moving the cursor again
+                start = col
+                end = col + 1
+                gap = 0
+                col += 1
+                while col < width and gap < 4:
+                    if row[col] == previous_row[col]:
+                        gap += 1
+                    else:
+                        gap = 0
+                        end = col + 1
+
+                    col += 1
+
+                col = end
+                output.append(f"\033[{row_idx + 1};{start + 1}H")
+                output.append("".join(row[start:end]))
+
+        if not output: return ""
+
+        output.append(self.__park(frame))
+        return "".join(output)
+
+    def __park(self, frame):
+        """Moves the cursor to the line under the frame, where input is echoed"""
+
+        return f"\033[{len(frame) + 1};1H"
+
+class RemoteRenderer(TerminalRenderer):
+    def __init__(self, stream, width: int = 80, height: int = 24, differential: bool = True):
+        """Draws frames to a terminal on the other end of a connection, which has a fixed size
+
+        Args:
+            stream: Where to write to, needs write and flush
+            width (int, optional): Width frames are made for. Defaults to 80.
+            height (int, optional): Height frames are made for. Defaults to 24.
+            differential (bool, optional): Only send the cells that changed since the last frame. Defaults to True.
+        """
+
+        super().__init__(stream, differential)
+
+        self.size = (width, height)
+
+    def getSize(self) -> tuple[int, int]:
+        return self.size
+
+    def waitForResize(self) -> None:
+        """The size never changes, so waiting would never end"""
+
+        raise TerminalTooSmallException(f"The room doesn't fit into {self.size[0]}x{self.size[1]}.")
+
+    async def waitForResizeAsync(self) -> None:
+        self.waitForResize()
+
+# --------------------------------------
+# HEADLESS SINKS
+# --------------------------------------
+# Used instead of a TerminalRenderer when there is no terminal. They have a fixed size and never write anywhere.
+ANSI_ESCAPE = re.compile(r"\033\[[0-9;]*[A-Za-z]")
+
+class NullSink:
+    def __init__(self, width: int = 80, height: int = 24):
+        """Throws every frame away
+
+        Args:
+            width (int, optional): Width frames are made for. Defaults to 80.
+            height (int, optional): Height frames are made for. Defaults to 24.
+        """
+
+        self.size = (width, height)
+
+        # Metrics
+        self.frames = 0
+        self.full_repaints = 0
+        self.last_frame_bytes = 0
+        self.total_bytes = 0
+
+    def getSize(self) -> tuple[int, int]:
+        return self.size
+
+    def waitForResize(self) -> None:
+        """The size never changes, so waiting would never end"""
+
+        raise TerminalTooSmallException(f"The room doesn't fit into {self.size[0]}x{self.size[1]}.")
+
+    async def waitForResizeAsync(self) -> None:
+        self.waitForResize()
+
+    def invalidate(self) -> None:
+        pass
+
+    def write(self, text: str) -> None:
+        pass
+
+    def draw(self, frame: list[list[str]]) -> int:
+        self.frames += 1
+        return 0
+
+class FrameSink(NullSink):
+    def __init__(self, width: int = 80, height: int = 24, messages: int = 100):
+        """Keeps the last frame and the last messages in memory
+
+        Args:
+            width (int, optional): Width frames are made for. Defaults to 80.
+            height (int, optional): Height frames are made for. Defaults to 24.
+            messages (int, optional): Amount of messages to keep. Defaults to 100.
+        """
+
+        super().__init__(width, height)
+
+        self.frame = None
+        self.messages = deque(maxlen=messages)
+
+    def write(self, text: str) -> None:
+        self.messages.append(text)
+
+    def draw(self, frame: list[list[str]]) -> int:
+        self.frame = frame
+        self.frames += 1
+        return 0
+
+    def text(self) -> str:
+        """Returns the last frame as plain text, without colors"""
+
+        if self.frame is None: return ""
+
+        return "\n".join(ANSI_ESCAPE.sub("", "".join(row)) for row in self.frame)
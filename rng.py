@@ -0,0 +1,102 @@
+import os
+import random
+import hashlib
+from bisect import bisect_right
+
+# --------------------------------------
+# WEIGHTED POOLS
+# --------------------------------------
+class WeightedPool:
+    def __init__(self, options: dict = None):
+        """Options to pick from by weight. Weights can be any positive number, options with a weight of 0 or less are never picked
+
+        Args:
+            options (dict, optional): Option -> weight. Defaults to an empty pool.
+        """
+
+        self.options = []
+        self.cumulative = [] # Sum of the weights up to and including every option
+        self.total = 0
+
+        for option, weight in (options or {}).items(): self.add(option, weight)
+
+    def add(self, option, weight: int | float) -> None:
+        """Adds an option. Adding the same option again adds to its chance"""
+
+        if type(weight) not in (int, float, bool): raise TypeError(f"Weight of '{option}' must be a number, got '{weight}'")
+        if weight <= 0: return
+
+        self.total += weight
+        self.options.append(option)
+        self.cumulative.append(self.total)
+
+    def choose(self, rng: random.Random) -> any:
+        """Picks an option, in O(log n) of the amount of options
+
+        Raises:
+            IndexError: The pool is empty
+        """
+
+        if not self.options: raise IndexError("Cannot choose from an empty pool")
+
+        idx = bisect_right(self.cumulative, rng.random() * self.total)
+        return self.options[min(idx, len(self.options) - 1)] # random() * total can round up to total
+
+    def copy(self) -> "WeightedPool":
+        pool = WeightedPool()
+        pool.options = list(self.options)
+        pool.cumulative = list(self.cumulative)
+        pool.total = self.total
+
+        return pool
+
+    def __len__(self):
+        return len(self.options)
+
+# --------------------------------------
+# RANDOM STREAMS
+# --------------------------------------
+# Every engine has its own streams instead of using the random module, so games running in one process don't affect
+# each other. Streams are derived from one seed by name, so using one stream more often doesn't change what another
+# stream returns. The "world" stream picks rooms for random generators, scripts can ask for their own streams.
+
+class RandomStreams:
+    def __init__(self, seed: int = None):
+        """Named random streams derived from one seed
+
+        Args:
+            seed (int, optional): The seed. Defaults to a new random seed.
+        """
+
+        self.seed = seed if seed is not None else int.from_bytes(os.urandom(8), "big")
+        self.streams = {}
+        self.changed = False # A stream was used since the last save
+
+    def stream(self, name: str) -> random.Random:
+        """Returns a stream, creating it if needed. It is seeded from the seed and its name"""
+
+        self.changed = True
+
+        rng = self.streams.get(name, None)
+        if rng is None:
+            digest = hashlib.sha256(f"{self.seed}:{name}".encode()).digest()
+            rng = self.streams[name] = random.Random(int.from_bytes(digest[:8], "big"))
+
+        return rng
+
+    def state(self) -> dict:
+        """Returns the seed and the state of every stream, in a form that can be written as json"""
+
+        return {"seed": self.seed, "streams": {name: rng.getstate() for name, rng in self.streams.items()}}
+
+    @classmethod
+    def fromState(cls, state: dict) -> "RandomStreams":
+        """Restores streams from RandomStreams.state, every stream continues where it was"""
+
+        streams = cls(state["seed"])
+
+        for name, (version, internal, gauss) in state["streams"].items():
+            rng = streams.streams[name] = random.Random()
+            rng.setstate((version, tuple(internal), gauss))
+
+        return streams
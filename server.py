@@ -0,0 +1,480 @@
+import os
+import re
+import time
+import pickle
+import socket
+import asyncio
+import argparse
+import itertools
+import threading
+import multiprocessing
+from multiprocessing import reduction, shared_memory
+import engine
+from gameloop import GameLoop, QueueKeyReader
+from inputs import ScriptedInput
+from renderer import NullSink, RemoteRenderer
+from static import PROMPT_ANSWERS_HEADLESS, SERVER_HOST, SERVER_PORT, SERVER_TERMINAL_SIZE, SERVER_MAX_SESSIONS, SERVER_WORKERS, SERVER_REPORT_INTERVAL
+
+# --------------------------------------
+# EXCEPTIONS
+# --------------------------------------
+class ScriptsNotSupportedException(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+# --------------------------------------
+# CONNECTIONS
+# --------------------------------------
+# Players connect with telnet or netcat and send one command per line, like ScriptedInput takes them: a single
+# character is a key press (w/a/s/d), anything longer is typed out, and an empty line is enter.
+
+TELNET_COMMAND = re.compile(rb"\xff[\xfb-\xfe].|\xff[\xf0-\xfa]", re.DOTALL) # IAC WILL/WONT/DO/DONT <option>, or IAC <command>
+
+class ConnectionStream:
+    def __init__(self, writer: asyncio.StreamWriter):
+        """The stream a RemoteRenderer writes to. Sends telnet line endings, the event loop sends what was written while it waits for input"""
+
+        self.writer = writer
+
+    def write(self, text: str) -> None:
+        if self.writer.is_closing(): return
+
+        self.writer.write(text.replace("\r\n", "\n").replace("\n", "\r\n").encode())
+
+    def flush(self) -> None:
+        pass
+
+class Session:
+    __slots__ = ("name", "engine", "game_loop", "reader", "started", "commands")
+
+    def __init__(self, name: str, engine, game_loop: GameLoop, reader: QueueKeyReader):
+        self.name = name
+        self.engine = engine
+        self.game_loop = game_loop
+        self.reader = reader
+        self.started = time.time()
+        self.commands = 0
+
+# --------------------------------------
+# SERVER
+# --------------------------------------
+def loadSharedWorld(search_dir: str, world_name: str, start_room: str) -> engine.SharedWorld:
+    """Loads a world for sessions to attach to
+
+    Raises:
+        ScriptsNotSupportedException: The world has custom scripts, they are bound to a single engine
+        RoomNotFoundException: The start room doesn't exist
+    """
+
+    if os.path.isdir(os.path.join(search_dir, world_name, "scripts")): raise ScriptsNotSupportedException(f"The world '{world_name}' has custom scripts, which can't be shared between players.")
+
+    base = engine.PSEngine(search_dir, ScriptedInput([]), NullSink(), PROMPT_ANSWERS_HEADLESS, _debug_flags_neverload=True, _debug_flags_skipsplash=True)
+    base.loadWorld(world_name)
+    base.findRoomByID(start_room) # Fail now instead of on the first connection
+
+    return base.shareWorld()
+
+class GameServer:
+    def __init__(self, search_dir: str = ".", world_name: str = "Demo World", start_room: str = "starter_room", host: str = SERVER_HOST, port: int = SERVER_PORT,
+                 size: tuple = SERVER_TERMINAL_SIZE, max_sessions: int = SERVER_MAX_SESSIONS, world: engine.SharedWorld = None, session_prefix: str = "session"):
+        """Lets many players play one world over TCP. The world is loaded once and shared, every session only copies the rooms it enters or changes, see PSEngine.attachWorld
+
+        Args:
+            search_dir (str, optional): Folder to look for worlds in. Defaults to ".".
+            world_name (str, optional): The world. Defaults to "Demo World".
+            start_room (str, optional): ID of the room new players spawn in. Defaults to "starter_room".
+            host (str, optional): Address to listen on. Defaults to SERVER_HOST.
+            port (int, optional): Port to listen on, 0 picks a free one. Defaults to SERVER_PORT.
+            size (tuple, optional): Width and height of the frames sent to players. Defaults to SERVER_TERMINAL_SIZE.
+            max_sessions (int, optional): Players let in at once. Defaults to SERVER_MAX_SESSIONS.
+            world (SharedWorld, optional): The world, already loaded. Defaults to loading it with loadSharedWorld.
+            session_prefix (str, optional): Session names are this and a number, they are also the save slots. Defaults to "session".
+
+        Raises:
+            ScriptsNotSupportedException: The world has custom scripts, they are bound to a single engine
+        """
+
+        self.search_dir = search_dir
+        self.world_name = world_name
+        self.start_room = start_room
+        self.host = host
+        self.port = port
+        self.size = size
+        self.max_sessions = max_sessions
+        self.sessions = {} # Name -> Session
+        self.server = None # asyncio.Server, while serving
+        self.session_prefix = session_prefix
+        self.connections = 0 # Sessions started
+        self.commands = 0 # Lines received from every session
+        self.__names = itertools.count(1)
+
+        self.world = world if world is not None else loadSharedWorld(search_dir, world_name, start_room)
+
+    async def start(self) -> None:
+        """Starts listening. The port is known after this, if 0 was given"""
+
+        self.server = await asyncio.start_server(self.handleConnection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def serve(self) -> None:
+        """Listens until cancelled"""
+
+        if self.server is None: await self.start()
+
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self) -> None:
+        """Stops listening and ends every session"""
+
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+        for session in list(self.sessions.values()): session.reader.close()
+
+    def stats(self) -> dict:
+        """Returns the amount of sessions, commands and rooms the sessions copied"""
+
+        return {
+            "sessions": len(self.sessions),
+            "max_sessions": self.max_sessions,
+            "connections": self.connections,
+            "commands": self.commands,
+            "shared_rooms": len(self.world.rooms),
+            "copied_rooms": sum(session.engine.stats()["rooms"]["copied"] for session in self.sessions.values())
+        }
+
+    def newSession(self, renderer) -> Session:
+        """Creates a session on the shared world, with the player spawned in the start room
+
+        Args:
+            renderer: Where the frames of the session go
+
+        Returns:
+            Session: The session, start its game_loop to play it
+        """
+
+        name = f"{self.session_prefix}{next(self.__names)}"
+
+        session_engine = engine.PSEngine(self.search_dir, ScriptedInput([]), renderer, PROMPT_ANSWERS_HEADLESS, _debug_flags_neverload=True, _debug_flags_skipsplash=True)
+        session_engine.attachWorld(self.world)
+        session_engine.save_slot = name
+        session_engine.changeRoom(self.start_room)
+        session_engine.spawnPlayerAtRoot()
+
+        reader = QueueKeyReader()
+        return Session(name, session_engine, GameLoop(session_engine, reader), reader)
+
+    async def handleConnection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Plays a session over a connection until the player quits or disconnects"""
+
+        if len(self.sessions) >= self.max_sessions:
+            writer.write(b"The server is full, try again later.\r\n")
+            writer.close()
+            return
+
+        session = self.newSession(RemoteRenderer(ConnectionStream(writer), *self.size))
+        self.sessions[session.name] = session
+        self.connections += 1
+
+        play = asyncio.create_task(self.__play(session, writer))
+        try:
+            while not play.done():
+                line = await reader.readline()
+                if not line: break
+
+                line = TELNET_COMMAND.sub(b"", line).decode(errors="ignore").strip("\r\n")
+                session.commands += 1
+                self.commands += 1
+                session.reader.put(line if line else "\r")
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            session.reader.close()
+            await asyncio.gather(play, return_exceptions=True)
+            del self.sessions[session.name]
+
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def __play(self, session, writer):
+        try:
+            await session.game_loop.run()
+        except engine.GameQuitException:
+            pass
+        except engine.PlayerDiedException:
+            writer.write(b"\r\nYou died.\r\n")
+        except Exception as e: # One broken session must not take the others down
+            writer.write(f"\r\nThe game ended with an error: {e}\r\n".encode(errors="ignore"))
+
+        writer.close() # Ends the read loop of the connection
+
+# --------------------------------------
+# WORKER PROCESSES
+# --------------------------------------
+# The supervisor accepts every connection and hands the socket to the least loaded worker, which plays the session with
+# a GameServer of its own. The world is pickled once into shared memory, workers unpickle it from there instead of
+# loading the world files again. Workers send their stats to the supervisor every SERVER_REPORT_INTERVAL seconds.
+
+class WorldSnapshot:
+    def __init__(self, world: engine.SharedWorld):
+        """A shared world pickled into shared memory, for worker processes to load with WorldSnapshot.load"""
+
+        data = pickle.dumps(world, pickle.HIGHEST_PROTOCOL)
+
+        self.memory = shared_memory.SharedMemory(create=True, size=len(data))
+        self.memory.buf[:len(data)] = data
+        self.name = self.memory.name
+        self.size = len(data)
+
+    @staticmethod
+    def load(name: str, size: int) -> engine.SharedWorld:
+        """Unpickles a snapshot another process made"""
+
+        memory = shared_memory.SharedMemory(name=name)
+        try:
+            return pickle.loads(memory.buf[:size])
+        finally:
+            memory.close()
+
+    def close(self) -> None:
+        self.memory.close()
+        self.memory.unlink()
+
+def sendSocket(connection, sock: socket.socket, pid: int) -> None:
+    """Hands a socket to another process over a multiprocessing connection, receive it with receiveSocket"""
+
+    if os.name == "nt":
+        connection.send(("socket", sock.share(pid)))
+    else:
+        connection.send(("socket", None))
+        reduction.send_handle(connection, sock.fileno(), pid)
+
+def receiveSocket(connection) -> socket.socket | None:
+    """Returns the next socket from sendSocket, or None once the supervisor stops the worker"""
+
+    kind, data = connection.recv()
+    if kind != "socket": return None
+
+    if os.name == "nt": return socket.fromshare(data)
+    return socket.socket(fileno=reduction.recv_handle(connection))
+
+class Worker:
+    __slots__ = ("number", "process", "connection", "routed", "report", "report_time", "commands_per_second")
+
+    def __init__(self, number: int, process, connection):
+        self.number = number
+        self.process = process
+        self.connection = connection # The supervisor end of the pipe sockets are sent through
+        self.routed = 0 # Sockets sent to the worker
+        self.report = {} # The last stats it sent
+        self.report_time = None
+        self.commands_per_second = 0.0
+
+    def load(self) -> int:
+        """Sessions it has, counting the ones sent to it since its last report"""
+
+        return self.report.get("sessions", 0) + self.routed - self.report.get("received", 0)
+
+def runWorker(number: int, snapshot: tuple, settings: dict, connection, reports) -> None:
+    """Entry point of the worker processes of Supervisor"""
+
+    world = WorldSnapshot.load(*snapshot)
+    server = GameServer(world=world, session_prefix=f"worker{number}-session", **settings)
+
+    try:
+        asyncio.run(workerMain(number, server, connection, reports))
+    except KeyboardInterrupt: # The supervisor gets it too, and stops the workers
+        pass
+
+async def workerMain(number: int, server: GameServer, connection, reports) -> None:
+    loop = asyncio.get_running_loop()
+    received = 0
+    sessions = set()
+
+    def report():
+        reports.put((number, {"pid": os.getpid(), "received": received, **server.stats()}))
+
+    async def reportEvery():
+        while True:
+            report()
+            await asyncio.sleep(SERVER_REPORT_INTERVAL)
+
+    reporter = asyncio.create_task(reportEvery())
+    try:
+        while (sock := await loop.run_in_executor(None, receiveSocket, connection)) is not None:
+            received += 1
+
+            reader, writer = await asyncio.open_connection(sock=sock)
+            task = asyncio.create_task(server.handleConnection(reader, writer))
+            sessions.add(task)
+            task.add_done_callback(sessions.discard)
+    finally:
+        reporter.cancel()
+        await server.close()
+        await asyncio.gather(*sessions, return_exceptions=True)
+        report()
+
+class Supervisor:
+    def __init__(self, search_dir: str = ".", world_name: str = "Demo World", start_room: str = "starter_room", host: str = SERVER_HOST, port: int = SERVER_PORT,
+                 workers: int = SERVER_WORKERS, size: tuple = SERVER_TERMINAL_SIZE, max_sessions: int = SERVER_MAX_SESSIONS):
+        """Serves a world like GameServer, from several worker processes so sessions can use every core
+
+        Args:
+            search_dir (str, optional): Folder to look for worlds in. Defaults to ".".
+            world_name (str, optional): The world. Defaults to "Demo World".
+            start_room (str, optional): ID of the room new players spawn in. Defaults to "starter_room".
+            host (str, optional): Address to listen on. Defaults to SERVER_HOST.
+            port (int, optional): Port to listen on, 0 picks a free one. Defaults to SERVER_PORT.
+            workers (int, optional): Worker processes. Defaults to SERVER_WORKERS.
+            size (tuple, optional): Width and height of the frames sent to players. Defaults to SERVER_TERMINAL_SIZE.
+            max_sessions (int, optional): Players every worker lets in at once. Defaults to SERVER_MAX_SESSIONS.
+
+        Raises:
+            ScriptsNotSupportedException: The world has custom scripts, they are bound to a single engine
+        """
+
+        self.host = host
+        self.port = port
+        self.worker_count = workers or os.cpu_count() or 1
+        self.settings = {"search_dir": search_dir, "world_name": world_name, "start_room": start_room, "size": size, "max_sessions": max_sessions}
+        self.workers = []
+        self.listener = None
+        self.snapshot = WorldSnapshot(loadSharedWorld(search_dir, world_name, start_room))
+        self.__context = multiprocessing.get_context("spawn") # Workers get the world from the snapshot, not from a copy of this process
+        self.__reports = self.__context.Queue()
+        self.__collector = None
+
+    def start(self) -> None:
+        """Starts the workers and starts listening. The port is known after this, if 0 was given"""
+
+        for number in range(self.worker_count):
+            connection, child = self.__context.Pipe()
+            process = self.__context.Process(target=runWorker, args=(number, (self.snapshot.name, self.snapshot.size), self.settings, child, self.__reports), name=f"pse-worker{number}", daemon=True)
+            process.start()
+            child.close()
+
+            self.workers.append(Worker(number, process, connection))
+
+        self.__collector = threading.Thread(target=self.__collect, name="pse-reports", daemon=True)
+        self.__collector.start()
+
+        self.listener = socket.create_server((self.host, self.port))
+        self.listener.setblocking(False)
+        self.port = self.listener.getsockname()[1]
+
+    async def serve(self) -> None:
+        """Hands connections to the workers until cancelled"""
+
+        if self.listener is None: self.start()
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            sock, _ = await loop.sock_accept(self.listener)
+
+            with sock:
+                alive = [worker for worker in self.workers if worker.process.is_alive()]
+                if not alive:
+                    await loop.sock_sendall(sock, b"The server is not running, try again later.\r\n")
+                    continue
+
+                worker = min(alive, key=Worker.load)
+                try:
+                    sendSocket(worker.connection, sock, worker.process.pid)
+                    worker.routed += 1
+                except OSError: # The worker just died, the next connection goes to another one
+                    pass
+
+    def close(self) -> None:
+        """Stops listening and stops the workers, after their sessions end"""
+
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+
+        for worker in self.workers:
+            try:
+                worker.connection.send(("stop", None))
+            except OSError:
+                pass
+
+        for worker in self.workers:
+            worker.process.join(5)
+            if worker.process.is_alive(): worker.process.terminate()
+
+        self.__reports.put(None)
+        self.snapshot.close()
+
+    def stats(self) -> dict:
+        """Returns the stats every worker last sent, with how many commands per second its sessions send"""
+
+        workers = []
+        for worker in self.workers:
+            workers.append({
+                "worker": worker.number,
+                "alive": worker.process.is_alive(),
+                "routed": worker.routed,
+                "load": worker.load(),
+                "commands_per_second": worker.commands_per_second,
+                **worker.report
+            })
+
+        return {
+            "workers": workers,
+            "sessions": sum(worker.report.get("sessions", 0) for worker in self.workers),
+            "snapshot_bytes": self.snapshot.size
+        }
+
+    def __collect(self):
+        while (report := self.__reports.get()) is not None:
+            number, data = report
+            worker = self.workers[number]
+            now = time.monotonic()
+
+            if worker.report_time is not None and now > worker.report_time:
+                worker.commands_per_second = (data["commands"] - worker.report.get("commands", 0)) / (now - worker.report_time)
+
+            worker.report = data
+            worker.report_time = now
+
+# --------------------------------------
+# MAIN
+# --------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves a world to many players over TCP. Connect with telnet or netcat.")
+    parser.add_argument("world", nargs="?", default="Demo World", help="The world folder")
+    parser.add_argument("--search-dir", default=".", help="Folder to look for worlds in")
+    parser.add_argument("--start-room", default="starter_room", help="ID of the room players spawn in")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--max-sessions", type=int, default=SERVER_MAX_SESSIONS, help="Players let in at once, per worker with --workers")
+    parser.add_argument("--workers", type=int, nargs="?", const=0, default=None, help="Play sessions in this many worker processes, every core if no amount is given")
+    args = parser.parse_args()
+
+    if args.workers is None:
+        server = GameServer(args.search_dir, args.world, args.start_room, args.host, args.port, max_sessions=args.max_sessions)
+    else:
+        server = Supervisor(args.search_dir, args.world, args.start_room, args.host, args.port, args.workers or SERVER_WORKERS, max_sessions=args.max_sessions)
+
+    async def main():
+        # Bind first, so the port printed is the real one when 0 was given
+        if isinstance(server, Supervisor):
+            server.start()
+        else:
+            await server.start()
+
+        print(f"Serving '{args.world}' on {args.host}:{server.port}")
+        await server.serve()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if isinstance(server, Supervisor): server.close()
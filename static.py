@@ -36,7 +36,7 @@ class dotdict(dict):
     __setattr__ = dict.__setitem__
     __delattr__ = dict.__delitem__
 
-UPDATE_FILES = {"engine.py": "https://raw.githubusercontent.com/GabbaTK/Procedural-Story-Engine/refs/heads/main/engine.py", "builtin.json": "https://raw.githubusercontent.com/GabbaTK/Procedural-Story-Engine/refs/heads/main/builtin.json", "static.py": "https://raw.githubusercontent.com/GabbaTK/Procedural-Story-Engine/refs/heads/main/static.py"}
+UPDATE_FILES = {"engine.py": "https://raw.githubusercontent.com/GabbaTK/Procedural-Story-Engine/refs/heads/main/engine.py", "builtin.json": "https://raw.githubusercontent.com/GabbaTK/Procedural-Story-Engine/refs/heads/main/builtin.json", "static.py": "https://raw.githubusercontent.com/GabbaTK/Procedural-Story-Engine/refs/heads/main/static.py", "renderer.py": "https://raw.githubusercontent.com/GabbaTK/Procedural-Story-Engine/refs/heads/main/renderer.py", "cache.py": "https://raw.githubusercontent.com/GabbaTK/Procedural-Story-Engine/refs/heads/main/cache.py", "inputs.py": "https://raw.githubusercontent.com/GabbaTK/Procedural-Story-Engine/refs/heads/main/inputs.py", "instrumentation.py": "https://raw.githubusercontent.com/GabbaTK/Procedural-Story-Engine/refs/heads/main/instrumentation.py", "models.py": "https://raw.githubusercontent.com/GabbaTK/Procedural-Story-Engine/refs/heads/main/models.py", "rng.py": "https://raw.githubusercontent.com/GabbaTK/Procedural-Story-Engine/refs/heads/main/rng.py", "hooks.py": "https://raw.githubusercontent.com/GabbaTK/Procedural-Story-Engine/refs/heads/main/hooks.py", "gameloop.py": "https://raw.githubusercontent.com/GabbaTK/Procedural-Story-Engine/refs/heads/main/gameloop.py", "server.py": "https://raw.githubusercontent.com/GabbaTK/Procedural-Story-Engine/refs/heads/main/server.py"}
 VERSION_URL = "https://raw.githubusercontent.com/GabbaTK/Procedural-Story-Engine/refs/heads/main/static.py"
 VERSION_REGEX = r'VERSION = "\d+\.\d+.\d+"'
 VERSION = "0.8.3"
@@ -90,6 +90,30 @@ Better luck next time!
 # CONFIG
 # --------------------------------------
 MIN_TERM_WIDTH = 50 # Random value
+DIFFERENTIAL_RENDERING = True # Only redraw what changed between frames. Set to False if your terminal doesn't support cursor movement
+TEMPLATE_CACHE_SIZE = 1024 # Amount of compiled templates to keep
+LAZY_ROOM_LOADING = True # Only load rooms when they are first needed. Set to False to load every room when the world is loaded
+PREFETCH_ROOMS = True # Load the rooms the current room can lead to in the background
+ROOM_MANIFEST_FILE = "manifest.json" # Where in the world folder to cache which file every room is in
+WORLD_CACHE = True # Keep parsed worlds between runs, so unchanged files aren't parsed again
+WORLD_CACHE_DIR = "__psecache__" # Folder in the engine folder to keep the world cache in
+PARALLEL_PARSE_THRESHOLD = 64 # Parse rooms across worker processes when loading at least this many rooms at once
+PARALLEL_PARSE_WORKERS = None # Amount of worker processes, None to use every core. Set to 1 to always parse in this process
+PROMPT_ANSWERS_HEADLESS = {"load_save": "n", "custom_scripts": "n", "continue": "", "died": ""} # Prompt answers to use when there is nobody to answer them. Set custom_scripts to "y" to run worlds with scripts
+DEFAULT_SAVE_SLOT = "Latest" # Save slot used until another one is loaded or saved to
+SAVE_JOURNAL_LIMIT = 32 # Saves appended to the journal before it is compacted into a full snapshot
+RANDOM_SEED = None # Seed of the random streams of new games, set it to make random generators pick the same rooms every game. None picks a new seed every game
+INSTRUMENTATION = False # Count and time the hot paths from the start, see PSEngine.stats. Instrumentation can also be enabled with PSEngine.enableInstrumentation
+INSTRUMENTATION_SNAPSHOT_FILE = None # Write PSEngine.stats to this JSON file every INSTRUMENTATION_SNAPSHOT_INTERVAL seconds while instrumentation is enabled
+INSTRUMENTATION_SNAPSHOT_INTERVAL = 10 # Seconds
+HOOK_TIME_BUDGET = None # Milliseconds, warn when a world script hook takes longer. None never warns
+AUTOSAVE_INTERVAL = None # Seconds between saves while the game runs on gameloop.GameLoop. None only saves when the player does
+SERVER_HOST = "127.0.0.1" # Address server.py listens on. Only this computer can connect, use "0.0.0.0" to let others in
+SERVER_PORT = 4000 # Port server.py listens on
+SERVER_TERMINAL_SIZE = (80, 24) # Width and height of the frames sent to players of server.py
+SERVER_MAX_SESSIONS = 500 # Players server.py lets in at once, per worker process when it runs with --workers
+SERVER_WORKERS = None # Worker processes of server.py --workers when no amount is given. None uses every core
+SERVER_REPORT_INTERVAL = 1 # Seconds between the stats every worker process sends to the supervisor
 ENTITIES = ["chest", "spawn_point"] # Required for "findEntityFromTemplate"
 USER_BASIC_MOVEMENT = ["w", "a", "s", "d"] # Movement
 USER_ADVANCED_MOVEMENT = ["inspect", "open", "close", "lock", "unlock", "gather", "leave", "pickup"] # Actions for entities